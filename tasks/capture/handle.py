@@ -0,0 +1,215 @@
+"""
+Handles of the capture processes started in the background and their graceful shutdown.
+"""
+import os
+import re
+import signal
+import time
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from netunicorn.base import Failure, Result, Success
+from netunicorn.library.tasks.capture.profiles import CaptureProfile
+
+LOG_SUFFIX = ".log"  # output of the capture tool is written to <filepath>.log
+
+_CAPTURED = re.compile(r"^\s*(\d+) packets? captured", re.MULTILINE)
+_RECEIVED = re.compile(r"^\s*(\d+) packets? received by filter", re.MULTILINE)
+_DROPPED = re.compile(r"^\s*(\d+) packets? dropped by kernel", re.MULTILINE)
+# tshark: "12 packets dropped from eth0", printed for each interface only if there were drops
+_DROPPED_FROM = re.compile(r"^\s*(\d+) packets? dropped(?: from .*)?$", re.MULTILINE)
+# dumpcap: "Packets received/dropped on interface 'eth0': 100/2 (pcap:2/...)"
+_INTERFACE = re.compile(
+    r"received/dropped on interface '[^']*': (\d+)/(\d+)(?: \(pcap:(\d+))?"
+)
+
+
+@dataclass
+class CaptureHandle:
+    """
+    Result of the tasks that start a capture in the background.
+    """
+
+    pid: int
+    filepath: str
+    profile: Optional[CaptureProfile] = None
+    nominal_sampling_rate: float = 1.0  # see `CaptureProfile.nominal_sampling_rate`
+    log_path: Optional[str] = None  # output of the capture tool
+
+
+@dataclass
+class CaptureStatistics:
+    """
+    Counters reported by the capture tool when it exits, None if not reported.
+    """
+
+    captured: Optional[int]  # packets written to the capture
+    received: Optional[int]  # packets received by the filter, including dropped ones
+    dropped: Optional[int]  # packets dropped by the kernel because the buffer was full
+    killed: bool  # the tool did not exit in time and was killed, the capture may be truncated
+
+    @property
+    def drop_rate(self) -> Optional[float]:
+        if self.dropped is None or self.received is None:
+            return None
+        return self.dropped / self.received if self.received else 0.0
+
+
+def capture_pid(handle: Any) -> int:
+    """
+    Returns the pid from a `CaptureHandle` or a pid returned by the capture tasks.
+    """
+    return getattr(handle, "pid", handle)
+
+
+def parse_capture_statistics(text: str, killed: bool = False) -> CaptureStatistics:
+    """
+    Parses the counters printed by tcpdump or tshark on exit.
+    """
+    captured = received = dropped = None
+    if match := _CAPTURED.search(text):
+        captured = int(match[1])
+    if match := _RECEIVED.search(text):
+        received = int(match[1])
+    if match := _DROPPED.search(text):
+        dropped = int(match[1])
+    if interfaces := _INTERFACE.findall(text):
+        received = sum(int(x[0]) for x in interfaces)
+        dropped = sum(int(x[2] or x[1]) for x in interfaces)
+    elif captured is not None and received is None and dropped is None:
+        # tshark does not report received packets, dropped ones were not captured
+        dropped = sum(int(x) for x in _DROPPED_FROM.findall(text))
+        received = captured + dropped
+    return CaptureStatistics(captured, received, dropped, killed)
+
+
+def wait_for_exit(pid: int, timeout: float) -> bool:
+    """
+    Waits until the process exits, returns False if it is still running after `timeout` seconds.
+    """
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                return True
+        except ChildProcessError:
+            # not a child of this process or already reaped (e.g., SIGCHLD is ignored)
+            if not _running(pid):
+                return True
+        if time.monotonic() >= deadline:
+            return False
+        time.sleep(0.05)
+
+
+def exit_status(pid: int) -> Optional[str]:
+    """
+    Returns the exit status of the process if it exited (reaping it), None if it is still running.
+    """
+    try:
+        reaped, status = os.waitpid(pid, os.WNOHANG)
+    except ChildProcessError:
+        # not a child of this process or already reaped (e.g., SIGCHLD is ignored)
+        return None if _running(pid) else "unknown exit status"
+    if not reaped:
+        return None
+    if os.WIFSIGNALED(status):
+        return f"killed by signal {os.WTERMSIG(status)}"
+    return f"exit code {os.WEXITSTATUS(status)}"
+
+
+def _running(pid: int) -> bool:
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # a zombie has exited already, but cannot be reaped by this process
+            return f.read().rsplit(")", 1)[1].split()[0] != "Z"
+    except (FileNotFoundError, ProcessLookupError):
+        return False
+
+
+def stop_capture(handle: Any, timeout: float) -> Result[CaptureStatistics, str]:
+    """
+    Interrupts the capture process so that it flushes the capture and reports its counters,
+    waits for it to exit (killing it after `timeout` seconds) and returns the counters.
+    """
+    pid = capture_pid(handle)
+    log_path = getattr(handle, "log_path", None)
+    if log_path is None:
+        # the capture tasks write the output of the tool to <filepath>.log
+        try:
+            log_path = os.readlink(f"/proc/{pid}/fd/2")
+        except OSError:
+            pass
+    try:
+        os.kill(pid, signal.SIGINT)
+    except ProcessLookupError:
+        return Failure(f"Capture process {pid} is not running")
+
+    killed = not wait_for_exit(pid, timeout)
+    if killed:
+        os.kill(pid, signal.SIGKILL)
+        wait_for_exit(pid, 5)
+
+    text = ""
+    if log_path and log_path.endswith(LOG_SUFFIX) and os.path.exists(log_path):
+        with open(log_path, errors="replace") as f:
+            text = f.read()
+    return Success(parse_capture_statistics(text, killed))
+
+
+def stop_all_captures(program: str, timeout: float) -> Result[CaptureStatistics, str]:
+    """
+    Stops all processes of the capture tool (e.g., "tshark") like `stop_capture`
+    and returns the sums of their counters. The counters are read from the file the output
+    of each process is written to, so they are None for processes not started by these tasks.
+    """
+    pids = [
+        int(x)
+        for x in os.listdir("/proc")
+        if x.isdigit()
+        and int(x) != os.getpid()
+        and _command(int(x)) == program
+        and _running(int(x))
+    ]
+    if not pids:
+        return Failure(f"No {program} processes are running")
+
+    log_paths = {}
+    for pid in pids:
+        try:
+            log_paths[pid] = os.readlink(f"/proc/{pid}/fd/2")
+            os.kill(pid, signal.SIGINT)
+        except (OSError, ProcessLookupError):
+            continue
+
+    deadline = time.monotonic() + timeout
+    statistics = []
+    for pid, log_path in log_paths.items():
+        killed = not wait_for_exit(pid, max(0.0, deadline - time.monotonic()))
+        if killed:
+            os.kill(pid, signal.SIGKILL)
+            wait_for_exit(pid, 5)
+        text = ""
+        if log_path.endswith(LOG_SUFFIX) and os.path.exists(log_path):
+            with open(log_path, errors="replace") as f:
+                text = f.read()
+        statistics.append(parse_capture_statistics(text, killed))
+
+    def total(values: list[Optional[int]]) -> Optional[int]:
+        return None if None in values else sum(values)
+
+    return Success(
+        CaptureStatistics(
+            total([x.captured for x in statistics]),
+            total([x.received for x in statistics]),
+            total([x.dropped for x in statistics]),
+            any(x.killed for x in statistics),
+        )
+    )
+
+
+def _command(pid: int) -> Optional[str]:
+    try:
+        with open(f"/proc/{pid}/comm") as f:
+            return f.read().strip()
+    except OSError:
+        return None
@@ -0,0 +1,620 @@
+"""
+In-process capture that feeds packets to preprocessing extractors in real time.
+
+Packets are read from a memory-mapped AF_PACKET ring (TPACKET_V3) in a forked worker
+and passed to extractors (e.g., `FlowAggregator`, `PacketCounter`, `PacketSampler`)
+as they arrive, so summaries are available without writing and re-reading a capture file.
+The worker can also write the packets to a pcap file.
+"""
+import mmap
+import os
+import select
+import signal
+import socket
+import struct
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional, Union
+
+from netunicorn.base import (
+    Architecture,
+    Failure,
+    Node,
+    Result,
+    Success,
+    Task,
+    TaskDispatcher,
+)
+from netunicorn.library.tasks.capture.handle import exit_status, wait_for_exit
+from netunicorn.library.tasks.capture.profiles import CaptureProfile, resolve_profile
+from netunicorn.library.tasks.preprocessing import rawpcap
+from netunicorn.library.tasks.preprocessing.scapy import (
+    CallableExtractor,
+    Extractor,
+    _feed_records,
+)
+
+_ETH_P_ALL = 0x0003
+_SOL_PACKET = 263
+_SO_ATTACH_FILTER = 26
+_PACKET_RX_RING = 5
+_PACKET_STATISTICS = 6
+_PACKET_VERSION = 10
+_TPACKET_V3 = 2
+_TP_STATUS_KERNEL = 0
+_TP_STATUS_USER = 1
+_TP_STATUS_VLAN_VALID = 1 << 4
+_FRAME_SIZE = 1 << 11
+_BLOCK_SIZE = 1 << 20
+_BLOCK_TIMEOUT_MS = 100
+_ARPHRD_LOOPBACK = 772
+_PACKET_OUTGOING = 4
+_PKTTYPE_OFFSET = 58  # sll_pkttype of sockaddr_ll following the packet header
+_MAX_SNAPLEN = 1 << 18
+# flows tracked for `CaptureProfile.first_packets_per_flow`
+_MAX_FLOWS = 1 << 20
+_FLOW_IDLE_TIMEOUT = 120  # seconds
+_BPF_RET_K = 0x06
+# A = random 32-bit number (SKF_AD_OFF + SKF_AD_RANDOM), A %= k, if A == 0 go on, else drop
+_BPF_LOAD_RANDOM = (0x20, 0, 0, 0xFFFFF038)
+_BPF_MOD_K = 0x94
+_BPF_JEQ_K = 0x15
+
+# tp_next_offset, tp_sec, tp_nsec, tp_snaplen, tp_len, tp_status, tp_mac, tp_net,
+# tp_rxhash, tp_vlan_tci, tp_vlan_tpid
+_packet_header = struct.Struct("IIIIIIHHIIH").unpack_from
+_block_status = struct.Struct("I")
+_block_header = struct.Struct("II").unpack_from  # num_pkts, offset_to_first_pkt
+_pcap_record = struct.Struct("<IIII").pack
+
+_ETHERNET = rawpcap.LINKTYPE_ETHERNET
+_ARPHRD_LINKTYPES = {65534: rawpcap.LINKTYPE_RAW, 776: rawpcap.LINKTYPE_RAW}
+
+
+@dataclass
+class LiveCaptureHandle:
+    pid: int
+    interface: str
+    results_path: str  # where the worker writes results of the extractors
+    filepath: Optional[str]  # pcap file written by the worker
+    nominal_sampling_rate: float = 1.0  # see `CaptureProfile.nominal_sampling_rate`
+
+
+@dataclass
+class LiveCaptureResult:
+    results: list[Any]  # results of the extractors, in the given order
+    packets: int  # packets passed to the extractors
+    dropped: int  # packets dropped by the kernel because the ring was full
+    filepath: Optional[str]
+    # share of matching packets passed to the extractors after sampling in the kernel
+    # and skipping packets beyond the first ones of each flow
+    sampling_rate: float = 1.0
+
+
+class StartLiveCapture(TaskDispatcher):
+    def __init__(
+        self,
+        interface: str,
+        extractors: list[Union[Extractor, Callable[[Any], Any]]],
+        bpf: Optional[str] = None,
+        filepath: Optional[str] = None,
+        ring_size_mb: int = 64,
+        profile: Union[str, CaptureProfile, None] = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.linux_implementation = StartLiveCaptureLinuxImplementation(
+            interface=interface,
+            extractors=extractors,
+            bpf=bpf,
+            filepath=filepath,
+            ring_size_mb=ring_size_mb,
+            profile=profile,
+            *args,
+            **kwargs,
+        )
+
+    def dispatch(self, node: Node) -> Task:
+        if node.architecture in {Architecture.LINUX_AMD64, Architecture.LINUX_ARM64}:
+            return self.linux_implementation
+
+        raise NotImplementedError(
+            f"StartLiveCapture is not implemented for {node.architecture}"
+        )
+
+
+class StartLiveCaptureLinuxImplementation(Task):
+    """
+    Starts a worker process that captures packets on `interface` and feeds them
+    to the extractors, and returns `LiveCaptureHandle` once the capture is running.
+    Use `GetLiveCaptureResults` to get intermediate results and `StopLiveCapture`
+    to stop the capture and get the final results.
+
+    `bpf` is a capture filter in tcpdump syntax applied in the kernel (requires libpcap
+    to compile it). If `filepath` is set, packets are also written to this pcap file.
+    `profile` is a name from `profiles.PROFILES` or a `profiles.CaptureProfile`: its snaplen
+    and random 1-in-N sampling are applied in the kernel, its filter is combined with `bpf`,
+    and packets beyond the first ones of each flow are skipped before the extractors.
+    Requires root privileges (or CAP_NET_RAW).
+    """
+
+    def __init__(
+        self,
+        interface: str,
+        extractors: list[Union[Extractor, Callable[[Any], Any]]],
+        bpf: Optional[str] = None,
+        filepath: Optional[str] = None,
+        ring_size_mb: int = 64,
+        profile: Union[str, CaptureProfile, None] = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.interface = interface
+        self.extractors = [
+            x if isinstance(x, Extractor) else CallableExtractor(x) for x in extractors
+        ]
+        self.bpf = bpf
+        self.filepath = filepath
+        self.ring_size_mb = ring_size_mb
+        self.profile = resolve_profile(profile) or CaptureProfile()
+        if self.profile.bpf:
+            self.bpf = f"({bpf}) and ({self.profile.bpf})" if bpf else self.profile.bpf
+
+    def run(self) -> Result[LiveCaptureHandle, str]:
+        results_path = os.path.join(
+            tempfile.gettempdir(), f"live_capture_{os.getpid()}_{time.time_ns()}.pickle"
+        )
+        receiver, sender = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(receiver)
+            try:
+                _LiveCapture(self, results_path).run(sender)
+            finally:
+                os._exit(0)
+
+        os.close(sender)
+        with os.fdopen(receiver, "rb") as f:
+            status = f.read()  # the worker closes the pipe when the capture is running
+        if status:
+            wait_for_exit(pid, 5)
+            return Failure(f"Live capture failed to start: {status.decode()}")
+        return Success(
+            LiveCaptureHandle(
+                pid,
+                self.interface,
+                results_path,
+                self.filepath,
+                self.profile.nominal_sampling_rate,
+            )
+        )
+
+
+class _LiveCapture:
+    def __init__(self, task: StartLiveCaptureLinuxImplementation, results_path: str):
+        self.task = task
+        self.results_path = results_path
+        self.stopping = False
+        self.snapshot = False
+        self.packets = 0
+        self.dropped = 0
+        self.received = 0  # packets received from the kernel, before skipping flows
+        # flow key -> [packets, timestamp of the last packet], least recently seen first
+        self.flows: OrderedDict[tuple, list] = OrderedDict()
+
+    def run(self, ready: int) -> None:
+        import cloudpickle
+
+        try:
+            signal.signal(signal.SIGTERM, self._stop)
+            signal.signal(signal.SIGINT, self._stop)
+            signal.signal(signal.SIGUSR1, self._snapshot)
+            for extractor in self.task.extractors:
+                extractor.start()
+            sock, ring, blocks = self._open()
+            writer = self._open_writer()
+        except BaseException as e:
+            os.write(ready, repr(e).encode())
+            os.close(ready)
+            return
+        os.close(ready)
+
+        try:
+            with sock, ring:
+                records = self._records(sock, ring, blocks, writer)
+                _feed_records(self.task.extractors, records)
+                self._update_statistics(sock)
+            self._write_results()
+        except BaseException as e:
+            with open(self.results_path, "wb") as f:
+                cloudpickle.dump(e, f)
+        finally:
+            if writer is not None:
+                writer.close()
+
+    def _stop(self, *_) -> None:
+        self.stopping = True
+
+    def _snapshot(self, *_) -> None:
+        self.snapshot = True
+
+    def _open(self) -> tuple[socket.socket, mmap.mmap, int]:
+        sock = socket.socket(
+            socket.AF_PACKET, socket.SOCK_RAW, socket.htons(_ETH_P_ALL)
+        )
+        blocks = max(1, self.task.ring_size_mb * (1 << 20) // _BLOCK_SIZE)
+        sock.setsockopt(_SOL_PACKET, _PACKET_VERSION, _TPACKET_V3)
+        sock.setsockopt(
+            _SOL_PACKET,
+            _PACKET_RX_RING,
+            struct.pack(
+                "IIIIIII",
+                _BLOCK_SIZE,
+                blocks,
+                _FRAME_SIZE,
+                _BLOCK_SIZE * blocks // _FRAME_SIZE,
+                _BLOCK_TIMEOUT_MS,
+                0,
+                0,
+            ),
+        )
+        ring = mmap.mmap(sock.fileno(), _BLOCK_SIZE * blocks)
+        hardware_type = _hardware_type(self.task.interface)
+        self.linktype = _ARPHRD_LINKTYPES.get(hardware_type, _ETHERNET)
+        self.loopback = hardware_type == _ARPHRD_LOOPBACK
+        program = _kernel_program(self.task.bpf, self.task.profile, self.linktype)
+        if program is not None:
+            _attach_filter(sock, program)
+        sock.bind((self.task.interface, _ETH_P_ALL))
+        return sock, ring, blocks
+
+    def _open_writer(self):
+        if self.task.filepath is None:
+            return None
+        writer = open(self.task.filepath, "wb")
+        # nanosecond resolution pcap
+        writer.write(
+            struct.pack(
+                "<IHHiIII",
+                0xA1B23C4D,
+                2,
+                4,
+                0,
+                0,
+                self.task.profile.snaplen or _MAX_SNAPLEN,
+                self.linktype,
+            )
+        )
+        writer.flush()
+        return writer
+
+    def _records(
+        self, sock: socket.socket, ring: mmap.mmap, blocks: int, writer
+    ) -> Iterator[rawpcap.PcapRecord]:
+        poller = select.poll()
+        poller.register(sock, select.POLLIN | select.POLLERR)
+        linktype = self.linktype
+        loopback = self.loopback
+        first_packets = self.task.profile.first_packets_per_flow
+        block = 0
+        remaining = blocks  # blocks still processed after the stop signal
+        while remaining:
+            if self.snapshot:
+                self.snapshot = False
+                self._update_statistics(sock)
+                self._write_results(self.results_path + ".snapshot")
+            offset = block * _BLOCK_SIZE
+            if not _block_status.unpack_from(ring, offset + 8)[0] & _TP_STATUS_USER:
+                if self.stopping:
+                    return
+                poller.poll(_BLOCK_TIMEOUT_MS)
+                continue
+            if self.stopping:
+                remaining -= 1
+
+            packets, position = _block_header(ring, offset + 12)
+            position += offset
+            for _ in range(packets):
+                (
+                    next_offset,
+                    seconds,
+                    nanoseconds,
+                    snaplen,
+                    length,
+                    status,
+                    mac,
+                    _,
+                    _,
+                    vlan_tci,
+                    vlan_tpid,
+                ) = _packet_header(ring, position)
+                if loopback and ring[position + _PKTTYPE_OFFSET] == _PACKET_OUTGOING:
+                    # packets on loopback are seen twice, skip them as libpcap does
+                    position += next_offset
+                    continue
+                data = ring[position + mac : position + mac + snaplen]
+                position += next_offset
+                if status & _TP_STATUS_VLAN_VALID and linktype == _ETHERNET:
+                    # the kernel strips VLAN tags, put them back as libpcap does
+                    tag = struct.pack("!HH", vlan_tpid or 0x8100, vlan_tci)
+                    data = data[:12] + tag + data[12:]
+                    length += 4
+                record = rawpcap.PcapRecord(
+                    linktype, seconds + nanoseconds * 1e-9, length, data
+                )
+                self.received += 1
+                if first_packets and not self._first_in_flow(record, first_packets):
+                    continue
+                if writer is not None:
+                    writer.write(_pcap_record(seconds, nanoseconds, len(data), length))
+                    writer.write(data)
+                self.packets += 1
+                yield record
+
+            _block_status.pack_into(ring, offset + 8, _TP_STATUS_KERNEL)
+            block = (block + 1) % blocks
+            if writer is not None:
+                writer.flush()
+
+    def _first_in_flow(self, record: rawpcap.PcapRecord, limit: int) -> bool:
+        packet = rawpcap.decode(record)
+        if not packet.version:
+            return True
+        source, destination = (packet.src, packet.sport), (packet.dst, packet.dport)
+        key = (packet.proto,) + (
+            (source, destination) if source <= destination else (destination, source)
+        )
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = [0, record.timestamp]
+            self._evict_flows(record.timestamp)
+        else:
+            flow[1] = record.timestamp
+            self.flows.move_to_end(key)
+        if flow[0] >= limit:
+            return False
+        flow[0] += 1
+        return True
+
+    def _evict_flows(self, now: float) -> None:
+        # a flow idle for longer than the timeout starts again with its first packets
+        flows = self.flows
+        while len(flows) > _MAX_FLOWS or (
+            flows and next(iter(flows.values()))[1] < now - _FLOW_IDLE_TIMEOUT
+        ):
+            flows.popitem(last=False)
+
+    def _update_statistics(self, sock: socket.socket) -> None:
+        # counters are reset by each read
+        _, dropped, _ = struct.unpack(
+            "III", sock.getsockopt(_SOL_PACKET, _PACKET_STATISTICS, 12)
+        )
+        self.dropped += dropped
+
+    def _write_results(self, path: Optional[str] = None) -> None:
+        import cloudpickle
+
+        path = path or self.results_path
+        result = LiveCaptureResult(
+            results=[x.result() for x in self.task.extractors],
+            packets=self.packets,
+            dropped=self.dropped,
+            filepath=self.task.filepath,
+            sampling_rate=self.task.profile.nominal_sampling_rate
+            * (self.packets / self.received if self.received else 1.0),
+        )
+        with open(path + ".tmp", "wb") as f:
+            cloudpickle.dump(result, f)
+        os.replace(path + ".tmp", path)
+
+
+def _hardware_type(interface: str) -> int:
+    try:
+        with open(f"/sys/class/net/{interface}/type") as f:
+            return int(f.read())
+    except OSError:
+        return 1  # ARPHRD_ETHER
+
+
+def _kernel_program(
+    expression: Optional[str], profile: CaptureProfile, linktype: int
+) -> Optional[list[tuple[int, int, int, int]]]:
+    """
+    Builds the socket filter from the expression, the snaplen and the sampling of the profile.
+    """
+    from netunicorn.library.tasks.preprocessing import bpf
+
+    if expression is None and not profile.snaplen and not profile.sample_every:
+        return None
+    if expression is None:
+        program = [(_BPF_RET_K, 0, 0, _MAX_SNAPLEN)]
+    else:
+        program = bpf.compile_filter(expression, linktype)
+    if profile.snaplen:
+        program = [
+            (code, jt, jf, min(k, profile.snaplen) if code == _BPF_RET_K else k)
+            for code, jt, jf, k in program
+        ]
+    if profile.sample_every and profile.sample_every > 1:
+        program = [
+            _BPF_LOAD_RANDOM,
+            (_BPF_MOD_K, 0, 0, profile.sample_every),
+            (_BPF_JEQ_K, 1, 0, 0),
+            (_BPF_RET_K, 0, 0, 0),
+        ] + program
+    return program
+
+
+def _attach_filter(
+    sock: socket.socket, program: list[tuple[int, int, int, int]]
+) -> None:
+    import ctypes
+
+    class SockFilter(ctypes.Structure):
+        _fields_ = [
+            ("code", ctypes.c_uint16),
+            ("jt", ctypes.c_uint8),
+            ("jf", ctypes.c_uint8),
+            ("k", ctypes.c_uint32),
+        ]
+
+    class SockFprog(ctypes.Structure):
+        _fields_ = [("len", ctypes.c_uint16), ("filter", ctypes.POINTER(SockFilter))]
+
+    instructions = (SockFilter * len(program))(*program)
+    fprog = SockFprog(len(program), instructions)
+    sock.setsockopt(
+        socket.SOL_SOCKET,
+        _SO_ATTACH_FILTER,
+        ctypes.string_at(ctypes.addressof(fprog), ctypes.sizeof(fprog)),
+    )
+
+
+def _handle(task: Task, name: str) -> Result[LiveCaptureHandle, str]:
+    handle = task.previous_steps.get(
+        name, [Failure("Named StartLiveCapture not found")]
+    )[-1]
+    if isinstance(handle, Failure):
+        return handle
+    return Success(handle.unwrap())
+
+
+def _load(path: str) -> Result[LiveCaptureResult, str]:
+    import cloudpickle
+
+    with open(path, "rb") as f:
+        result = cloudpickle.load(f)
+    if isinstance(result, BaseException):
+        return Failure(f"Live capture failed: {result!r}")
+    return Success(result)
+
+
+def _exited(handle: LiveCaptureHandle, status: Optional[str]) -> Failure:
+    message = f"Live capture worker {handle.pid} is not running ({status or 'unknown exit status'})"
+    if os.path.exists(handle.results_path):
+        # the worker writes the error it failed with
+        result = _load(handle.results_path)
+        if isinstance(result, Failure):
+            message += f": {result.failure()}"
+    return Failure(message)
+
+
+class GetLiveCaptureResults(TaskDispatcher):
+    def __init__(
+        self, start_capture_task_name: str, timeout: float = 10, *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.linux_implementation = GetLiveCaptureResultsLinuxImplementation(
+            start_capture_task_name=start_capture_task_name,
+            timeout=timeout,
+            *args,
+            **kwargs,
+        )
+
+    def dispatch(self, node: Node) -> Task:
+        if node.architecture in {Architecture.LINUX_AMD64, Architecture.LINUX_ARM64}:
+            return self.linux_implementation
+
+        raise NotImplementedError(
+            f"GetLiveCaptureResults is not implemented for {node.architecture}"
+        )
+
+
+class GetLiveCaptureResultsLinuxImplementation(Task):
+    """
+    Returns intermediate results of a running live capture started
+    by the task with the given name, without stopping it.
+    """
+
+    def __init__(
+        self, start_capture_task_name: str, timeout: float = 10, *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.start_capture_task_name = start_capture_task_name
+        self.timeout = timeout
+
+    def run(self) -> Result[LiveCaptureResult, str]:
+        handle = _handle(self, self.start_capture_task_name)
+        if isinstance(handle, Failure):
+            return handle
+        handle = handle.unwrap()
+
+        path = handle.results_path + ".snapshot"
+        if os.path.exists(path):
+            os.remove(path)
+        try:
+            os.kill(handle.pid, signal.SIGUSR1)
+        except ProcessLookupError:
+            return _exited(handle, exit_status(handle.pid))
+        deadline = time.monotonic() + self.timeout
+        while not os.path.exists(path):
+            status = exit_status(handle.pid)
+            if status is not None:
+                return _exited(handle, status)
+            if time.monotonic() > deadline:
+                return Failure("Live capture did not report results in time")
+            time.sleep(0.05)
+        return _load(path)
+
+
+class StopLiveCapture(TaskDispatcher):
+    def __init__(
+        self, start_capture_task_name: str, timeout: float = 30, *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.linux_implementation = StopLiveCaptureLinuxImplementation(
+            start_capture_task_name=start_capture_task_name,
+            timeout=timeout,
+            *args,
+            **kwargs,
+        )
+
+    def dispatch(self, node: Node) -> Task:
+        if node.architecture in {Architecture.LINUX_AMD64, Architecture.LINUX_ARM64}:
+            return self.linux_implementation
+
+        raise NotImplementedError(
+            f"StopLiveCapture is not implemented for {node.architecture}"
+        )
+
+
+class StopLiveCaptureLinuxImplementation(Task):
+    """
+    Stops the live capture started by the task with the given name
+    and returns its final results.
+    """
+
+    def __init__(
+        self, start_capture_task_name: str, timeout: float = 30, *args, **kwargs
+    ):
+        super().__init__(*args, **kwargs)
+        self.start_capture_task_name = start_capture_task_name
+        self.timeout = timeout
+
+    def run(self) -> Result[LiveCaptureResult, str]:
+        handle = _handle(self, self.start_capture_task_name)
+        if isinstance(handle, Failure):
+            return handle
+        handle = handle.unwrap()
+
+        try:
+            os.kill(handle.pid, signal.SIGTERM)
+        except ProcessLookupError:
+            return _exited(handle, exit_status(handle.pid))
+        if not wait_for_exit(handle.pid, self.timeout):
+            try:
+                os.kill(handle.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                pass
+            return Failure("Live capture did not stop in time and was killed")
+        if not os.path.exists(handle.results_path):
+            return Failure("Live capture exited without results")
+        result = _load(handle.results_path)
+        for path in (handle.results_path, handle.results_path + ".snapshot"):
+            if os.path.exists(path):
+                os.remove(path)
+        return result
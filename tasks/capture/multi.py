@@ -0,0 +1,393 @@
+"""
+Parallel tcpdump captures on several interfaces of a node.
+
+All captures are started at once, each pinned to its own CPU core, and the task returns
+as soon as every tcpdump has opened its interface. Stopping the captures merges
+the per-interface files into one time-ordered pcapng file with an interface per capture.
+"""
+import heapq
+import os
+import signal
+import struct
+import subprocess
+import time
+from dataclasses import dataclass
+from typing import Iterator, List, Optional, Union
+
+from netunicorn.base import (
+    Architecture,
+    Failure,
+    Node,
+    Result,
+    Success,
+    Task,
+    TaskDispatcher,
+)
+from netunicorn.library.tasks.capture.handle import (
+    LOG_SUFFIX,
+    CaptureHandle,
+    CaptureStatistics,
+    exit_status,
+    parse_capture_statistics,
+    wait_for_exit,
+)
+from netunicorn.library.tasks.capture.profiles import CaptureProfile, resolve_profile
+from netunicorn.library.tasks.tasks_utils import any_ready, file_written, log_line
+
+_PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+_PCAPNG_SECTION = 0x0A0D0D0A
+_PCAPNG_INTERFACE = 1
+_PCAPNG_PACKET = 6
+_PCAPNG_IF_NAME = 2
+_PCAPNG_IF_TSRESOL = 9
+
+
+@dataclass
+class MultiCaptureHandle:
+    captures: dict[str, CaptureHandle]  # interface -> capture on this interface
+    filepath: str  # where the merged capture is written when the captures are stopped
+
+
+@dataclass
+class MultiCaptureResult:
+    filepath: str  # merged pcapng file
+    packets: int  # packets in the merged file
+    statistics: dict[str, CaptureStatistics]  # interface -> counters of its capture
+
+
+class StartMultiCapture(TaskDispatcher):
+    def __init__(
+        self,
+        interfaces: List[str],
+        filepath: str,
+        arguments: Optional[List[str]] = None,
+        profile: Union[str, CaptureProfile, None] = None,
+        cpus: Optional[List[int]] = None,
+        timeout: float = 10,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.linux_implementation = StartMultiCaptureLinuxImplementation(
+            interfaces=interfaces,
+            filepath=filepath,
+            arguments=arguments,
+            profile=profile,
+            cpus=cpus,
+            timeout=timeout,
+            *args,
+            **kwargs,
+        )
+
+    def dispatch(self, node: Node) -> Task:
+        if node.architecture in {Architecture.LINUX_AMD64, Architecture.LINUX_ARM64}:
+            return self.linux_implementation
+
+        raise NotImplementedError(
+            f"StartMultiCapture is not implemented for {node.architecture}"
+        )
+
+
+class StartMultiCaptureLinuxImplementation(Task):
+    """
+    Starts tcpdump on each of `interfaces`, writing to `<filepath>.<interface>.pcap`
+    (without the extension of `filepath`), and returns `MultiCaptureHandle` once all of them
+    are capturing, or fails if any of them exits or is not ready in `timeout` seconds.
+
+    Captures are pinned round-robin to `cpus` (by default, CPUs available to this process).
+    `arguments` (without `-i` and `-w`) and `profile` are applied to every capture,
+    as in `tcpdump.StartCapture`.
+    """
+
+    requirements = ["sudo apt-get update", "sudo apt-get install -y tcpdump"]
+
+    def __init__(
+        self,
+        interfaces: List[str],
+        filepath: str,
+        arguments: Optional[List[str]] = None,
+        profile: Union[str, CaptureProfile, None] = None,
+        cpus: Optional[List[int]] = None,
+        timeout: float = 10,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        if not interfaces:
+            raise ValueError("At least one interface is required")
+        self.interfaces = interfaces
+        self.filepath = filepath
+        self.arguments = arguments or []
+        self.profile = resolve_profile(profile)
+        self.profile_arguments = self.profile.tool_arguments() if self.profile else []
+        self.cpus = cpus
+        self.timeout = timeout
+
+    def run(self) -> Result[MultiCaptureHandle, str]:
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+
+        cpus = self.cpus or sorted(os.sched_getaffinity(0))
+        processes = {}
+        for number, interface in enumerate(self.interfaces):
+            path = _interface_path(self.filepath, interface)
+            with open(path + LOG_SUFFIX, "wb") as log:
+                processes[interface] = subprocess.Popen(
+                    ["tcpdump", "-i", interface]
+                    + self.arguments
+                    + ["-U", "-w", path]
+                    + self.profile_arguments,
+                    stdout=log,
+                    stderr=subprocess.STDOUT,
+                    preexec_fn=_pin(cpus[number % len(cpus)]),
+                )
+
+        probes = {
+            x: any_ready(log_line(y + LOG_SUFFIX, "listening on"), file_written(y))
+            for x, y in (
+                (x, _interface_path(self.filepath, x)) for x in self.interfaces
+            )
+        }
+        waiting = set(self.interfaces)
+        deadline = time.monotonic() + self.timeout
+        while waiting and time.monotonic() < deadline:
+            for interface in list(waiting):
+                path = _interface_path(self.filepath, interface)
+                if (exit_code := processes[interface].poll()) is not None:
+                    _terminate(processes.values())
+                    with open(path + LOG_SUFFIX, errors="replace") as f:
+                        text = f.read()
+                    return Failure(
+                        f"Tcpdump on {interface} terminated with return code "
+                        f"{exit_code}\n{text}"
+                    )
+                if probes[interface]():
+                    waiting.remove(interface)
+            if waiting:
+                time.sleep(0.05)
+        if waiting:
+            _terminate(processes.values())
+            return Failure(f"Captures on {sorted(waiting)} did not start in time")
+
+        nominal_sampling_rate = (
+            self.profile.nominal_sampling_rate if self.profile else 1.0
+        )
+        return Success(
+            MultiCaptureHandle(
+                {
+                    interface: CaptureHandle(
+                        process.pid,
+                        _interface_path(self.filepath, interface),
+                        self.profile,
+                        nominal_sampling_rate,
+                        _interface_path(self.filepath, interface) + LOG_SUFFIX,
+                    )
+                    for interface, process in processes.items()
+                },
+                self.filepath,
+            )
+        )
+
+
+def _interface_path(filepath: str, interface: str) -> str:
+    return f"{os.path.splitext(filepath)[0]}.{interface}.pcap"
+
+
+def _pin(cpu: int):
+    return lambda: os.sched_setaffinity(0, {cpu})
+
+
+def _terminate(processes) -> None:
+    for process in processes:
+        if process.poll() is None:
+            process.kill()
+
+
+class StopMultiCapture(TaskDispatcher):
+    def __init__(
+        self,
+        start_capture_task_name: str,
+        timeout: float = 30,
+        keep_files: bool = False,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.linux_implementation = StopMultiCaptureLinuxImplementation(
+            start_capture_task_name=start_capture_task_name,
+            timeout=timeout,
+            keep_files=keep_files,
+            *args,
+            **kwargs,
+        )
+
+    def dispatch(self, node: Node) -> Task:
+        if node.architecture in {Architecture.LINUX_AMD64, Architecture.LINUX_ARM64}:
+            return self.linux_implementation
+
+        raise NotImplementedError(
+            f"StopMultiCapture is not implemented for {node.architecture}"
+        )
+
+
+class StopMultiCaptureLinuxImplementation(Task):
+    """
+    Stops all captures started by the task with the given name with SIGINT,
+    waits up to `timeout` seconds for them to flush and exit (then kills them),
+    and merges their files into the pcapng file of the handle ordered by time.
+    Per-interface files are removed after merging unless `keep_files` is set.
+    Fails without merging if a capture had exited with an error before it was stopped.
+    """
+
+    def __init__(
+        self,
+        start_capture_task_name: str,
+        timeout: float = 30,
+        keep_files: bool = False,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.start_capture_task_name = start_capture_task_name
+        self.timeout = timeout
+        self.keep_files = keep_files
+
+    def run(self) -> Result[MultiCaptureResult, str]:
+        handle = self.previous_steps.get(
+            self.start_capture_task_name,
+            [Failure("Named StartMultiCapture not found")],
+        )[-1]
+        if isinstance(handle, Failure):
+            return handle
+        handle = handle.unwrap()
+
+        # captures that exited before they were stopped, with their exit status,
+        # collected before SIGCHLD is ignored so that exited children can still be reaped
+        exited = {
+            interface: status
+            for interface, capture in handle.captures.items()
+            if (status := exit_status(capture.pid)) is not None
+        }
+        signal.signal(signal.SIGCHLD, signal.SIG_IGN)
+        # interrupt all captures first so that they stop at the same time
+        for interface, capture in handle.captures.items():
+            if interface in exited:
+                continue
+            try:
+                os.kill(capture.pid, signal.SIGINT)
+            except ProcessLookupError:
+                exited[interface] = "unknown exit status"
+        deadline = time.monotonic() + self.timeout
+        statistics = {}
+        for interface, capture in handle.captures.items():
+            killed = not wait_for_exit(
+                capture.pid, max(0.0, deadline - time.monotonic())
+            )
+            if killed:
+                try:
+                    os.kill(capture.pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                wait_for_exit(capture.pid, 5)
+            with open(capture.log_path, errors="replace") as f:
+                statistics[interface] = parse_capture_statistics(f.read(), killed)
+        # tcpdump exits successfully by itself with some arguments (e.g., -c)
+        failed = {x: y for x, y in exited.items() if y != "exit code 0"}
+        if failed:
+            # the files are kept to look into the failure
+            return Failure(
+                "Captures exited before they were stopped: "
+                + ", ".join(
+                    f"{x} ({y}, see {handle.captures[x].log_path})"
+                    for x, y in failed.items()
+                )
+            )
+
+        packets = merge_captures(
+            {x: y.filepath for x, y in handle.captures.items()}, handle.filepath
+        )
+        if not self.keep_files:
+            for capture in handle.captures.values():
+                os.remove(capture.filepath)
+                os.remove(capture.log_path)
+        return Success(MultiCaptureResult(handle.filepath, packets, statistics))
+
+
+def merge_captures(captures: dict[str, str], filepath: str) -> int:
+    """
+    Merges pcap or pcapng files (interface name -> path) into a pcapng file ordered
+    by packet timestamps, with an interface description per input file
+    that keeps the timestamp resolution of the file (e.g., nanoseconds).
+    Returns the number of packets written.
+    """
+    from netunicorn.library.tasks.preprocessing import rawpcap
+
+    interfaces = []
+    divisors = []  # nanoseconds per timestamp unit of each interface
+    streams = []
+    for number, (interface, path) in enumerate(captures.items()):
+        tsresol = rawpcap.timestamp_resolution(path)
+        if tsresol & 0x80 or tsresol > 9:
+            tsresol = 9
+        divisors.append(10 ** (9 - tsresol))
+        records = rawpcap.read_records(path, nanoseconds=True)
+        first = next(records, None)
+        linktype = first.linktype if first else rawpcap.LINKTYPE_ETHERNET
+        interfaces.append((interface, linktype, tsresol))
+        if first is not None:
+            streams.append(_numbered(number, first, records))
+
+    packets = 0
+    with open(filepath, "wb") as f:
+        f.write(
+            _block(
+                _PCAPNG_SECTION,
+                struct.pack("<IHHq", _PCAPNG_BYTE_ORDER_MAGIC, 1, 0, -1),
+            )
+        )
+        for interface, linktype, tsresol in interfaces:
+            f.write(
+                _block(
+                    _PCAPNG_INTERFACE,
+                    struct.pack("<HHI", linktype, 0, 0)
+                    + _option(_PCAPNG_IF_NAME, interface.encode())
+                    + _option(_PCAPNG_IF_TSRESOL, bytes([tsresol]))
+                    + _option(0, b""),
+                )
+            )
+        for timestamp, number, record in heapq.merge(*streams):
+            ticks = timestamp // divisors[number]
+            f.write(
+                _block(
+                    _PCAPNG_PACKET,
+                    struct.pack(
+                        "<IIIII",
+                        number,
+                        ticks >> 32,
+                        ticks & 0xFFFFFFFF,
+                        len(record.data),
+                        record.length,
+                    )
+                    + _padded(record.data),
+                )
+            )
+            packets += 1
+    return packets
+
+
+def _numbered(number: int, first, records) -> Iterator[tuple]:
+    yield first.timestamp, number, first
+    for record in records:
+        yield record.timestamp, number, record
+
+
+def _padded(data: bytes) -> bytes:
+    return data + b"\x00" * (-len(data) % 4)
+
+
+def _option(code: int, value: bytes) -> bytes:
+    return struct.pack("<HH", code, len(value)) + _padded(value)
+
+
+def _block(kind: int, body: bytes) -> bytes:
+    total = struct.pack("<I", len(body) + 12)
+    return struct.pack("<I", kind) + total + body + total
@@ -0,0 +1,77 @@
+"""
+Named capture profiles that reduce how much of the traffic is captured.
+
+A profile combines truncation of packets (snaplen), sampling of 1 in N packets,
+keeping only the first K packets of each flow, and a capture filter (BPF preset),
+so that common reductions do not require tool-specific arguments.
+"""
+from dataclasses import dataclass
+from typing import Optional, Union
+
+# enough for Ethernet, VLAN, IPv6 or IPv4 with options and TCP with options
+HEADERS_SNAPLEN = 128
+
+
+@dataclass(frozen=True)
+class CaptureProfile:
+    """
+    `snaplen`: number of bytes kept of each packet.
+    `sample_every`: keep 1 of this many packets, chosen randomly in the kernel (live capture only:
+    tcpdump and tshark can only select packets by header fields, which is heavily biased).
+    `first_packets_per_flow`: keep only the first packets of each flow (live capture only;
+    a flow idle for two minutes is counted again from its next packet).
+    `bpf`: capture filter in tcpdump syntax.
+    """
+
+    snaplen: Optional[int] = None
+    sample_every: Optional[int] = None
+    first_packets_per_flow: Optional[int] = None
+    bpf: Optional[str] = None
+
+    @property
+    def nominal_sampling_rate(self) -> float:
+        """
+        1 / `sample_every`: the share of matching packets that sampling keeps on average.
+        """
+        return 1 / self.sample_every if self.sample_every else 1.0
+
+    def tool_arguments(self, filter_option: Optional[str] = None) -> list[str]:
+        """
+        Arguments for tcpdump (filter as the last argument) or tshark (`filter_option="-f"`).
+        """
+        if self.first_packets_per_flow:
+            raise ValueError(
+                "first_packets_per_flow is supported only by the live capture"
+            )
+        if self.sample_every and self.sample_every > 1:
+            raise ValueError("sample_every is supported only by the live capture")
+        arguments = ["-s", str(self.snaplen)] if self.snaplen else []
+        if self.bpf:
+            arguments += [filter_option, self.bpf] if filter_option else [self.bpf]
+        return arguments
+
+
+PROFILES: dict[str, CaptureProfile] = {
+    "full": CaptureProfile(),
+    "headers": CaptureProfile(snaplen=HEADERS_SNAPLEN),
+    "sampled": CaptureProfile(snaplen=HEADERS_SNAPLEN, sample_every=100),
+    "flow-starts": CaptureProfile(snaplen=HEADERS_SNAPLEN, first_packets_per_flow=10),
+    "tcp-control": CaptureProfile(
+        snaplen=HEADERS_SNAPLEN,
+        bpf="tcp[tcpflags] & (tcp-syn|tcp-fin|tcp-rst) != 0",
+    ),
+    "dns": CaptureProfile(bpf="port 53"),
+    "no-ssh": CaptureProfile(bpf="not port 22"),
+}
+
+
+def resolve_profile(
+    profile: Union[str, CaptureProfile, None],
+) -> Optional[CaptureProfile]:
+    if profile is None or isinstance(profile, CaptureProfile):
+        return profile
+    if profile not in PROFILES:
+        raise ValueError(
+            f"Unknown capture profile: {profile}, available: {list(PROFILES)}"
+        )
+    return PROFILES[profile]
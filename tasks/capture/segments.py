@@ -0,0 +1,143 @@
+"""
+Index of the files (segments) written by a rotating capture.
+
+The index is stored next to the capture in `<filepath>.index.json` and lists the time range
+and the number of packets of each segment, so that only the segments covering
+a given time window need to be opened. Segments that did not change since
+the previous indexing are not read again.
+"""
+import glob
+import json
+import os
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+from netunicorn.base import Task
+from netunicorn.library.tasks.preprocessing import rawpcap
+
+INDEX_SUFFIX = ".index.json"
+
+_CAPTURE_MAGIC = {*rawpcap._PCAP_MAGIC, rawpcap._PCAPNG_MAGIC}
+
+
+@dataclass
+class CaptureSegment:
+    path: str
+    # timestamp of the first packet, None if there are no packets
+    start_time: Optional[float]
+    end_time: Optional[float]  # timestamp of the last packet
+    packets: int
+    size: int  # bytes
+    modified: float  # modification time of the file when it was indexed
+
+
+def segment_files(filepath: str) -> list[str]:
+    """
+    Returns files of the capture started with the given `filepath`, named as tcpdump
+    (`<filepath>`, `<filepath><number>`, `<filepath>.<time>`) or tshark
+    (`<name>_<number>_<time><extension>`) name them when rotating.
+    """
+    root, extension = os.path.splitext(filepath)
+    candidates = set(glob.glob(glob.escape(filepath) + "*"))
+    candidates.update(glob.glob(glob.escape(root) + "_[0-9]*" + glob.escape(extension)))
+
+    files = []
+    for path in sorted(candidates):
+        try:
+            with open(path, "rb") as f:
+                if f.read(4) in _CAPTURE_MAGIC:
+                    files.append(path)
+        except (IsADirectoryError, FileNotFoundError):
+            continue
+    return files
+
+
+def index_capture(filepath: str) -> list[CaptureSegment]:
+    """
+    Updates the index of the capture and returns its segments ordered by time.
+    """
+    index_path = filepath + INDEX_SUFFIX
+    previous = {}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            previous = {x["path"]: CaptureSegment(**x) for x in json.load(f)}
+
+    segments = []
+    for path in segment_files(filepath):
+        stat = os.stat(path)
+        segment = previous.get(path)
+        if (
+            segment is None
+            or segment.size != stat.st_size
+            or segment.modified != stat.st_mtime
+        ):
+            start_time = end_time = None
+            packets = 0
+            for record in rawpcap.read_records(path):
+                if start_time is None:
+                    start_time = record.timestamp
+                end_time = record.timestamp
+                packets += 1
+            segment = CaptureSegment(
+                path, start_time, end_time, packets, stat.st_size, stat.st_mtime
+            )
+        segments.append(segment)
+
+    segments.sort(key=lambda x: (x.start_time is None, x.start_time or 0.0, x.path))
+    temporary = index_path + ".tmp"
+    with open(temporary, "w") as f:
+        json.dump([asdict(x) for x in segments], f, indent=2)
+    os.replace(temporary, index_path)
+    return segments
+
+
+def segments_between(
+    filepath: str, start_time: Optional[float] = None, end_time: Optional[float] = None
+) -> list[str]:
+    """
+    Returns paths of the capture segments with packets between `start_time` and `end_time`
+    (UNIX timestamps), ordered by time.
+    """
+    return [
+        x.path for x in index_capture(filepath) if _overlaps(x, start_time, end_time)
+    ]
+
+
+def _overlaps(
+    segment: CaptureSegment, start_time: Optional[float], end_time: Optional[float]
+) -> bool:
+    if start_time is None and end_time is None:
+        return True
+    return (
+        segment.start_time is not None
+        and (start_time is None or segment.end_time >= start_time)
+        and (end_time is None or segment.start_time <= end_time)
+    )
+
+
+class IndexCapture(Task):
+    """
+    Updates the index of a rotating capture (see `StartCapture` in `tcpdump` and `tshark`
+    modules) and returns its segments. If `start_time` or `end_time` is set,
+    only segments with packets in this time window are returned.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        start_time: Optional[float] = None,
+        end_time: Optional[float] = None,
+        *args,
+        **kwargs,
+    ):
+        self.filepath = filepath
+        self.start_time = start_time
+        self.end_time = end_time
+        super().__init__(*args, **kwargs)
+
+    def run(self) -> list[CaptureSegment]:
+        return [
+            x
+            for x in index_capture(self.filepath)
+            if _overlaps(x, self.start_time, self.end_time)
+        ]
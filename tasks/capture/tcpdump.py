@@ -1,7 +1,9 @@
+import os
+import shlex
 import signal
 import subprocess
-import time
-from typing import List, Optional
+import tempfile
+from typing import List, Optional, Union
 
 from netunicorn.base import (
     Architecture,
@@ -12,19 +14,51 @@ from netunicorn.base import (
     Task,
     TaskDispatcher,
 )
-from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.library.tasks.capture.handle import (
+    LOG_SUFFIX,
+    CaptureHandle,
+    CaptureStatistics,
+    stop_capture,
+)
+from netunicorn.library.tasks.capture.profiles import CaptureProfile, resolve_profile
+from netunicorn.library.tasks.tasks_utils import (
+    any_ready,
+    file_written,
+    log_line,
+    subprocess_run,
+    wait_until_ready,
+)
 
 
 class StartCapture(TaskDispatcher):
     def __init__(
-        self, filepath: str, arguments: Optional[List[str]] = None, *args, **kwargs
+        self,
+        filepath: str,
+        arguments: Optional[List[str]] = None,
+        *args,
+        rotate_size_mb: Optional[int] = None,
+        rotate_seconds: Optional[int] = None,
+        max_files: Optional[int] = None,
+        profile: Union[str, CaptureProfile, None] = None,
+        timeout: float = 10,
+        return_handle: bool = False,
+        **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.filepath = filepath
         self.arguments = arguments
 
         self.linux_implementation = StartCaptureLinuxImplementation(
-            filepath=self.filepath, arguments=self.arguments, *args, **kwargs
+            self.filepath,
+            self.arguments,
+            *args,
+            rotate_size_mb=rotate_size_mb,
+            rotate_seconds=rotate_seconds,
+            max_files=max_files,
+            profile=profile,
+            timeout=timeout,
+            return_handle=return_handle,
+            **kwargs,
         )
 
     def dispatch(self, node: Node) -> Task:
@@ -37,42 +71,123 @@ class StartCapture(TaskDispatcher):
 
 
 class StartCaptureLinuxImplementation(Task):
+    """
+    Starts tcpdump in the background and returns its pid, or its `CaptureHandle`
+    with `return_handle`, as soon as tcpdump is capturing (fails if it is not in `timeout` seconds).
+
+    The capture is rotated to a new file after `rotate_size_mb` megabytes (files are named
+    `<filepath>` followed by a number) or every `rotate_seconds` seconds (files are named
+    `<filepath>.<YYYYmmddHHMMSS>`). With `max_files`, only that many newest files are kept.
+    Use `segments.IndexCapture` to list the files with their time ranges.
+
+    `profile` is a name from `profiles.PROFILES` or a `profiles.CaptureProfile` that sets
+    the snaplen and the capture filter; in this case `arguments` must not contain
+    a filter expression. Profiles with sampling are supported only by the live capture.
+    """
+
     requirements = ["sudo apt-get update", "sudo apt-get install -y tcpdump"]
 
     def __init__(
-        self, filepath: str, arguments: Optional[List[str]] = None, *args, **kwargs
+        self,
+        filepath: str,
+        arguments: Optional[List[str]] = None,
+        *args,
+        rotate_size_mb: Optional[int] = None,
+        rotate_seconds: Optional[int] = None,
+        max_files: Optional[int] = None,
+        profile: Union[str, CaptureProfile, None] = None,
+        timeout: float = 10,
+        return_handle: bool = False,
+        **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.arguments = arguments or []
         self.filepath = filepath
+        self.rotate_size_mb = rotate_size_mb
+        self.rotate_seconds = rotate_seconds
+        self.max_files = max_files
+        if max_files and not (rotate_size_mb or rotate_seconds):
+            raise ValueError("max_files requires rotate_size_mb or rotate_seconds")
+        self.profile = resolve_profile(profile)
+        self.timeout = timeout
+        self.return_handle = return_handle
+        self.profile_arguments = self.profile.tool_arguments() if self.profile else []
+
+    def _rotation_arguments(self) -> List[str]:
+        arguments = []
+        if self.rotate_size_mb:
+            arguments += ["-C", str(self.rotate_size_mb)]
+        if not self.rotate_seconds:
+            if self.max_files:
+                arguments += ["-W", str(self.max_files)]
+            return arguments + ["-w", self.filepath]
+
+        arguments += ["-G", str(self.rotate_seconds)]
+        if self.max_files:
+            # with -G, tcpdump stops after -W files instead of overwriting them,
+            # so old files are removed by a script executed after each rotation
+            with tempfile.NamedTemporaryFile(
+                "w", prefix="tcpdump_rotate_", suffix=".sh", delete=False
+            ) as f:
+                f.write(
+                    "#!/bin/sh\n"
+                    f"ls -1t {shlex.quote(self.filepath)}.[0-9]* "
+                    f"| tail -n +{self.max_files + 1} | xargs -r rm -f\n"
+                )
+            os.chmod(f.name, 0o755)
+            arguments += ["-z", f.name]
+        return arguments + ["-w", self.filepath + ".%Y%m%d%H%M%S"]
 
     def run(self) -> Result:
         signal.signal(signal.SIGCHLD, signal.SIG_IGN)
 
+        log_path = self.filepath + LOG_SUFFIX
+        log = open(log_path, "wb")
         proc = subprocess.Popen(
-            ["tcpdump"] + self.arguments + ["-U", "-w", self.filepath],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            ["tcpdump"]
+            + self.arguments
+            + ["-U"]
+            + self._rotation_arguments()
+            + self.profile_arguments,
+            stdout=log,
+            stderr=subprocess.STDOUT,
         )
-        time.sleep(2)
-        if (exit_code := proc.poll()) is None:  # not finished yet
-            return Success(proc.pid)
-
-        text = ""
-        if proc.stdout:
-            text += proc.stdout.read().decode("utf-8") + "\n"
-        if proc.stderr:
-            text += proc.stderr.read().decode("utf-8")
-        return Failure(f"Tcpdump terminated with return code {exit_code}" + text)
+        log.close()
+        ready = wait_until_ready(
+            proc,
+            any_ready(log_line(log_path, "listening on"), file_written(self.filepath)),
+            self.timeout,
+        )
+        if not isinstance(ready, Failure):
+            if not self.return_handle:
+                return Success(proc.pid)
+            return Success(
+                CaptureHandle(
+                    proc.pid,
+                    self.filepath,
+                    self.profile,
+                    self.profile.nominal_sampling_rate if self.profile else 1.0,
+                    log_path,
+                )
+            )
+
+        if proc.poll() is None:
+            proc.kill()
+        with open(log_path, errors="replace") as f:
+            text = f.read()
+        return Failure(f"Tcpdump failed to start: {ready.failure()}\n" + text)
 
 
 class StopNamedCapture(TaskDispatcher):
-    def __init__(self, start_capture_task_name: str, *args, **kwargs):
+    def __init__(
+        self, start_capture_task_name: str, *args, timeout: float = 30, **kwargs
+    ):
         super().__init__(*args, **kwargs)
         self.start_capture_task_name = start_capture_task_name
         self.linux_implementation = StopNamedCaptureLinuxImplementation(
-            capture_task_name=self.start_capture_task_name,
+            self.start_capture_task_name,
             *args,
+            timeout=timeout,
             **kwargs,
         )
 
@@ -86,17 +201,23 @@ class StopNamedCapture(TaskDispatcher):
 
 
 class StopNamedCaptureLinuxImplementation(Task):
+    """
+    Stops tcpdump with SIGINT so that it flushes the capture, waits up to `timeout` seconds
+    for it to exit (then kills it) and returns the packet counters reported by tcpdump.
+    """
+
     requirements = [
         "sudo apt-get update",
         "sudo apt-get install -y tcpdump",
         "sudo apt-get install -y procps",
     ]
 
-    def __init__(self, capture_task_name: str, *args, **kwargs):
+    def __init__(self, capture_task_name: str, *args, timeout: float = 30, **kwargs):
         super().__init__(*args, **kwargs)
         self.capture_task_name = capture_task_name
+        self.timeout = timeout
 
-    def run(self):
+    def run(self) -> Result[CaptureStatistics, str]:
         signal.signal(signal.SIGCHLD, signal.SIG_IGN)
         pid = self.previous_steps.get(
             self.capture_task_name, [Failure("Named StartCapture not found")]
@@ -104,8 +225,7 @@ class StopNamedCaptureLinuxImplementation(Task):
         if isinstance(pid, Failure):
             return pid
 
-        pid = pid.unwrap()
-        return subprocess_run(["kill", str(pid)])
+        return stop_capture(pid.unwrap(), self.timeout)
 
 
 class StopAllTCPDumps(TaskDispatcher):
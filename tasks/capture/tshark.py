@@ -1,6 +1,5 @@
 import subprocess
-import time
-from typing import List, Optional
+from typing import List, Optional, Union
 
 from netunicorn.base import (
     Architecture,
@@ -11,19 +10,51 @@ from netunicorn.base import (
     Task,
     TaskDispatcher,
 )
-from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.library.tasks.capture.handle import (
+    LOG_SUFFIX,
+    CaptureHandle,
+    CaptureStatistics,
+    stop_all_captures,
+    stop_capture,
+)
+from netunicorn.library.tasks.capture.profiles import CaptureProfile, resolve_profile
+from netunicorn.library.tasks.tasks_utils import (
+    any_ready,
+    file_written,
+    log_line,
+    wait_until_ready,
+)
 
 
 class StartCapture(TaskDispatcher):
     def __init__(
-        self, filepath: str, arguments: Optional[List[str]] = None, *args, **kwargs
+        self,
+        filepath: str,
+        arguments: Optional[List[str]] = None,
+        *args,
+        rotate_size_mb: Optional[int] = None,
+        rotate_seconds: Optional[int] = None,
+        max_files: Optional[int] = None,
+        profile: Union[str, CaptureProfile, None] = None,
+        timeout: float = 10,
+        return_handle: bool = False,
+        **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.filepath = filepath
         self.arguments = arguments
 
         self.linux_implementation = StartCaptureLinuxImplementation(
-            filepath=self.filepath, arguments=self.arguments, *args, **kwargs
+            self.filepath,
+            self.arguments,
+            *args,
+            rotate_size_mb=rotate_size_mb,
+            rotate_seconds=rotate_seconds,
+            max_files=max_files,
+            profile=profile,
+            timeout=timeout,
+            return_handle=return_handle,
+            **kwargs,
         )
 
     def dispatch(self, node: Node) -> Task:
@@ -36,42 +67,102 @@ class StartCapture(TaskDispatcher):
 
 
 class StartCaptureLinuxImplementation(Task):
+    """
+    Starts tshark in the background and returns its pid, or its `CaptureHandle`
+    with `return_handle`, as soon as tshark is capturing (fails if it is not in `timeout` seconds).
+
+    The capture is rotated to a new file after `rotate_size_mb` megabytes and/or
+    every `rotate_seconds` seconds, keeping at most `max_files` newest files (ring buffer).
+    Files are named `<name>_<number>_<YYYYmmddHHMMSS><extension>` by tshark.
+    Use `segments.IndexCapture` to list the files with their time ranges.
+
+    `profile` is a name from `profiles.PROFILES` or a `profiles.CaptureProfile` that sets
+    the snaplen and the capture filter; in this case `arguments` must not contain `-f`.
+    Profiles with sampling are supported only by the live capture.
+    """
+
     requirements = ["sudo apt-get install -y tshark"]
 
     def __init__(
-        self, filepath: str, arguments: Optional[List[str]] = None, *args, **kwargs
+        self,
+        filepath: str,
+        arguments: Optional[List[str]] = None,
+        *args,
+        rotate_size_mb: Optional[int] = None,
+        rotate_seconds: Optional[int] = None,
+        max_files: Optional[int] = None,
+        profile: Union[str, CaptureProfile, None] = None,
+        timeout: float = 10,
+        return_handle: bool = False,
+        **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.arguments = arguments or []
         self.filepath = filepath
+        if max_files and not (rotate_size_mb or rotate_seconds):
+            raise ValueError("max_files requires rotate_size_mb or rotate_seconds")
         if "-w" not in self.arguments:
             self.arguments += ["-w", self.filepath]
+        if rotate_size_mb:
+            self.arguments += ["-b", f"filesize:{rotate_size_mb * 1000}"]
+        if rotate_seconds:
+            self.arguments += ["-b", f"duration:{rotate_seconds}"]
+        if max_files:
+            self.arguments += ["-b", f"files:{max_files}"]
+        self.profile = resolve_profile(profile)
+        self.timeout = timeout
+        self.return_handle = return_handle
+        if self.profile:
+            self.arguments += self.profile.tool_arguments(filter_option="-f")
 
     def run(self) -> Result:
+        log_path = self.filepath + LOG_SUFFIX
+        log = open(log_path, "wb")
         proc = subprocess.Popen(
             ["tshark"] + self.arguments,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
+            stdout=log,
+            stderr=subprocess.STDOUT,
         )
-        time.sleep(2)
-        if (exit_code := proc.poll()) is None:  # not finished yet
-            return Success(proc.pid)
-
-        text = ""
-        if proc.stdout:
-            text += proc.stdout.read().decode("utf-8") + "\n"
-        if proc.stderr:
-            text += proc.stderr.read().decode("utf-8")
-        return Failure(f"tshark terminated with return code {exit_code}\n" + text)
+        log.close()
+        ready = wait_until_ready(
+            proc,
+            any_ready(log_line(log_path, "Capturing on"), file_written(self.filepath)),
+            self.timeout,
+        )
+        if not isinstance(ready, Failure):
+            if not self.return_handle:
+                return Success(proc.pid)
+            return Success(
+                CaptureHandle(
+                    proc.pid,
+                    self.filepath,
+                    self.profile,
+                    self.profile.nominal_sampling_rate if self.profile else 1.0,
+                    log_path,
+                )
+            )
+
+        if proc.poll() is None:
+            proc.kill()
+        with open(log_path, errors="replace") as f:
+            text = f.read()
+        return Failure(f"tshark failed to start: {ready.failure()}\n" + text)
 
 
 class StopCapture(TaskDispatcher):
-    def __init__(self, start_capture_task_name: Optional[str] = None, *args, **kwargs):
+    def __init__(
+        self,
+        start_capture_task_name: Optional[str] = None,
+        *args,
+        timeout: float = 30,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.start_capture_task_name = start_capture_task_name
         self.linux_implementation = StopCaptureLinuxImplementation(
-            capture_task_name=self.start_capture_task_name,
+            self.start_capture_task_name,
             *args,
+            timeout=timeout,
             **kwargs,
         )
 
@@ -85,15 +176,27 @@ class StopCapture(TaskDispatcher):
 
 
 class StopCaptureLinuxImplementation(Task):
-    requirements = ["sudo apt-get install -y procps"]
+    """
+    Stops tshark with SIGINT so that it flushes the capture, waits up to `timeout` seconds
+    for it to exit (then kills it) and returns the packet counters reported by tshark.
+    Without `capture_task_name`, all tshark processes are stopped and the sums
+    of their counters are returned (see `handle.stop_all_captures`).
+    """
 
-    def __init__(self, capture_task_name: Optional[str] = None, *args, **kwargs):
+    def __init__(
+        self,
+        capture_task_name: Optional[str] = None,
+        *args,
+        timeout: float = 30,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.capture_task_name = capture_task_name
+        self.timeout = timeout
 
-    def run(self):
+    def run(self) -> Result[CaptureStatistics, str]:
         if self.capture_task_name is None:
-            return subprocess_run(["killall", "-s", "SIGKILL", "tshark"])
+            return stop_all_captures("tshark", self.timeout)
 
         pid = self.previous_steps.get(
             self.capture_task_name, [Failure("Named StartCapture not found")]
@@ -101,5 +204,4 @@ class StopCaptureLinuxImplementation(Task):
         if isinstance(pid, Failure):
             return pid
 
-        pid = pid.unwrap()
-        return subprocess_run(["kill", "-9", str(pid)])
+        return stop_capture(pid.unwrap(), self.timeout)
@@ -5,7 +5,20 @@ import time
 from dataclasses import dataclass
 from typing import Optional
 
-from netunicorn.base import Architecture, Node, Result, Success, Task, TaskDispatcher
+from netunicorn.base import (
+    Architecture,
+    Failure,
+    Node,
+    Result,
+    Success,
+    Task,
+    TaskDispatcher,
+)
+from netunicorn.library.tasks.tasks_utils import (
+    file_written,
+    http_ok,
+    wait_until_ready,
+)
 
 
 @dataclass
@@ -102,6 +115,17 @@ def measure(
     )
     os.environ["DISPLAY"] = f":{display_number}"
 
+    # wait until the page is served and the display accepts connections
+    for process, probe in (
+        (http_process, http_ok("http://localhost:44345/test.html")),
+        (xvfb_process, file_written(f"/tmp/.X11-unix/X{display_number}", 0)),
+    ):
+        ready = wait_until_ready(process, probe)
+        if isinstance(ready, Failure):
+            xvfb_process.kill()
+            http_process.kill()
+            raise RuntimeError(f"{process.args[0]} failed to start: {ready.failure()}")
+
     options = Options()
     options.add_argument("--no-sandbox")
     options.add_argument("--disable-dev-shm-usage")
@@ -112,12 +136,12 @@ def measure(
         options.binary_location = chrome_location
 
     driver = webdriver.Chrome(service=Service(), options=options)
-    time.sleep(1)
     driver.get("http://localhost:44345/test.html")
-    time.sleep(1)
 
     # check "window.testInstance.isFinished" attribute
-    while not driver.execute_script("return window.testInstance.isFinished"):
+    while not driver.execute_script(
+        "return window.testInstance && window.testInstance.isFinished"
+    ):
         time.sleep(1)
 
     # get results
@@ -1,7 +1,11 @@
-from typing import List, Optional
+from typing import List, Optional, Union
 
-from netunicorn.base import Task
-from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.base import Result, Task
+from netunicorn.library.tasks.tasks_utils import (
+    ProcessResult,
+    subprocess_run,
+    subprocess_stream,
+)
 
 
 class StartServer(Task):
@@ -25,6 +29,14 @@ class StopServer(Task):
 
 
 class FlentCommand(Task):
+    """
+    Runs a flent test and returns its output, like `subprocess_run`.
+
+    With `stream=True` or `output_path`, the test is run with `subprocess_stream` instead:
+    the output is written to `output_path` (if set) as it is produced,
+    and `ProcessResult` is returned with only the beginning and the end of the output.
+    """
+
     requirements = [
         "sudo apt install -y netperf iputils-ping irtt python3-pip",
         "pip install matplotlib flent",
@@ -37,18 +49,24 @@ class FlentCommand(Task):
         duration: int = 60,
         additional_arguments: Optional[List[str]] = None,
         *args,
+        stream: bool = False,
+        output_path: Optional[str] = None,
         **kwargs,
     ):
         self.test_name = test_name
         self.host = host
         self.duration = duration
         self.additional_arguments = additional_arguments or []
+        self.stream = stream or output_path is not None
+        self.output_path = output_path
         super().__init__(*args, **kwargs)
 
-    def run(self) -> str:
+    def run(self) -> Result[Union[str, ProcessResult], Union[str, ProcessResult]]:
         command = ["flent", self.test_name, "-H", self.host, "-l", str(self.duration)]
         command.extend(self.additional_arguments)
-        return subprocess_run(command)
+        if not self.stream:
+            return subprocess_run(command)
+        return subprocess_stream(command, self.output_path)
 
 
 class PingTest(FlentCommand):
@@ -1,31 +1,54 @@
 import subprocess
-import time
 from typing import Optional
 
 from netunicorn.base import Failure, Success, Task
-from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.library.tasks.tasks_utils import (
+    port_listening,
+    subprocess_run,
+    wait_until_ready,
+)
 
 
 class Iperf3ServerStart(Task):
+    """
+    This task starts a iperf3 server and returns its pid
+    as soon as the server listens on its port (`-p`, 5201 by default).
+    """
+
     requirements = ["apt-get install -y iperf3"]
 
-    def __init__(self, flags: Optional[list[str]] = None, *args, **kwargs):
+    def __init__(
+        self, flags: Optional[list[str]] = None, *args, timeout: float = 10, **kwargs
+    ):
         self.flags = flags or []
         if "-s" not in self.flags:
             self.flags += ["-s"]
+        self.timeout = timeout
         super().__init__(*args, **kwargs)
 
+    def _port(self) -> int:
+        for number, flag in enumerate(self.flags):
+            if flag in {"-p", "--port"} and number + 1 < len(self.flags):
+                return int(self.flags[number + 1])
+            if flag.startswith("--port="):
+                return int(flag.split("=", 1)[1])
+        return 5201
+
     def run(self) -> str:
         process = subprocess.Popen(
             ["iperf3"] + self.flags, stdout=subprocess.PIPE, stderr=subprocess.PIPE
         )
-        time.sleep(2)
-        if process.poll() is None:  # not finished yet
+        ready = wait_until_ready(
+            process, port_listening(self._port(), process.pid), self.timeout
+        )
+        if not isinstance(ready, Failure):
             return Success(process.pid)
 
-        text = ""
+        if process.poll() is None:
+            process.kill()
+        text = ready.failure() + "\n"
         if process.stdout:
-            text = process.stdout.read().decode("utf-8") + "\n"
+            text += process.stdout.read().decode("utf-8") + "\n"
         if process.stderr:
             text += process.stderr.read().decode("utf-8")
         return Failure(text)
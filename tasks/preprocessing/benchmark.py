@@ -0,0 +1,375 @@
+"""
+Benchmarks of the preprocessing tasks on deterministic synthetic captures.
+
+Captures are generated without Scapy and without network access, so the benchmarks
+can run on any node (or locally: `python -m netunicorn.library.tasks.preprocessing.benchmark`).
+Each benchmark runs in a forked process to measure its peak memory usage separately.
+"""
+import os
+import random
+import struct
+import time
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+
+from netunicorn.base import Task
+from netunicorn.library.tasks.preprocessing import scapy
+from netunicorn.library.tasks.preprocessing.flows import FlowAggregator, GetFlowTable
+
+_ethernet = struct.Struct("!6s6sH").pack
+_ipv4 = struct.Struct("!BBHHHBBH4s4s").pack
+_tcp = struct.Struct("!HHIIBBHHH").pack
+_udp = struct.Struct("!HHHH").pack
+_record = struct.Struct("<IIII").pack
+
+_BROADCAST = b"\xff" * 6
+_DOMAINS = [f"host{i}.example{i % 7}.org" for i in range(64)]
+
+
+@dataclass
+class BenchmarkResult:
+    name: str
+    packets: int
+    seconds: float
+    packets_per_second: float
+    peak_rss: int  # bytes
+    result_size: int  # rows or items in the result
+    result_bytes: int  # size of the serialized result
+
+
+def _mac(address: bytes) -> bytes:
+    return b"\x02\x00" + address
+
+
+def _ip(src: bytes, dst: bytes, proto: int, transport: bytes, identifier: int) -> bytes:
+    return (
+        _ethernet(_mac(dst), _mac(src), 0x0800)
+        + _ipv4(
+            0x45, 0, 20 + len(transport), identifier & 0xFFFF, 0, 64, proto, 0, src, dst
+        )
+        + transport
+    )
+
+
+def _tcp_session(
+    rng: random.Random, client: bytes, server: bytes, port: int
+) -> Iterator[bytes]:
+    sport = rng.randrange(1024, 65536)
+    seq, ack = rng.getrandbits(32), rng.getrandbits(32)
+
+    def segment(forward: bool, flags: int, payload: bytes = b"") -> bytes:
+        nonlocal seq, ack
+        if forward:
+            header = _tcp(sport, port, seq, ack, 0x50, flags, 65535, 0, 0)
+            src, dst = client, server
+            seq = (seq + len(payload) + (flags & 0x03 != 0)) & 0xFFFFFFFF
+        else:
+            header = _tcp(port, sport, ack, seq, 0x50, flags, 65535, 0, 0)
+            src, dst = server, client
+            ack = (ack + len(payload) + (flags & 0x03 != 0)) & 0xFFFFFFFF
+        return _ip(src, dst, 6, header + payload, seq)
+
+    yield segment(True, 0x02)
+    yield segment(False, 0x12)
+    yield segment(True, 0x10)
+    if port == 443:
+        yield segment(True, 0x18, _client_hello(rng.choice(_DOMAINS)))
+    else:
+        host = rng.choice(_DOMAINS).encode()
+        request = b"GET /%d HTTP/1.1\r\nHost: %s\r\nAccept: */*\r\n\r\n" % (
+            rng.randrange(1000),
+            host,
+        )
+        yield segment(True, 0x18, request)
+    for _ in range(rng.randrange(1, 16)):
+        yield segment(False, 0x10, bytes(rng.randrange(64, 1400)))
+        yield segment(True, 0x10)
+    yield segment(True, 0x11)
+    yield segment(False, 0x11)
+
+
+def _client_hello(name: str) -> bytes:
+    name = name.encode()
+    server_name = struct.pack("!HBH", len(name) + 3, 0, len(name)) + name
+    extensions = struct.pack("!HH", 0, len(server_name)) + server_name
+    body = (
+        b"\x03\x03"
+        + bytes(32)
+        + b"\x00\x00\x02\x13\x01\x01\x00"
+        + struct.pack("!H", len(extensions))
+        + extensions
+    )
+    handshake = b"\x01" + len(body).to_bytes(3, "big") + body
+    return b"\x16\x03\x01" + struct.pack("!H", len(handshake)) + handshake
+
+
+def _dns_exchange(
+    rng: random.Random, client: bytes, server: bytes, port: int
+) -> Iterator[bytes]:
+    sport = rng.randrange(1024, 65536)
+    identifier = rng.getrandbits(16)
+    question = (
+        b"".join(bytes([len(x)]) + x.encode() for x in rng.choice(_DOMAINS).split("."))
+        + b"\x00\x00\x01\x00\x01"
+    )
+    query = struct.pack("!HHHHHH", identifier, 0x0100, 1, 0, 0, 0) + question
+    answer = (
+        struct.pack("!HHHHHH", identifier, 0x8180, 1, 1, 0, 0)
+        + question
+        + b"\xc0\x0c\x00\x01\x00\x01\x00\x00\x01\x2c\x00\x04"
+        + client
+    )
+    yield _ip(client, server, 17, _udp(sport, 53, 8 + len(query), 0) + query, sport)
+    yield _ip(server, client, 17, _udp(53, sport, 8 + len(answer), 0) + answer, sport)
+
+
+def _udp_flow(
+    rng: random.Random, client: bytes, server: bytes, port: int
+) -> Iterator[bytes]:
+    sport = rng.randrange(1024, 65536)
+    for i in range(rng.randrange(1, 32)):
+        payload = bytes(rng.randrange(16, 1200))
+        if i % 3:
+            yield _ip(
+                client, server, 17, _udp(sport, port, 8 + len(payload), 0) + payload, i
+            )
+        else:
+            yield _ip(
+                server, client, 17, _udp(port, sport, 8 + len(payload), 0) + payload, i
+            )
+
+
+def _ping(
+    rng: random.Random, client: bytes, server: bytes, port: int
+) -> Iterator[bytes]:
+    identifier = rng.getrandbits(16)
+    for sequence in range(rng.randrange(1, 5)):
+        for kind, src, dst in ((8, client, server), (0, server, client)):
+            icmp = struct.pack("!BBHHH", kind, 0, 0, identifier, sequence) + bytes(32)
+            yield _ip(src, dst, 1, icmp, sequence)
+
+
+def _arp(
+    rng: random.Random, client: bytes, server: bytes, port: int
+) -> Iterator[bytes]:
+    yield (
+        _ethernet(_BROADCAST, _mac(client), 0x0806)
+        + struct.pack("!HHBBH", 1, 0x0800, 6, 4, 1)
+        + _mac(client)
+        + client
+        + bytes(6)
+        + server
+    )
+
+
+# generator, server port, weight
+_SESSIONS = [
+    (_tcp_session, 80, 20),
+    (_tcp_session, 443, 20),
+    (_dns_exchange, 53, 25),
+    (_udp_flow, 4433, 10),
+    (_ping, 0, 10),
+    (_arp, 0, 5),
+]
+
+
+def generate_capture(path: str, packets: int, seed: int = 0) -> str:
+    """
+    Writes a pcap file with `packets` packets of interleaved TCP (HTTP, TLS), UDP, DNS,
+    ICMP and ARP sessions between hosts of 10.0.0.0/16. The same arguments always
+    produce the same file.
+    """
+    rng = random.Random(seed)
+    generators = [x[0] for x in _SESSIONS]
+    ports = [x[1] for x in _SESSIONS]
+    weights = [x[2] for x in _SESSIONS]
+    active = []
+    timestamp = 1_700_000_000_000_000  # microseconds
+
+    with open(path, "wb") as f:
+        f.write(struct.pack("<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 65535, 1))
+        written = 0
+        while written < packets:
+            while len(active) < 64:
+                i = rng.choices(range(len(generators)), weights)[0]
+                client = bytes([10, 0, rng.randrange(256), rng.randrange(1, 255)])
+                server = bytes([10, 0, rng.randrange(4), rng.randrange(1, 255)])
+                active.append(generators[i](rng, client, server, ports[i]))
+
+            index = rng.randrange(len(active))
+            packet = next(active[index], None)
+            if packet is None:
+                active[index] = active[-1]
+                active.pop()
+                continue
+
+            timestamp += rng.randrange(1, 2000)
+            seconds, microseconds = divmod(timestamp, 1_000_000)
+            f.write(_record(seconds, microseconds, len(packet), len(packet)))
+            f.write(packet)
+            written += 1
+    return path
+
+
+_BENCHMARKS: dict[str, Callable[[str, int], Task]] = {
+    "5tuples-scapy": lambda f, w: scapy.Get5Tuples(f, streaming=True, workers=w),
+    "5tuples-raw": lambda f, w: scapy.Get5Tuples(f, engine="raw", workers=w),
+    "5tuples-raw-columnar": lambda f, w: scapy.Get5Tuples(
+        f, engine="raw", columnar=True, workers=w
+    ),
+    "dns-queries": lambda f, w: scapy.GetDNSQueries(f, streaming=True, workers=w),
+    "http-host-headers": lambda f, w: scapy.GetHTTPHostHeaders(f, workers=w),
+    "tls-server-names": lambda f, w: scapy.GetTLSServerNames(f, workers=w),
+    "icmp-requests": lambda f, w: scapy.GetICMPRequests(f, streaming=True, workers=w),
+    "unique-arp-mac": lambda f, w: scapy.GetUniqueARPMAC(f, streaming=True, workers=w),
+    "flow-table": lambda f, w: GetFlowTable(f, workers=w),
+    "all-extractors": lambda f, w: scapy.ExtractFromPcap(
+        f,
+        [
+            scapy.FiveTuples(),
+            scapy.RawFiveTuples(),
+            scapy.DNSQueries(),
+            scapy.HTTPHostHeaders(),
+            scapy.TLSServerNames(),
+            scapy.ICMPRequests(),
+            scapy.UniqueARPMAC(),
+            FlowAggregator(),
+        ],
+        streaming=True,
+        workers=w,
+    ),
+}
+BENCHMARKS = list(_BENCHMARKS)
+
+
+def run_benchmark(
+    name: str, filename: str, packets: int, workers: int = 1
+) -> BenchmarkResult:
+    """
+    Runs the benchmark on the capture with the given number of packets in a forked process.
+    Peak RSS is the maximum resident set size of this process, including the memory
+    inherited from the parent.
+    """
+    import cloudpickle
+
+    task = _BENCHMARKS[name](filename, workers)
+    receiver, sender = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(receiver)
+        try:
+            start = time.perf_counter()
+            result = task.run()
+            seconds = time.perf_counter() - start
+            if isinstance(task, scapy.ExtractFromPcap):
+                size = sum(_result_size(x) for x in result)
+            else:
+                size = _result_size(result)
+            data = cloudpickle.dumps((seconds, size, len(cloudpickle.dumps(result))))
+        except BaseException as e:
+            data = cloudpickle.dumps(e)
+        with os.fdopen(sender, "wb") as f:
+            f.write(data)
+        os._exit(0)
+
+    os.close(sender)
+    with os.fdopen(receiver, "rb") as f:
+        data = f.read()
+    _, status, usage = os.wait4(pid, 0)
+    if not data:
+        raise RuntimeError(f"Benchmark {name} exited unexpectedly with status {status}")
+    outcome = cloudpickle.loads(data)
+    if isinstance(outcome, BaseException):
+        raise outcome
+
+    seconds, result_size, result_bytes = outcome
+    return BenchmarkResult(
+        name=name,
+        packets=packets,
+        seconds=seconds,
+        packets_per_second=packets / seconds if seconds else 0.0,
+        peak_rss=usage.ru_maxrss * 1024,  # kilobytes on Linux
+        result_size=result_size,
+        result_bytes=result_bytes,
+    )
+
+
+def _result_size(result: Any) -> int:
+    if isinstance(result, dict):  # columnar result
+        return len(next(iter(result.values()), []))
+    return len(result)
+
+
+class BenchmarkPreprocessing(Task):
+    """
+    Generates synthetic captures of the given sizes (see `generate_capture`) and runs
+    the benchmarks (all of `BENCHMARKS` by default) on each of them.
+    Captures are stored in `directory` and reused by later runs.
+
+    Scapy-based benchmarks process roughly 10K packets per second,
+    so exclude them for captures of millions of packets.
+    """
+
+    requirements = ["pip install scapy"]
+
+    def __init__(
+        self,
+        packets: Optional[list[int]] = None,
+        benchmarks: Optional[list[str]] = None,
+        workers: int = 1,
+        directory: str = "/tmp/netunicorn_benchmark",
+        seed: int = 0,
+        *args,
+        **kwargs,
+    ):
+        self.packets = packets or [10_000]
+        self.benchmarks = benchmarks or BENCHMARKS
+        unknown = set(self.benchmarks) - set(BENCHMARKS)
+        if unknown:
+            raise ValueError(f"Unknown benchmarks: {sorted(unknown)}")
+        self.workers = workers
+        self.directory = directory
+        self.seed = seed
+        super().__init__(*args, **kwargs)
+
+    def run(self) -> list[BenchmarkResult]:
+        os.makedirs(self.directory, exist_ok=True)
+        results = []
+        for packets in self.packets:
+            filename = os.path.join(
+                self.directory, f"synthetic_{packets}_{self.seed}.pcap"
+            )
+            if not os.path.exists(filename):
+                generate_capture(filename + ".tmp", packets, self.seed)
+                os.replace(filename + ".tmp", filename)
+            for name in self.benchmarks:
+                results.append(run_benchmark(name, filename, packets, self.workers))
+        return results
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--packets", type=int, nargs="+", default=[10_000])
+    parser.add_argument("--benchmarks", nargs="+", choices=BENCHMARKS)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--directory", default="/tmp/netunicorn_benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    print(
+        f"{'benchmark':<22}{'packets':>10}{'seconds':>10}{'packets/s':>12}"
+        f"{'peak RSS, MB':>14}{'result size':>13}{'result, KB':>12}"
+    )
+    for x in BenchmarkPreprocessing(
+        arguments.packets,
+        arguments.benchmarks,
+        arguments.workers,
+        arguments.directory,
+        arguments.seed,
+    ).run():
+        print(
+            f"{x.name:<22}{x.packets:>10}{x.seconds:>10.2f}{x.packets_per_second:>12.0f}"
+            f"{x.peak_rss / 2**20:>14.1f}{x.result_size:>13}{x.result_bytes / 1024:>12.1f}"
+        )
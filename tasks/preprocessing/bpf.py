@@ -0,0 +1,191 @@
+"""
+Classic BPF filters evaluated over raw pcap records.
+
+Filter expressions (tcpdump syntax) are compiled to BPF bytecode by libpcap through Scapy,
+and the bytecode is evaluated in Python over the record bytes. This is much cheaper
+than dissecting a packet with Scapy, so non-matching packets can be dropped before dissection.
+"""
+import struct
+import warnings
+from typing import Optional
+
+from netunicorn.library.tasks.preprocessing.rawpcap import LINKTYPE_ETHERNET
+
+Program = list[tuple[int, int, int, int]]  # (code, jt, jf, k) instructions
+
+_BPF_MEMWORDS = 16
+
+_word = struct.Struct("!I").unpack_from
+_half = struct.Struct("!H").unpack_from
+
+
+def compile_filter(expression: str, linktype: int) -> Program:
+    """
+    Compiles the filter expression with libpcap for the given link type.
+    Requires libpcap to be installed on the node.
+    """
+    from ctypes import byref
+
+    from scapy.arch.common import compile_filter as scapy_compile_filter
+
+    program = scapy_compile_filter(expression, linktype=linktype)
+    # imported only once libpcap is known to be available
+    from scapy.libs.winpcapy import pcap_freecode
+
+    try:
+        return [
+            (x.code, x.jt, x.jf, x.k)
+            for x in (program.bf_insns[i] for i in range(program.bf_len))
+        ]
+    finally:
+        pcap_freecode(byref(program))
+
+
+def with_vlan(expression: str) -> str:
+    """
+    Extends the expression to also match packets with a single VLAN tag,
+    which libpcap filters do not match by default.
+    """
+    return f"({expression}) or (vlan and ({expression}))"
+
+
+def run(program: Program, data: bytes, length: int) -> int:
+    """
+    Evaluates the program over the packet data, `length` is the original length
+    of the packet on the wire. Returns 0 if the packet does not match.
+    """
+    a = x = 0
+    memory = [0] * _BPF_MEMWORDS
+    size = len(data)
+    pc = 0
+    try:
+        while True:
+            code, jt, jf, k = program[pc]
+            pc += 1
+            kind = code & 0x07
+
+            if kind == 0x00 or kind == 0x01:  # load into A or X
+                mode = code & 0xE0
+                if mode == 0x00:  # immediate
+                    value = k
+                elif mode == 0x80:  # packet length
+                    value = length
+                elif mode == 0x60:  # scratch memory
+                    value = memory[k]
+                elif mode == 0xA0:  # ip header length
+                    if k >= size:
+                        return 0
+                    value = (data[k] & 0x0F) << 2
+                else:  # absolute or indirect packet load
+                    offset = k + x if mode == 0x40 else k
+                    width = code & 0x18
+                    if width == 0x10:
+                        if offset >= size:
+                            return 0
+                        value = data[offset]
+                    elif width == 0x08:
+                        if offset + 2 > size:
+                            return 0
+                        value = _half(data, offset)[0]
+                    else:
+                        if offset + 4 > size:
+                            return 0
+                        value = _word(data, offset)[0]
+                if kind == 0x00:
+                    a = value
+                else:
+                    x = value
+
+            elif kind == 0x05:  # jump
+                operation = code & 0xF0
+                if operation == 0x00:
+                    pc += k
+                    continue
+                operand = x if code & 0x08 else k
+                if operation == 0x10:
+                    condition = a == operand
+                elif operation == 0x20:
+                    condition = a > operand
+                elif operation == 0x30:
+                    condition = a >= operand
+                else:
+                    condition = a & operand
+                pc += jt if condition else jf
+
+            elif kind == 0x06:  # return
+                rval = code & 0x18
+                return a if rval == 0x10 else x if rval == 0x08 else k
+
+            elif kind == 0x04:  # arithmetic on A
+                operation = code & 0xF0
+                operand = x if code & 0x08 else k
+                if operation == 0x00:
+                    a += operand
+                elif operation == 0x10:
+                    a -= operand
+                elif operation == 0x20:
+                    a *= operand
+                elif operation == 0x30:
+                    if not operand:
+                        return 0
+                    a //= operand
+                elif operation == 0x90:
+                    if not operand:
+                        return 0
+                    a %= operand
+                elif operation == 0x40:
+                    a |= operand
+                elif operation == 0x50:
+                    a &= operand
+                elif operation == 0xA0:
+                    a ^= operand
+                elif operation == 0x60:
+                    a <<= operand
+                elif operation == 0x70:
+                    a >>= operand
+                elif operation == 0x80:
+                    a = -a
+                a &= 0xFFFFFFFF
+
+            elif kind == 0x02:  # store A
+                memory[k] = a
+            elif kind == 0x03:  # store X
+                memory[k] = x
+            else:  # transfer between A and X
+                if code & 0xF8 == 0x80:
+                    a = x
+                else:
+                    x = a
+    except IndexError:
+        # jumps outside of the program or invalid memory access
+        return 0
+
+
+class BPFFilter:
+    """
+    Filter expression compiled lazily for each link type it is applied to.
+    On Ethernet, packets with a VLAN tag are matched as well.
+
+    If libpcap is not available, the filter matches all packets.
+    """
+
+    def __init__(self, expression: str):
+        self.expression = expression
+        self.programs: dict[int, Optional[Program]] = {}
+
+    def matches(self, linktype: int, data: bytes, length: int) -> bool:
+        try:
+            program = self.programs[linktype]
+        except KeyError:
+            program = self.programs[linktype] = self._compile(linktype)
+        return program is None or run(program, data, length) != 0
+
+    def _compile(self, linktype: int) -> Optional[Program]:
+        expression = self.expression
+        if linktype == LINKTYPE_ETHERNET:
+            expression = with_vlan(expression)
+        try:
+            return compile_filter(expression, linktype)
+        except ImportError as e:
+            warnings.warn(f"Filter '{self.expression}' is not applied: {e}")
+            return None
@@ -0,0 +1,139 @@
+"""
+Writes preprocessing results to columnar files on the node.
+
+Parquet and Arrow IPC files require pyarrow (`pip install pyarrow`).
+Without it, results are written as CSV with string columns dictionary-encoded:
+values are replaced by integer codes and the dictionary is stored in a sidecar CSV file.
+"""
+import csv
+import os
+from array import array
+from dataclasses import dataclass, field
+from typing import Any, Literal, Sequence
+
+ExportFormat = Literal["auto", "parquet", "arrow", "csv"]
+
+_EXTENSIONS = {"parquet": ".parquet", "arrow": ".arrow", "csv": ".csv"}
+
+
+@dataclass
+class ExportedFile:
+    path: str
+    format: str
+    rows: int
+    size: int  # bytes on disk, including additional files
+    columns: list[str]
+    additional_files: list[str] = field(default_factory=list)
+
+
+def resolve_format(format: ExportFormat) -> str:
+    if format != "auto":
+        return format
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return "csv"
+    return "parquet"
+
+
+def extension(format: ExportFormat) -> str:
+    return _EXTENSIONS[resolve_format(format)]
+
+
+def write_columns(
+    columns: dict[str, Sequence[Any]], path: str, format: ExportFormat = "auto"
+) -> ExportedFile:
+    """
+    Writes columns of equal length to the file.
+    """
+    format = resolve_format(format)
+    lengths = {len(values) for values in columns.values()}
+    if len(lengths) > 1:
+        raise ValueError(f"Columns have different lengths: {lengths}")
+    rows = lengths.pop() if lengths else 0
+
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    if format == "csv":
+        additional_files = _write_csv(columns, path)
+    elif format in {"parquet", "arrow"}:
+        _write_arrow(columns, path, format)
+        additional_files = []
+    else:
+        raise ValueError(f"Unknown export format: {format}")
+
+    return ExportedFile(
+        path=path,
+        format=format,
+        rows=rows,
+        size=sum(os.path.getsize(x) for x in [path] + additional_files),
+        columns=list(columns),
+        additional_files=additional_files,
+    )
+
+
+def _write_arrow(columns: dict[str, Sequence[Any]], path: str, format: str) -> None:
+    import pyarrow as pa
+
+    types = {
+        "B": pa.uint8(),
+        "H": pa.uint16(),
+        "I": pa.uint32(),
+        "Q": pa.uint64(),
+        "d": pa.float64(),
+    }
+
+    arrays = {}
+    for name, values in columns.items():
+        if isinstance(values, array) and values.typecode in types:
+            # zero-copy view of the array buffer
+            arrays[name] = pa.Array.from_buffers(
+                types[values.typecode], len(values), [None, pa.py_buffer(values)]
+            )
+        else:
+            values = pa.array(values)
+            if pa.types.is_string(values.type) or pa.types.is_binary(values.type):
+                values = values.dictionary_encode()
+            arrays[name] = values
+    table = pa.table(arrays)
+
+    if format == "parquet":
+        import pyarrow.parquet as pq
+
+        pq.write_table(table, path, compression="zstd")
+    else:
+        options = pa.ipc.IpcWriteOptions(compression="zstd")
+        with pa.ipc.new_file(path, table.schema, options=options) as writer:
+            writer.write_table(table)
+
+
+def _write_csv(columns: dict[str, Sequence[Any]], path: str) -> list[str]:
+    dictionaries = {}
+    encoded = []
+    for name, values in columns.items():
+        if values and isinstance(values[0], (str, bytes)):
+            codes = dictionaries[name] = {}
+            encoded.append([codes.setdefault(x, len(codes)) for x in values])
+        else:
+            encoded.append(values)
+
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(columns)
+        writer.writerows(zip(*encoded))
+
+    if not dictionaries:
+        return []
+
+    dictionary_path = path + ".dictionary.csv"
+    with open(dictionary_path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["column", "code", "value"])
+        for name, codes in dictionaries.items():
+            for value, code in codes.items():
+                if isinstance(value, bytes):
+                    value = value.decode("utf-8", errors="backslashreplace")
+                writer.writerow([name, code, value])
+    return [dictionary_path]
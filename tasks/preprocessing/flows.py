@@ -0,0 +1,233 @@
+"""
+Flow-level aggregation of captures on edge nodes.
+
+Instead of returning one record per packet, packets are aggregated into
+bidirectional flows keyed by the 5-tuple, so results stay small even for huge captures.
+"""
+import socket
+from array import array
+from dataclasses import dataclass, fields
+from typing import Any, Iterator, Optional, Sequence
+
+from netunicorn.library.tasks.preprocessing import rawpcap
+from netunicorn.library.tasks.preprocessing.scapy import Extractor, _ScapyTask
+
+# fragmented datagrams whose ports FlowAggregator remembers for their later fragments
+_MAX_FRAGMENTED_DATAGRAMS = 10000
+
+
+@dataclass
+class FlowTable:
+    """
+    Bidirectional flows stored column-wise.
+
+    The source of a flow is the sender of its first packet: `fwd_*` columns describe
+    packets sent by the source and `bwd_*` columns packets sent by the destination.
+    TCP flags columns contain all flags seen in the given direction (bitwise OR).
+    Ports are 0 for protocols other than TCP and UDP.
+    """
+
+    src_ip: list[str]
+    dst_ip: list[str]
+    src_port: array
+    dst_port: array
+    proto: array
+    first_seen: array
+    last_seen: array
+    fwd_packets: array
+    bwd_packets: array
+    fwd_bytes: array
+    bwd_bytes: array
+    fwd_tcp_flags: array
+    bwd_tcp_flags: array
+
+    def __len__(self) -> int:
+        return len(self.proto)
+
+    def columns(self) -> dict[str, Any]:
+        return {field.name: getattr(self, field.name) for field in fields(self)}
+
+    def rows(self) -> Iterator[dict[str, Any]]:
+        columns = self.columns()
+        for i in range(len(self)):
+            yield {name: column[i] for name, column in columns.items()}
+
+
+class FlowAggregator(Extractor):
+    """
+    Aggregates IP packets into a `FlowTable`.
+
+    If `idle_timeout` (seconds) is set, a packet that arrives later than that
+    after the previous packet of its flow starts a new flow with the same 5-tuple.
+
+    Only the first fragment of an IP datagram has the TCP/UDP header: later fragments
+    are counted in the flow of the first one by the identification of the datagram.
+    Fragments seen before the first one (or more than `_MAX_FRAGMENTED_DATAGRAMS`
+    datagrams after it) are counted in a flow with ports 0.
+    """
+
+    raw = True
+
+    def __init__(self, idle_timeout: Optional[float] = None):
+        self.idle_timeout = idle_timeout
+
+    def start(self) -> None:
+        self._flows = {}  # 5-tuple -> row index
+        # (src, dst, proto, identification) -> ports of the first fragment
+        self._datagrams = {}
+        self._keys = []
+        self._first_seen = array("d")
+        self._last_seen = array("d")
+        self._fwd_packets = array("Q")
+        self._bwd_packets = array("Q")
+        self._fwd_bytes = array("Q")
+        self._bwd_bytes = array("Q")
+        self._fwd_tcp_flags = array("B")
+        self._bwd_tcp_flags = array("B")
+
+    def process(self, packet: rawpcap.RawPacket) -> None:
+        if not packet.version:
+            return
+
+        sport, dport = packet.sport, packet.dport
+        if packet.fragment is not None:
+            datagram = (packet.src, packet.dst, packet.proto, packet.fragment[0])
+            if not packet.fragment[1]:
+                self._datagrams[datagram] = (sport, dport)
+                if len(self._datagrams) > _MAX_FRAGMENTED_DATAGRAMS:
+                    # identifications are reused, old datagrams are complete
+                    del self._datagrams[next(iter(self._datagrams))]
+            elif datagram in self._datagrams:
+                sport, dport = self._datagrams[datagram]
+
+        key = (packet.src, packet.dst, sport, dport, packet.proto)
+        flow_key = key
+        index = self._flows.get(key)
+        if index is None:
+            flow_key = (packet.dst, packet.src, dport, sport, packet.proto)
+            index = self._flows.get(flow_key)
+
+        timestamp = packet.timestamp
+        if index is not None and self.idle_timeout is not None:
+            if timestamp - self._last_seen[index] > self.idle_timeout:
+                del self._flows[flow_key]
+                index = None
+        if index is None:
+            flow_key = key
+            index = self._flows[key] = len(self._keys)
+            self._keys.append(key)
+            self._first_seen.append(timestamp)
+            self._last_seen.append(timestamp)
+            for column in (
+                self._fwd_packets,
+                self._bwd_packets,
+                self._fwd_bytes,
+                self._bwd_bytes,
+                self._fwd_tcp_flags,
+                self._bwd_tcp_flags,
+            ):
+                column.append(0)
+
+        if timestamp > self._last_seen[index]:
+            self._last_seen[index] = timestamp
+        if flow_key is key:
+            self._fwd_packets[index] += 1
+            self._fwd_bytes[index] += packet.length
+            self._fwd_tcp_flags[index] |= packet.tcp_flags
+        else:
+            self._bwd_packets[index] += 1
+            self._bwd_bytes[index] += packet.length
+            self._bwd_tcp_flags[index] |= packet.tcp_flags
+
+    def merge(self, other: "FlowAggregator") -> None:
+        joined = set()
+        for i, key in enumerate(other._keys):
+            reverse = (key[1], key[0], key[3], key[2], key[4])
+            index = None
+            # only the first flow of a connection in the other part can continue a flow,
+            # later ones were started by the idle timeout
+            if min(key, reverse) not in joined:
+                joined.add(min(key, reverse))
+                flow_key = key
+                index = self._flows.get(key)
+                if index is None:
+                    flow_key = reverse
+                    index = self._flows.get(reverse)
+                if (
+                    index is not None
+                    and self.idle_timeout is not None
+                    and other._first_seen[i] - self._last_seen[index]
+                    > self.idle_timeout
+                ):
+                    index = None
+
+            if index is None:
+                self._flows.pop(reverse, None)
+                self._flows[key] = len(self._keys)
+                self._keys.append(key)
+                self._first_seen.append(other._first_seen[i])
+                self._last_seen.append(other._last_seen[i])
+                self._fwd_packets.append(other._fwd_packets[i])
+                self._bwd_packets.append(other._bwd_packets[i])
+                self._fwd_bytes.append(other._fwd_bytes[i])
+                self._bwd_bytes.append(other._bwd_bytes[i])
+                self._fwd_tcp_flags.append(other._fwd_tcp_flags[i])
+                self._bwd_tcp_flags.append(other._bwd_tcp_flags[i])
+                continue
+
+            fwd, bwd = (0, 1) if flow_key is key else (1, 0)
+            packets = (other._fwd_packets[i], other._bwd_packets[i])
+            sizes = (other._fwd_bytes[i], other._bwd_bytes[i])
+            flags = (other._fwd_tcp_flags[i], other._bwd_tcp_flags[i])
+            self._first_seen[index] = min(self._first_seen[index], other._first_seen[i])
+            self._last_seen[index] = max(self._last_seen[index], other._last_seen[i])
+            self._fwd_packets[index] += packets[fwd]
+            self._bwd_packets[index] += packets[bwd]
+            self._fwd_bytes[index] += sizes[fwd]
+            self._bwd_bytes[index] += sizes[bwd]
+            self._fwd_tcp_flags[index] |= flags[fwd]
+            self._bwd_tcp_flags[index] |= flags[bwd]
+
+    def result(self) -> FlowTable:
+        addresses = {}
+
+        def address(packed: bytes) -> str:
+            if (value := addresses.get(packed)) is None:
+                family = socket.AF_INET if len(packed) == 4 else socket.AF_INET6
+                value = addresses[packed] = socket.inet_ntop(family, packed)
+            return value
+
+        return FlowTable(
+            src_ip=[address(key[0]) for key in self._keys],
+            dst_ip=[address(key[1]) for key in self._keys],
+            src_port=array("H", (key[2] for key in self._keys)),
+            dst_port=array("H", (key[3] for key in self._keys)),
+            proto=array("B", (key[4] for key in self._keys)),
+            first_seen=self._first_seen,
+            last_seen=self._last_seen,
+            fwd_packets=self._fwd_packets,
+            bwd_packets=self._bwd_packets,
+            fwd_bytes=self._fwd_bytes,
+            bwd_bytes=self._bwd_bytes,
+            fwd_tcp_flags=self._fwd_tcp_flags,
+            bwd_tcp_flags=self._bwd_tcp_flags,
+        )
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        return self.result().columns()
+
+
+class GetFlowTable(_ScapyTask):
+    """
+    Aggregates the capture into bidirectional flows and returns a compact `FlowTable`
+    instead of per-packet records. Headers are parsed without Scapy.
+    """
+
+    def __init__(
+        self, filename: str, *args, idle_timeout: Optional[float] = None, **kwargs
+    ):
+        self.idle_timeout = idle_timeout
+        super().__init__(filename, *args, **kwargs)
+
+    def run(self) -> FlowTable:
+        return self._extract([FlowAggregator(self.idle_timeout)])[0]
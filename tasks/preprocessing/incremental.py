@@ -0,0 +1,140 @@
+"""
+Incremental preprocessing of captures that are still being written (e.g., by `tcpdump -U`).
+
+Each run reads only the records appended since the previous run and continues
+from the state of the extractors saved in a sidecar checkpoint file.
+"""
+import os
+import pickle
+from types import CodeType
+from typing import Any, Callable, Iterator, Optional, Union
+
+from netunicorn.library.tasks.preprocessing import rawpcap
+from netunicorn.library.tasks.preprocessing.scapy import (
+    CallableExtractor,
+    Extractor,
+    _feed_records,
+    _ScapyTask,
+)
+
+_CHECKPOINT_VERSION = 2
+_IDENTITY_SIZE = 40  # pcap file header and the header of the first record
+
+
+class ExtractIncrementally(_ScapyTask):
+    """
+    Runs the extractors over the records appended to a pcap file since the previous run
+    and returns their results for the whole file so far, like `ExtractFromPcap`.
+
+    The byte offset of the first unprocessed record and the collected state of the extractors
+    are stored in the checkpoint file (`<filename>.checkpoint` by default), so run the task
+    with the same extractors each time. A truncated last record is left for the next run.
+    If the capture file was replaced (e.g., a new capture was started with the same name),
+    processing starts from the beginning.
+
+    Only pcap files are supported (as written by tcpdump), not pcapng.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        extractors: list[Union[Extractor, Callable[[Any], Any]]],
+        *args,
+        checkpoint_path: Optional[str] = None,
+        **kwargs,
+    ):
+        self.extractors = [
+            x if isinstance(x, Extractor) else CallableExtractor(x) for x in extractors
+        ]
+        self.checkpoint_path = checkpoint_path or filename + ".checkpoint"
+        super().__init__(filename, *args, streaming=True, **kwargs)
+
+    def run(self) -> list[Any]:
+        return self._extract(self.extractors)
+
+    def _feed(self, extractors: list[Extractor]) -> None:
+        with open(self.filename, "rb") as f:
+            identity = f.read(_IDENTITY_SIZE)
+        if identity[:4] not in rawpcap._PCAP_MAGIC:
+            raise ValueError(f"{self.filename} is not a pcap file")
+
+        offset = None
+        checkpoint = self._load_checkpoint()
+        if (
+            checkpoint is not None
+            and checkpoint["identity"] == identity[: len(checkpoint["identity"])]
+            and checkpoint["extractors"] == [_identity(x) for x in extractors]
+            and checkpoint["offset"] <= os.path.getsize(self.filename)
+        ):
+            offset = checkpoint["offset"]
+            for extractor, state in zip(extractors, checkpoint["states"]):
+                extractor.__dict__.update(state)
+        else:
+            for extractor in extractors:
+                extractor.start()
+
+        position = [offset or rawpcap._PCAP_HEADER_SIZE]
+        _feed_records(extractors, _tracked(self.filename, position))
+
+        self._save_checkpoint(
+            {
+                "version": _CHECKPOINT_VERSION,
+                "identity": identity,
+                "offset": position[0],
+                "extractors": [_identity(x) for x in extractors],
+                "states": [
+                    {k: v for k, v in vars(x).items() if k.startswith("_")}
+                    for x in extractors
+                ],
+            }
+        )
+
+    def _load_checkpoint(self) -> Optional[dict]:
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path, "rb") as f:
+            checkpoint = pickle.load(f)
+        if checkpoint.get("version") != _CHECKPOINT_VERSION:
+            return None
+        return checkpoint
+
+    def _save_checkpoint(self, checkpoint: dict) -> None:
+        import cloudpickle
+
+        # written to a temporary file first, so an interrupted run keeps the previous checkpoint
+        temporary = self.checkpoint_path + ".tmp"
+        with open(temporary, "wb") as f:
+            cloudpickle.dump(checkpoint, f)
+        os.replace(temporary, self.checkpoint_path)
+
+
+def _identity(extractor: Extractor) -> tuple:
+    """
+    Class and configuration (public attributes) of the extractor, so that state collected
+    by an extractor configured differently (e.g., `FiveTuples(ipv6=False)`) is not resumed.
+    Values are compared by repr and functions by their code, constants and closure.
+    """
+    configuration = []
+    for key, value in sorted(vars(extractor).items()):
+        if key.startswith("_"):
+            continue
+        code = getattr(value, "__code__", None)
+        if code is not None:
+            value = (
+                value.__qualname__,
+                code.co_code,
+                code.co_names,
+                [repr(x) for x in code.co_consts if not isinstance(x, CodeType)],
+                [repr(x.cell_contents) for x in value.__closure__ or ()],
+            )
+        else:
+            value = repr(value)
+        configuration.append((key, value))
+    return type(extractor).__name__, configuration
+
+
+def _tracked(filename: str, position: list[int]) -> Iterator[rawpcap.PcapRecord]:
+    # position[0] is kept at the end of the last record yielded
+    for record in rawpcap.read_records(filename, position[0]):
+        yield record
+        position[0] += 16 + len(record.data)
@@ -0,0 +1,495 @@
+"""
+Minimal pcap/pcapng reader and header decoder that works on raw bytes without Scapy.
+
+It understands only the headers needed for flow-level preprocessing:
+Ethernet (with 802.1Q/802.1ad tags), Linux cooked capture (SLL and SLL2),
+raw IP and BSD loopback link layers, IPv4, IPv6, TCP and UDP.
+Skipping full dissection makes it much faster than Scapy for these fields.
+"""
+import os
+import struct
+from typing import BinaryIO, Iterator, NamedTuple, Optional
+
+LINKTYPE_NULL = 0
+LINKTYPE_ETHERNET = 1
+LINKTYPE_RAW = 101
+LINKTYPE_LINUX_SLL = 113
+LINKTYPE_IPV4 = 228
+LINKTYPE_IPV6 = 229
+LINKTYPE_LINUX_SLL2 = 276
+_RAW_IP_LINKTYPES = {LINKTYPE_RAW, 12, 14, LINKTYPE_IPV4, LINKTYPE_IPV6}
+
+_PCAP_MAGIC = {
+    b"\xd4\xc3\xb2\xa1": ("<", 1e-6),
+    b"\xa1\xb2\xc3\xd4": (">", 1e-6),
+    b"\x4d\x3c\xb2\xa1": ("<", 1e-9),
+    b"\xa1\xb2\x3c\x4d": (">", 1e-9),
+}
+_PCAPNG_MAGIC = b"\x0a\x0d\x0d\x0a"
+
+_PCAP_HEADER_SIZE = 24
+_READ_SIZE = 1 << 20
+_MAX_RECORD_SIZE = 1 << 26
+_MIN_CHUNK_SIZE = 1 << 23
+
+_ETHERTYPE_IPV4 = 0x0800
+_ETHERTYPE_IPV6 = 0x86DD
+_VLAN_ETHERTYPES = {0x8100, 0x88A8, 0x9100}
+_IPV6_EXTENSION_HEADERS = {0, 43, 60}
+_IPPROTO_TCP = 6
+_IPPROTO_UDP = 17
+
+_ports = struct.Struct("!HH").unpack_from
+
+
+class PcapRecord(NamedTuple):
+    linktype: int
+    timestamp: float
+    length: int  # original length of the packet on the wire
+    data: bytes  # captured bytes, starting from the link layer
+
+
+class RawPacket(NamedTuple):
+    timestamp: float
+    length: int  # original length of the packet on the wire
+    data: bytes  # captured bytes, starting from the link layer
+    version: int  # IP version, 0 for non-IP packets
+    src: bytes  # packed source address
+    dst: bytes  # packed destination address
+    proto: int  # IP protocol number
+    sport: int  # 0 if there is no TCP/UDP header
+    dport: int
+    tcp_flags: int
+    payload_offset: int  # offset of the transport payload in data
+    transport_offset: int  # offset of the transport header in data
+    payload_end: int  # end of the IP packet in data, link-layer padding excluded
+    # (identification, offset in bytes) if the packet is a fragment of an IP datagram
+    fragment: Optional[tuple[int, int]] = None
+
+
+def read_records(
+    filename: str,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    nanoseconds: bool = False,
+) -> Iterator[PcapRecord]:
+    """
+    Iterates over the records of a pcap or pcapng file without dissecting them.
+    A truncated last record (e.g., of a capture that is still being written) is skipped.
+
+    For pcap files, `start` and `end` limit reading to the records that begin
+    in this byte range; `start` must be a record boundary (see `split`).
+    If `nanoseconds` is set, timestamps are exact integer numbers of nanoseconds
+    instead of seconds (a float keeps current timestamps only to a quarter of a microsecond).
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(4)
+        if magic == _PCAPNG_MAGIC:
+            if start is not None or end is not None:
+                raise ValueError("Byte ranges are not supported for pcapng files")
+            f.seek(0)
+            yield from _pcapng_records(f, nanoseconds)
+        elif magic in _PCAP_MAGIC:
+            yield from _pcap_records(f, *_PCAP_MAGIC[magic], start, end, nanoseconds)
+        else:
+            raise ValueError(f"{filename} is not a pcap or pcapng file")
+
+
+def _pcap_records(
+    f: BinaryIO,
+    byteorder: str,
+    resolution: float,
+    start: Optional[int] = None,
+    end: Optional[int] = None,
+    nanoseconds: bool = False,
+) -> Iterator[PcapRecord]:
+    header = f.read(20)
+    if len(header) < 20:
+        return
+    if nanoseconds:
+        second, unit = 1_000_000_000, round(resolution * 1e9)
+    else:
+        second, unit = 1, resolution
+    linktype = struct.unpack(byteorder + "I", header[16:20])[0] & 0x0FFFFFFF
+    unpack_from = struct.Struct(byteorder + "IIII").unpack_from
+
+    offset = start or _PCAP_HEADER_SIZE  # file offset of the buffer start
+    f.seek(offset)
+    buffer = b""
+    position = 0
+    while chunk := f.read(_READ_SIZE):
+        offset += position
+        buffer = buffer[position:] + chunk
+        position = 0
+        size = len(buffer)
+        limit = size if end is None else end - offset
+        while position + 16 <= size and position < limit:
+            seconds, fraction, caplen, length = unpack_from(buffer, position)
+            if caplen > _MAX_RECORD_SIZE:
+                raise ValueError(f"Corrupted pcap record at {offset + position}")
+            stop = position + 16 + caplen
+            if stop > size:
+                break
+            yield PcapRecord(
+                linktype,
+                seconds * second + fraction * unit,
+                length,
+                buffer[position + 16 : stop],
+            )
+            position = stop
+        if end is not None and position >= limit:
+            return
+
+
+def split(filename: str, parts: int) -> list[tuple[int, Optional[int]]]:
+    """
+    Splits a pcap file into at most `parts` byte ranges that start at record boundaries,
+    to be read independently with `read_records`.
+    pcapng files and small files are not split.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        magic = f.read(4)
+        if magic not in _PCAP_MAGIC or size < 2 * _MIN_CHUNK_SIZE or parts < 2:
+            return [(None, None)]
+
+        byteorder, resolution = _PCAP_MAGIC[magic]
+        snaplen = struct.unpack(byteorder + "I", f.read(20)[12:16])[0] or 1 << 18
+        unpack = struct.Struct(byteorder + "IIII").unpack
+        f.seek(_PCAP_HEADER_SIZE)
+        first = f.read(16)
+        if len(first) < 16:
+            return [(None, None)]
+        limits = (
+            snaplen,
+            round(1 / resolution),
+            unpack(first)[0] - 86400,
+            unpack(first)[0] + 86400 * 366,
+        )
+
+        parts = min(parts, size // _MIN_CHUNK_SIZE)
+        boundaries = [_PCAP_HEADER_SIZE]
+        for i in range(1, parts):
+            position = max(size * i // parts, boundaries[-1])
+            while position < size and not _is_record_boundary(
+                f, position, size, unpack, limits
+            ):
+                position += 1
+            if position >= size:
+                break
+            if position > boundaries[-1]:
+                boundaries.append(position)
+    ranges = list(zip(boundaries, boundaries[1:] + [None]))
+    ranges[0] = (None, ranges[0][1])
+    return ranges
+
+
+def _is_record_boundary(
+    f: BinaryIO, position: int, size: int, unpack, limits: tuple, depth: int = 16
+) -> bool:
+    # there are no markers between pcap records, so a position is accepted
+    # only if it starts a chain of records with plausible headers
+    snaplen, fraction_limit, min_seconds, max_seconds = limits
+    for _ in range(depth):
+        if position + 16 > size:
+            return True
+        f.seek(position)
+        seconds, fraction, caplen, length = unpack(f.read(16))
+        if (
+            caplen > snaplen
+            or caplen > length
+            or length > _MAX_RECORD_SIZE
+            or fraction >= fraction_limit
+            or not min_seconds <= seconds <= max_seconds
+        ):
+            return False
+        position += 16 + caplen
+    return True
+
+
+def timestamp_resolution(filename: str) -> int:
+    """
+    Returns the timestamp resolution of a pcap or pcapng file as a pcapng `if_tsresol` value
+    (6 for microseconds, 9 for nanoseconds); of the first interface for pcapng files.
+    """
+    with open(filename, "rb") as f:
+        magic = f.read(4)
+        if magic in _PCAP_MAGIC:
+            return 6 if _PCAP_MAGIC[magic][1] == 1e-6 else 9
+        if magic != _PCAPNG_MAGIC:
+            raise ValueError(f"{filename} is not a pcap or pcapng file")
+        f.seek(0)
+        byteorder = "<"
+        while len(head := f.read(8)) == 8:
+            if head[:4] == _PCAPNG_MAGIC:
+                byteorder = "<" if f.read(4) == b"\x4d\x3c\x2b\x1a" else ">"
+                f.read(struct.unpack(byteorder + "I", head[4:])[0] - 12)
+                continue
+            kind, total = struct.unpack(byteorder + "II", head)
+            body = f.read(total - 8)
+            if kind == 1:
+                return _pcapng_resolution(body, 8, byteorder)
+    return 6
+
+
+def _pcapng_records(f: BinaryIO, nanoseconds: bool = False) -> Iterator[PcapRecord]:
+    byteorder = "<"
+    # (linktype, snaplen, resolution, scale, divisor) of each interface,
+    # a timestamp is ticks * resolution seconds or ticks * scale // divisor nanoseconds
+    interfaces = []
+
+    while len(head := f.read(8)) == 8:
+        if head[:4] == _PCAPNG_MAGIC:
+            # section header: byte order is defined by the magic at the body start
+            byteorder = "<" if f.read(4) == b"\x4d\x3c\x2b\x1a" else ">"
+            total = struct.unpack(byteorder + "I", head[4:])[0]
+            f.read(total - 12)
+            interfaces = []
+            continue
+
+        kind, total = struct.unpack(byteorder + "II", head)
+        if total < 12 or total > _MAX_RECORD_SIZE:
+            raise ValueError(f"Corrupted pcapng block at {f.tell() - 8}")
+        body = f.read(total - 8)
+        if len(body) < total - 8:
+            return
+
+        if kind == 1:  # interface description
+            linktype, _, snaplen = struct.unpack_from(byteorder + "HHI", body)
+            interfaces.append(
+                (linktype, snaplen)
+                + _pcapng_scale(_pcapng_resolution(body, 8, byteorder))
+            )
+        elif kind == 6:  # enhanced packet
+            interface, high, low, caplen, length = struct.unpack_from(
+                byteorder + "IIIII", body
+            )
+            linktype, _, resolution, scale, divisor = interfaces[interface]
+            ticks = (high << 32) | low
+            yield PcapRecord(
+                linktype,
+                ticks * scale // divisor if nanoseconds else ticks * resolution,
+                length,
+                body[20 : 20 + caplen],
+            )
+        elif kind == 3:  # simple packet
+            length = struct.unpack_from(byteorder + "I", body)[0]
+            linktype, snaplen = interfaces[0][:2]
+            caplen = min(length, snaplen) if snaplen else length
+            yield PcapRecord(
+                linktype, 0 if nanoseconds else 0.0, length, body[4 : 4 + caplen]
+            )
+        elif kind == 2:  # obsolete packet block
+            interface, _, high, low, caplen, length = struct.unpack_from(
+                byteorder + "HHIIII", body
+            )
+            linktype, _, resolution, scale, divisor = interfaces[interface]
+            ticks = (high << 32) | low
+            yield PcapRecord(
+                linktype,
+                ticks * scale // divisor if nanoseconds else ticks * resolution,
+                length,
+                body[20 : 20 + caplen],
+            )
+
+
+def _pcapng_resolution(body: bytes, offset: int, byteorder: str) -> int:
+    # looks for the if_tsresol option, default resolution is microseconds
+    while offset + 4 <= len(body) - 4:
+        code, size = struct.unpack_from(byteorder + "HH", body, offset)
+        if code == 0:
+            break
+        if code == 9 and size >= 1:
+            return body[offset + 4]
+        offset += 4 + ((size + 3) & ~3)
+    return 6
+
+
+def _pcapng_scale(tsresol: int) -> tuple[float, int, int]:
+    # resolution in seconds, and scale and divisor of ticks to nanoseconds
+    if tsresol & 0x80:
+        exponent = tsresol & 0x7F
+        return 2.0**-exponent, 1_000_000_000, 1 << exponent
+    if tsresol <= 9:
+        return 10.0**-tsresol, 10 ** (9 - tsresol), 1
+    return 10.0**-tsresol, 1, 10 ** (tsresol - 9)
+
+
+def decode(record: PcapRecord) -> RawPacket:
+    """
+    Decodes link, network and transport headers of a record.
+    Packets that are not IPv4/IPv6 are returned with version 0.
+    """
+    linktype, timestamp, length, data = record
+    size = len(data)
+
+    if linktype == LINKTYPE_ETHERNET:
+        if size < 14:
+            return RawPacket(timestamp, length, data, 0, b"", b"", 0, 0, 0, 0, 0, 0, 0)
+        ethertype = (data[12] << 8) | data[13]
+        offset = 14
+        while ethertype in _VLAN_ETHERTYPES and size >= offset + 4:
+            ethertype = (data[offset + 2] << 8) | data[offset + 3]
+            offset += 4
+    elif linktype in _RAW_IP_LINKTYPES:
+        offset = 0
+        version = data[0] >> 4 if size else 0
+        ethertype = _ETHERTYPE_IPV4 if version == 4 else _ETHERTYPE_IPV6
+    elif linktype == LINKTYPE_LINUX_SLL:
+        offset = 16
+        ethertype = (data[14] << 8) | data[15] if size >= 16 else 0
+    elif linktype == LINKTYPE_LINUX_SLL2:
+        offset = 20
+        ethertype = (data[0] << 8) | data[1] if size >= 20 else 0
+    elif linktype == LINKTYPE_NULL:
+        offset = 4
+        # address family is in the byte order of the capturing host
+        family = (data[0] | data[3]) if size >= 4 else 0
+        ethertype = _ETHERTYPE_IPV4 if family == 2 else _ETHERTYPE_IPV6
+    else:
+        ethertype = offset = 0
+
+    fragment = None
+    if ethertype == _ETHERTYPE_IPV4 and size >= offset + 20:
+        if data[offset] >> 4 != 4:
+            return RawPacket(timestamp, length, data, 0, b"", b"", 0, 0, 0, 0, 0, 0, 0)
+        version = 4
+        proto = data[offset + 9]
+        src = data[offset + 12 : offset + 16]
+        dst = data[offset + 16 : offset + 20]
+        transport = offset + (data[offset] & 0x0F) * 4
+        total = (data[offset + 2] << 8) | data[offset + 3]
+        end = min(size, offset + total) if total else size
+        if data[offset + 6] & 0x3F or data[offset + 7]:  # more fragments or offset
+            fragment = (
+                (data[offset + 4] << 8) | data[offset + 5],
+                (((data[offset + 6] & 0x1F) << 8) | data[offset + 7]) * 8,
+            )
+        # only the first fragment carries the transport header
+        if (data[offset + 6] & 0x1F) or data[offset + 7]:
+            return RawPacket(
+                timestamp,
+                length,
+                data,
+                4,
+                src,
+                dst,
+                proto,
+                0,
+                0,
+                0,
+                transport,
+                transport,
+                end,
+                fragment,
+            )
+    elif ethertype == _ETHERTYPE_IPV6 and size >= offset + 40:
+        if data[offset] >> 4 != 6:
+            return RawPacket(timestamp, length, data, 0, b"", b"", 0, 0, 0, 0, 0, 0, 0)
+        version = 6
+        proto = data[offset + 6]
+        src = data[offset + 8 : offset + 24]
+        dst = data[offset + 24 : offset + 40]
+        transport = offset + 40
+        total = (data[offset + 4] << 8) | data[offset + 5]
+        end = min(size, transport + total) if total else size
+        while size >= transport + 8:
+            if proto in _IPV6_EXTENSION_HEADERS:
+                proto, transport = (
+                    data[transport],
+                    transport + (data[transport + 1] + 1) * 8,
+                )
+            elif proto == 51:  # authentication header
+                proto, transport = (
+                    data[transport],
+                    transport + (data[transport + 1] + 2) * 4,
+                )
+            elif proto == 44:  # fragment
+                proto = data[transport]
+                fragment = (
+                    int.from_bytes(data[transport + 4 : transport + 8], "big"),
+                    ((data[transport + 2] << 8) | data[transport + 3]) & 0xFFF8,
+                )
+                transport += 8
+                if fragment[1]:
+                    return RawPacket(
+                        timestamp,
+                        length,
+                        data,
+                        6,
+                        src,
+                        dst,
+                        proto,
+                        0,
+                        0,
+                        0,
+                        transport,
+                        transport,
+                        end,
+                        fragment,
+                    )
+            else:
+                break
+    else:
+        return RawPacket(timestamp, length, data, 0, b"", b"", 0, 0, 0, 0, 0, 0, 0)
+
+    if proto == _IPPROTO_TCP and size >= transport + 14:
+        sport, dport = _ports(data, transport)
+        return RawPacket(
+            timestamp,
+            length,
+            data,
+            version,
+            src,
+            dst,
+            proto,
+            sport,
+            dport,
+            data[transport + 13],
+            transport + (data[transport + 12] >> 4) * 4,
+            transport,
+            end,
+            fragment,
+        )
+    if proto == _IPPROTO_UDP and size >= transport + 8:
+        sport, dport = _ports(data, transport)
+        return RawPacket(
+            timestamp,
+            length,
+            data,
+            version,
+            src,
+            dst,
+            proto,
+            sport,
+            dport,
+            0,
+            transport + 8,
+            transport,
+            end,
+            fragment,
+        )
+    return RawPacket(
+        timestamp,
+        length,
+        data,
+        version,
+        src,
+        dst,
+        proto,
+        0,
+        0,
+        0,
+        transport,
+        transport,
+        end,
+        fragment,
+    )
+
+
+def read_packets(filename: str) -> Iterator[RawPacket]:
+    """
+    Iterates over decoded packets of a pcap or pcapng file.
+    """
+    for record in read_records(filename):
+        yield decode(record)
@@ -3,93 +3,726 @@ This module contains various Scapy tasks for preprocessing the data on edge node
 
 These tasks are mainly examples and not an exhaustive list of all possible tasks.
 """
-from abc import ABC
+import copy
+import multiprocessing
+import os
+import socket
+from abc import ABC, abstractmethod
+from array import array
+from multiprocessing.connection import wait
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    Literal,
+    Optional,
+    Sequence,
+    Union,
+)
 
 from netunicorn.base import Task
+from netunicorn.library.tasks.preprocessing import export, rawpcap, streams
+from netunicorn.library.tasks.preprocessing.bpf import BPFFilter
 
 
-class _ScapyTask(Task, ABC):
-    requirements = ["pip install scapy"]
+class Extractor(ABC):
+    """
+    Collects a result from the packets of a capture, one packet at a time.
 
+    Extractors are independent of each other, so several of them can be fed
+    from a single read of the capture file (see `ExtractFromPcap`).
 
-class Get5Tuples(_ScapyTask):
-    def __init__(self, filename: str, *args, **kwargs):
-        self.filename = filename
-        super().__init__(*args, **kwargs)
+    If `raw` is True, `process` receives a `rawpcap.RawPacket` decoded
+    without Scapy instead of a Scapy packet.
 
-    def run(self) -> list[tuple[str, str, int, int, str]]:
-        from scapy.all import IP, TCP, UDP, rdpcap
+    `bpf` is an optional filter (tcpdump syntax) that is evaluated over the raw record
+    before dissection: only matching packets are passed to `process`. The filter must match
+    at least all packets the extractor is interested in, as it is not applied
+    if libpcap is not available.
 
-        packets = rdpcap(self.filename)
-        tuples = []
-        for pkt in packets:
-            if IP in pkt:
-                src_ip = pkt[IP].src
-                dst_ip = pkt[IP].dst
-                src_port = dst_port = proto = None
+    To process a capture in parallel, extractors implement `merge`,
+    which combines partial results of consecutive parts of the capture.
+    Collected state must be stored in attributes starting with an underscore,
+    as only these attributes are sent back from worker processes.
+    """
 
-                if TCP in pkt:
-                    src_port = pkt[TCP].sport
-                    dst_port = pkt[TCP].dport
-                    proto = "TCP"
-                elif UDP in pkt:
-                    src_port = pkt[UDP].sport
-                    dst_port = pkt[UDP].dport
-                    proto = "UDP"
+    raw: bool = False
+    bpf: Optional[str] = None
 
-                if src_port and dst_port:  # Ensure both ports are present
-                    tuples.append((src_ip, dst_ip, src_port, dst_port, proto))
+    def start(self) -> None:
+        """
+        Called once before the first packet. Resets the collected state.
+        """
 
-        return tuples
+    @abstractmethod
+    def process(self, packet) -> None:
+        raise NotImplementedError
 
+    @abstractmethod
+    def result(self) -> Any:
+        raise NotImplementedError
 
-class GetDNSQueries(_ScapyTask):
-    def __init__(self, filename: str, *args, **kwargs):
-        self.filename = filename
-        super().__init__(*args, **kwargs)
+    def merge(self, other: "Extractor") -> None:
+        """
+        Adds the state of another extractor of the same type
+        that processed the packets following the packets of this extractor.
+        """
+        raise NotImplementedError(
+            f"{type(self).__name__} does not support parallel processing"
+        )
 
-    def run(self) -> list[str]:
-        from scapy.all import DNSQR, rdpcap
+    def columns(self) -> dict[str, Sequence[Any]]:
+        """
+        Returns the result as named columns of equal length, used to export it to files.
+        """
+        return {"value": list(self.result())}
 
-        pcap = rdpcap(self.filename)
-        return [pkt[DNSQR].qname.decode() for pkt in pcap if DNSQR in pkt]
 
+class FiveTuples(Extractor):
+    def __init__(self, ipv6: bool = False):
+        self.ipv6 = ipv6
+        self.bpf = "tcp or udp" if ipv6 else "ip and (tcp or udp)"
 
-class GetHTTPHostHeaders(_ScapyTask):
-    def __init__(self, filename: str, *args, **kwargs):
-        self.filename = filename
-        super().__init__(*args, **kwargs)
+    def start(self) -> None:
+        from scapy.all import IP, TCP, UDP, IPv6
+
+        self._layers = IP, IPv6, TCP, UDP
+        self._tuples = []
+
+    def process(self, pkt) -> None:
+        IP, IPv6, TCP, UDP = self._layers
+        if IP not in pkt and self.ipv6 and IPv6 in pkt:
+            IP = IPv6
+        if IP in pkt:
+            src_ip = pkt[IP].src
+            dst_ip = pkt[IP].dst
+            src_port = dst_port = proto = None
+
+            if TCP in pkt:
+                src_port = pkt[TCP].sport
+                dst_port = pkt[TCP].dport
+                proto = "TCP"
+            elif UDP in pkt:
+                src_port = pkt[UDP].sport
+                dst_port = pkt[UDP].dport
+                proto = "UDP"
+
+            if src_port and dst_port:  # Ensure both ports are present
+                self._tuples.append((src_ip, dst_ip, src_port, dst_port, proto))
+
+    def result(self) -> list[tuple[str, str, int, int, str]]:
+        return self._tuples
+
+    def merge(self, other: "FiveTuples") -> None:
+        self._tuples.extend(other._tuples)
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        names = ["src_ip", "dst_ip", "src_port", "dst_port", "proto"]
+        if not self._tuples:
+            return {name: [] for name in names}
+        return {name: list(x) for name, x in zip(names, zip(*self._tuples))}
 
-    def run(self) -> list[bytes]:
-        from scapy.all import Raw, rdpcap
 
-        packets = rdpcap(self.filename)
+class RawFiveTuples(Extractor):
+    """
+    Same tuples as `FiveTuples`, but headers are parsed directly from the record bytes
+    without Scapy, which is an order of magnitude faster.
+
+    With `columnar=True`, the result is a dict of columns instead of a list of tuples:
+    src_ip and dst_ip as lists of strings, src_port and dst_port as arrays of
+    unsigned shorts, and proto as an array of IP protocol numbers.
+    """
+
+    raw = True
+
+    def __init__(self, ipv6: bool = False, columnar: bool = False):
+        self.ipv6 = ipv6
+        self.columnar = columnar
+
+    def start(self) -> None:
+        self._addresses = {}
+        self._src_ip = []
+        self._dst_ip = []
+        self._src_port = array("H")
+        self._dst_port = array("H")
+        self._proto = array("B")
+
+    def _address(self, packed: bytes) -> str:
+        # captures usually contain few distinct addresses, so conversions are cached
+        if (address := self._addresses.get(packed)) is None:
+            family = socket.AF_INET if len(packed) == 4 else socket.AF_INET6
+            address = self._addresses[packed] = socket.inet_ntop(family, packed)
+        return address
+
+    def process(self, packet: rawpcap.RawPacket) -> None:
+        if packet.sport and packet.dport and (packet.version == 4 or self.ipv6):
+            self._src_ip.append(self._address(packet.src))
+            self._dst_ip.append(self._address(packet.dst))
+            self._src_port.append(packet.sport)
+            self._dst_port.append(packet.dport)
+            self._proto.append(packet.proto)
+
+    def result(self) -> Union[list[tuple[str, str, int, int, str]], dict[str, Any]]:
+        if self.columnar:
+            return {
+                "src_ip": self._src_ip,
+                "dst_ip": self._dst_ip,
+                "src_port": self._src_port,
+                "dst_port": self._dst_port,
+                "proto": self._proto,
+            }
+        names = {6: "TCP", 17: "UDP"}
         return [
-            bytes(pkt[Raw]).split(b"\r\n")[1]
-            for pkt in packets
-            if Raw in pkt and b"Host:" in bytes(pkt[Raw])
+            (src_ip, dst_ip, src_port, dst_port, names[proto])
+            for src_ip, dst_ip, src_port, dst_port, proto in zip(
+                self._src_ip, self._dst_ip, self._src_port, self._dst_port, self._proto
+            )
         ]
 
+    def merge(self, other: "RawFiveTuples") -> None:
+        self._src_ip.extend(other._src_ip)
+        self._dst_ip.extend(other._dst_ip)
+        self._src_port.extend(other._src_port)
+        self._dst_port.extend(other._dst_port)
+        self._proto.extend(other._proto)
 
-class GetICMPRequests(_ScapyTask):
-    def __init__(self, filename: str, *args, **kwargs):
+    def columns(self) -> dict[str, Sequence[Any]]:
+        names = {6: "TCP", 17: "UDP"}
+        return {
+            "src_ip": self._src_ip,
+            "dst_ip": self._dst_ip,
+            "src_port": self._src_port,
+            "dst_port": self._dst_port,
+            "proto": [names[proto] for proto in self._proto],
+        }
+
+
+class DNSQueries(Extractor):
+    # ports of DNS, mDNS and LLMNR
+    bpf = "port 53 or port 5353 or port 5355"
+
+    def start(self) -> None:
+        from scapy.all import DNSQR
+
+        self._layer = DNSQR
+        self._queries = []
+
+    def process(self, pkt) -> None:
+        if self._layer in pkt:
+            self._queries.append(pkt[self._layer].qname.decode())
+
+    def result(self) -> list[str]:
+        return self._queries
+
+    def merge(self, other: "DNSQueries") -> None:
+        self._queries.extend(other._queries)
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        return {"qname": self._queries}
+
+
+class HTTPHostHeaders(Extractor):
+    """
+    Host header lines of HTTP/1.x requests (e.g., b"Host: example.com").
+
+    Requests are found by scanning reassembled TCP streams (see `streams.scan_http_request`),
+    so headers in any position and requests split across segments are handled.
+    With parallel processing, requests split between parts of the capture are missed.
+    """
+
+    raw = True
+
+    def start(self) -> None:
+        self._streams = {}
+        self._headers = []
+
+    def process(self, packet: rawpcap.RawPacket) -> None:
+        streams.reassemble(
+            self._streams, packet, streams.scan_http_request, self._headers
+        )
+
+    def result(self) -> list[bytes]:
+        return self._headers
+
+    def merge(self, other: "HTTPHostHeaders") -> None:
+        self._headers.extend(other._headers)
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        return {"host": self._headers}
+
+
+class TLSServerNames(Extractor):
+    """
+    Server names (SNI) from TLS ClientHello messages, one per connection.
+
+    ClientHello messages split across TCP segments are reassembled.
+    With parallel processing, messages split between parts of the capture are missed.
+    """
+
+    raw = True
+
+    def start(self) -> None:
+        self._streams = {}
+        self._names = []
+
+    def process(self, packet: rawpcap.RawPacket) -> None:
+        streams.reassemble(
+            self._streams, packet, streams.scan_tls_client_hello, self._names
+        )
+
+    def result(self) -> list[str]:
+        return self._names
+
+    def merge(self, other: "TLSServerNames") -> None:
+        self._names.extend(other._names)
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        return {"server_name": self._names}
+
+
+class ICMPRequests(Extractor):
+    bpf = "icmp[icmptype] == icmp-echo"
+
+    def start(self) -> None:
+        from scapy.all import ICMP
+
+        self._layer = ICMP
+        self._requests = []
+
+    def process(self, pkt) -> None:
+        if self._layer in pkt and pkt[self._layer].type == 8:
+            self._requests.append(pkt)
+
+    def result(self) -> list:
+        return self._requests
+
+    def merge(self, other: "ICMPRequests") -> None:
+        self._requests.extend(other._requests)
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        # packet fields instead of whole packets, which are expensive to serialize
+        icmp = [pkt[self._layer] for pkt in self._requests]
+        return {
+            "time": array("d", (float(pkt.time) for pkt in self._requests)),
+            "src": [x.underlayer.src for x in icmp],
+            "dst": [x.underlayer.dst for x in icmp],
+            "id": array("H", (x.id for x in icmp)),
+            "seq": array("H", (x.seq for x in icmp)),
+            "length": array("I", (len(pkt) for pkt in self._requests)),
+        }
+
+
+class UniqueARPMAC(Extractor):
+    bpf = "arp"
+
+    def start(self) -> None:
+        from scapy.all import ARP
+
+        self._layer = ARP
+        self._macs = set()
+
+    def process(self, pkt) -> None:
+        if self._layer in pkt:
+            self._macs.add(pkt[self._layer].hwsrc)
+
+    def result(self) -> set:
+        return self._macs
+
+    def merge(self, other: "UniqueARPMAC") -> None:
+        self._macs.update(other._macs)
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        return {"mac": sorted(self._macs)}
+
+
+class CallableExtractor(Extractor):
+    """
+    Wraps a user function that takes a packet and returns a value.
+    Values other than None are collected into a list.
+    """
+
+    def __init__(
+        self,
+        function: Callable[[Any], Any],
+        raw: bool = False,
+        bpf: Optional[str] = None,
+    ):
+        self.function = function
+        self.raw = raw
+        self.bpf = bpf
+
+    def start(self) -> None:
+        self._values = []
+
+    def process(self, packet) -> None:
+        value = self.function(packet)
+        if value is not None:
+            self._values.append(value)
+
+    def result(self) -> list:
+        return self._values
+
+    def merge(self, other: "CallableExtractor") -> None:
+        self._values.extend(other._values)
+
+
+class PacketCounter(Extractor):
+    """
+    Counts packets and bytes (original length) per IP protocol.
+    Non-IP packets are counted as protocol -1.
+    """
+
+    raw = True
+
+    def start(self) -> None:
+        self._packets = {}
+        self._bytes = {}
+
+    def process(self, packet: rawpcap.RawPacket) -> None:
+        proto = packet.proto if packet.version else -1
+        self._packets[proto] = self._packets.get(proto, 0) + 1
+        self._bytes[proto] = self._bytes.get(proto, 0) + packet.length
+
+    def result(self) -> dict[int, tuple[int, int]]:
+        return {x: (self._packets[x], self._bytes[x]) for x in sorted(self._packets)}
+
+    def merge(self, other: "PacketCounter") -> None:
+        for proto, packets in other._packets.items():
+            self._packets[proto] = self._packets.get(proto, 0) + packets
+            self._bytes[proto] = self._bytes.get(proto, 0) + other._bytes[proto]
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        protos = sorted(self._packets)
+        return {
+            "proto": protos,
+            "packets": [self._packets[x] for x in protos],
+            "bytes": [self._bytes[x] for x in protos],
+        }
+
+
+class PacketSampler(Extractor):
+    """
+    Keeps (timestamp, length, data) of every `every`-th packet,
+    with data truncated to `snaplen` bytes.
+    """
+
+    raw = True
+
+    def __init__(self, every: int = 100, snaplen: int = 128):
+        self.every = every
+        self.snaplen = snaplen
+
+    def start(self) -> None:
+        self._seen = 0
+        self._samples = []
+
+    def process(self, packet: rawpcap.RawPacket) -> None:
+        if self._seen % self.every == 0:
+            self._samples.append(
+                (packet.timestamp, packet.length, packet.data[: self.snaplen])
+            )
+        self._seen += 1
+
+    def result(self) -> list[tuple[float, int, bytes]]:
+        return self._samples
+
+    def columns(self) -> dict[str, Sequence[Any]]:
+        return {
+            "time": array("d", (x[0] for x in self._samples)),
+            "length": array("Q", (x[1] for x in self._samples)),
+            "data": [x[2] for x in self._samples],
+        }
+
+
+class _ScapyTask(Task, ABC):
+    """
+    Base class for tasks that read a capture file with Scapy.
+
+    By default, the whole capture is loaded into memory with `rdpcap`.
+    With `streaming=True`, records are read one at a time, checked against the `bpf`
+    prefilters of the extractors, and dissected only if some extractor needs them,
+    so memory usage does not depend on the capture size. Captures are always streamed
+    if there are raw extractors or `workers` > 1.
+
+    `filename` can also be a list of files (e.g., a rotated capture set),
+    which are processed in the given order.
+    With `workers` > 1, pcap files are split into parts at record boundaries
+    and processed in parallel worker processes. Partial results are merged
+    in the order of the parts, so the output is the same as with a single worker.
+
+    If `output_path` is set, results are written to a columnar file on the node
+    (see `export.write_columns`) and the task returns `export.ExportedFile`
+    with the path and a short summary instead of the results themselves.
+    For tasks with several extractors, `output_path` is a directory with one file per extractor.
+    """
+
+    requirements = ["pip install scapy"]
+
+    def __init__(
+        self,
+        filename: Union[str, list[str]],
+        *args,
+        streaming: bool = False,
+        output_path: Optional[str] = None,
+        output_format: export.ExportFormat = "auto",
+        workers: int = 1,
+        **kwargs,
+    ):
         self.filename = filename
+        self.streaming = streaming
+        self.output_path = output_path
+        self.output_format = output_format
+        self.workers = workers
         super().__init__(*args, **kwargs)
+        if output_format in {"parquet", "arrow"}:
+            self.add_requirement("pip install pyarrow")
+
+    @property
+    def filenames(self) -> list[str]:
+        return [self.filename] if isinstance(self.filename, str) else self.filename
+
+    def _packets(self) -> Iterator:
+        from scapy.all import rdpcap
+
+        for filename in self.filenames:
+            yield from rdpcap(filename)
+
+    def _extract(self, extractors: list[Extractor]) -> list[Any]:
+        self._feed(extractors)
+        if self.output_path is None:
+            return [extractor.result() for extractor in extractors]
+
+        if len(extractors) == 1:
+            paths = [self.output_path]
+        else:
+            extension = export.extension(self.output_format)
+            paths = [
+                os.path.join(self.output_path, f"{i}_{type(x).__name__}{extension}")
+                for i, x in enumerate(extractors)
+            ]
+        return [
+            export.write_columns(extractor.columns(), path, self.output_format)
+            for extractor, path in zip(extractors, paths)
+        ]
+
+    def _feed(self, extractors: list[Extractor]) -> None:
+        for extractor in extractors:
+            extractor.start()
+
+        if self.workers > 1:
+            parts = [
+                (filename, start, end)
+                for filename in self.filenames
+                for start, end in rawpcap.split(filename, self.workers)
+            ]
+            for states in _process_parts(extractors, parts, self.workers):
+                for extractor, state in zip(extractors, states):
+                    other = copy.copy(extractor)
+                    other.__dict__.update(state)
+                    extractor.merge(other)
+        elif self.streaming or any(x.raw for x in extractors):
+            for filename in self.filenames:
+                _feed_records(extractors, rawpcap.read_records(filename))
+        else:
+            # prefilters only skip dissection, the extractors check the packets themselves
+            for pkt in self._packets():
+                for extractor in extractors:
+                    extractor.process(pkt)
+
+
+def _feed_records(
+    extractors: list[Extractor], records: Iterable[rawpcap.PcapRecord]
+) -> None:
+    filters = {x.bpf: BPFFilter(x.bpf) for x in extractors if x.bpf}
+    raw_extractors = [(x, filters.get(x.bpf)) for x in extractors if x.raw]
+    scapy_extractors = [(x, filters.get(x.bpf)) for x in extractors if not x.raw]
+
+    # records are read once, filtered, and decoded or dissected only if some extractor needs it
+    for record in records:
+        linktype, _, length, data = record
+        if raw_extractors:
+            packet = None
+            for extractor, bpf in raw_extractors:
+                if bpf is None or bpf.matches(linktype, data, length):
+                    if packet is None:
+                        packet = rawpcap.decode(record)
+                    extractor.process(packet)
+        if scapy_extractors:
+            pkt = None
+            for extractor, bpf in scapy_extractors:
+                if bpf is None or bpf.matches(linktype, data, length):
+                    if pkt is None:
+                        pkt = _dissect(record)
+                    extractor.process(pkt)
+
 
+def _process_parts(
+    extractors: list[Extractor],
+    parts: list[tuple[str, Optional[int], Optional[int]]],
+    workers: int,
+) -> Iterator[list[dict[str, Any]]]:
+    """
+    Feeds copies of the extractors with each part of the capture in a separate process
+    and yields their collected state in the order of the parts.
+
+    Workers are forked, so extractors (and user functions in them) are not pickled on start.
+    Library classes are shipped to nodes by value and cannot be reliably pickled back,
+    so only the collected state of the extractors is returned.
+    """
+    import cloudpickle
+
+    context = multiprocessing.get_context("fork")
+    running = {}  # connection -> (part index, process)
+    finished = {}
+    next_part = next_result = 0
+    while next_result < len(parts):
+        while next_part < len(parts) and len(running) < workers:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(
+                target=_process_part,
+                args=(sender, extractors, *parts[next_part]),
+                daemon=True,
+            )
+            process.start()
+            sender.close()
+            running[receiver] = (next_part, process)
+            next_part += 1
+
+        for receiver in wait(list(running)):
+            index, process = running.pop(receiver)
+            try:
+                finished[index] = cloudpickle.loads(receiver.recv_bytes())
+            except EOFError:
+                finished[index] = RuntimeError(
+                    f"Worker for part {parts[index]} exited unexpectedly"
+                )
+            receiver.close()
+            process.join()
+
+        while next_result in finished:
+            partial = finished.pop(next_result)
+            if isinstance(partial, BaseException):
+                for _, process in running.values():
+                    process.kill()
+                raise partial
+            yield partial
+            next_result += 1
+
+
+def _process_part(
+    connection,
+    extractors: list[Extractor],
+    filename: str,
+    start: Optional[int],
+    end: Optional[int],
+) -> None:
+    import cloudpickle
+
+    try:
+        for extractor in extractors:
+            extractor.start()
+        _feed_records(extractors, rawpcap.read_records(filename, start, end))
+        states = [
+            {k: v for k, v in vars(extractor).items() if k.startswith("_")}
+            for extractor in extractors
+        ]
+        connection.send_bytes(cloudpickle.dumps(states))
+    except BaseException as e:
+        connection.send_bytes(cloudpickle.dumps(e))
+    finally:
+        connection.close()
+
+
+def _dissect(record: rawpcap.PcapRecord):
+    from scapy.all import conf
+
+    layer = conf.l2types.num2layer.get(record.linktype, conf.raw_layer)
+    pkt = layer(record.data)
+    pkt.time = record.timestamp
+    pkt.wirelen = record.length
+    return pkt
+
+
+class Get5Tuples(_ScapyTask):
+    """
+    Returns (src_ip, dst_ip, src_port, dst_port, proto) of every TCP and UDP packet.
+
+    With `engine="raw"`, headers are parsed without Scapy (see `RawFiveTuples`),
+    which also allows `columnar=True` output.
+    IPv6 packets are included only if `ipv6` is True.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        *args,
+        engine: Literal["scapy", "raw"] = "scapy",
+        columnar: bool = False,
+        ipv6: bool = False,
+        **kwargs,
+    ):
+        if columnar and engine != "raw":
+            raise ValueError("Columnar output is only supported with engine='raw'")
+        self.engine = engine
+        self.columnar = columnar
+        self.ipv6 = ipv6
+        super().__init__(filename, *args, **kwargs)
+
+    def run(self) -> Union[list[tuple[str, str, int, int, str]], dict[str, Any]]:
+        if self.engine == "raw":
+            return self._extract([RawFiveTuples(self.ipv6, self.columnar)])[0]
+        return self._extract([FiveTuples(self.ipv6)])[0]
+
+
+class GetDNSQueries(_ScapyTask):
+    def run(self) -> list[str]:
+        return self._extract([DNSQueries()])[0]
+
+
+class GetHTTPHostHeaders(_ScapyTask):
     def run(self) -> list[bytes]:
-        from scapy.all import ICMP, rdpcap
+        return self._extract([HTTPHostHeaders()])[0]
 
-        packets = rdpcap(self.filename)
-        return [pkt for pkt in packets if ICMP in pkt and pkt[ICMP].type == 8]
 
+class GetTLSServerNames(_ScapyTask):
+    def run(self) -> list[str]:
+        return self._extract([TLSServerNames()])[0]
 
-class GetUniqueARPMAC(_ScapyTask):
-    def __init__(self, filename: str, *args, **kwargs):
-        self.filename = filename
-        super().__init__(*args, **kwargs)
 
+class GetICMPRequests(_ScapyTask):
+    def run(self) -> list[bytes]:
+        return self._extract([ICMPRequests()])[0]
+
+
+class GetUniqueARPMAC(_ScapyTask):
     def run(self) -> set:
-        from scapy.all import ARP, rdpcap
+        return self._extract([UniqueARPMAC()])[0]
+
+
+class ExtractFromPcap(_ScapyTask):
+    """
+    Runs several extractors over a single read of the capture file,
+    so the capture is read and dissected only once.
+
+    Extractors can be instances of `Extractor` (e.g., `FiveTuples()`, `DNSQueries()`)
+    or functions that take a packet and return a value (None values are skipped).
+    Raw extractors (e.g., `RawFiveTuples()`) can be mixed with Scapy ones;
+    in this case the capture is always read in streaming mode.
+    Returns a list of results in the order of the given extractors.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        extractors: list[Union[Extractor, Callable[[Any], Any]]],
+        *args,
+        **kwargs,
+    ):
+        self.extractors = [
+            x if isinstance(x, Extractor) else CallableExtractor(x) for x in extractors
+        ]
+        super().__init__(filename, *args, **kwargs)
 
-        packets = rdpcap(self.filename)
-        return {pkt[ARP].hwsrc for pkt in packets if ARP in pkt}
+    def run(self) -> list[Any]:
+        return self._extract(self.extractors)
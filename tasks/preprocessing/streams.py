@@ -0,0 +1,222 @@
+"""
+Lightweight TCP stream reassembly and scanners of application protocol messages.
+
+Streams are reassembled only as far as scanners need: payload is scanned in place
+in the packet data while messages fit into a segment, and buffered only while
+a message is split across segments. Streams that scanners do not recognize are dropped.
+"""
+import re
+import struct
+from typing import Callable, Optional, Union
+
+from netunicorn.library.tasks.preprocessing import rawpcap
+
+Buffer = Union[bytes, bytearray]
+
+# Scans data[start:end] and returns the number of bytes consumed (can be larger than
+# the data to skip a message body) and the values found, or None instead of the number
+# of bytes if the rest of the stream is of no interest.
+Scanner = Callable[[Buffer, int, int], tuple[Optional[int], list]]
+
+MAX_BUFFER_SIZE = 1 << 16
+MAX_PENDING_SEGMENTS = 64
+
+_SEQUENCE, _BUFFER, _SKIP, _PENDING = range(4)  # fields of the stream state
+_FIN, _SYN, _RST = 0x01, 0x02, 0x04
+_MASK = 0xFFFFFFFF
+_HALF = 1 << 31
+
+_sequence = struct.Struct("!I").unpack_from
+_half = struct.Struct("!H").unpack_from
+
+
+def reassemble(
+    streams: dict, packet: rawpcap.RawPacket, scanner: Scanner, values: list
+) -> None:
+    """
+    Feeds the TCP payload of the packet into its stream and appends values
+    found by the scanner to `values`. `streams` holds the state of all streams
+    and is kept between calls. Both directions of a connection are separate streams.
+
+    Out-of-order segments are kept until the missing data arrives and retransmitted data is skipped.
+    Streams that started before the capture are scanned from the first segment with payload.
+    """
+    if packet.proto != 6 or not packet.version or not packet.sport:
+        return
+    data = packet.data
+    flags = packet.tcp_flags
+    key = (packet.src, packet.dst, packet.sport, packet.dport)
+    start, end = packet.payload_offset, packet.payload_end
+    sequence = _sequence(data, packet.transport_offset + 4)[0]
+
+    stream = streams.get(key, False)
+    if stream is False:
+        if flags & _SYN:
+            streams[key] = [(sequence + 1) & _MASK, bytearray(), 0, {}]
+            return
+        if start >= end or flags & _RST:
+            return
+        stream = streams[key] = [sequence, bytearray(), 0, {}]
+
+    if stream is not None and start < end:
+        ahead = (sequence - stream[_SEQUENCE]) & _MASK
+        if ahead and ahead < _HALF:
+            if len(stream[_PENDING]) < MAX_PENDING_SEGMENTS:
+                stream[_PENDING][sequence] = data[start:end]
+            else:
+                streams[key] = None
+        else:
+            # retransmitted data is skipped
+            start += (stream[_SEQUENCE] - sequence) & _MASK
+            if start < end and not _append(stream, data, start, end, scanner, values):
+                streams[key] = None
+            elif stream[_PENDING]:
+                if not _drain(stream, scanner, values):
+                    streams[key] = None
+
+    if flags & (_FIN | _RST):
+        del streams[key]
+
+
+def _drain(stream: list, scanner: Scanner, values: list) -> bool:
+    pending = stream[_PENDING]
+    found = True
+    while found and pending:
+        found = False
+        for sequence in list(pending):
+            behind = (stream[_SEQUENCE] - sequence) & _MASK
+            if behind < _HALF:
+                found = True
+                segment = pending.pop(sequence)
+                if behind < len(segment) and not _append(
+                    stream, segment, behind, len(segment), scanner, values
+                ):
+                    return False
+    return True
+
+
+def _append(
+    stream: list, data: Buffer, start: int, end: int, scanner: Scanner, values: list
+) -> bool:
+    stream[_SEQUENCE] = (stream[_SEQUENCE] + end - start) & _MASK
+    if stream[_SKIP]:
+        skipped = min(stream[_SKIP], end - start)
+        stream[_SKIP] -= skipped
+        start += skipped
+        if start == end:
+            return True
+
+    buffer = stream[_BUFFER]
+    if buffer:
+        buffer += memoryview(data)[start:end]
+        data, start, end = buffer, 0, len(buffer)
+
+    while start < end:
+        consumed, found = scanner(data, start, end)
+        values.extend(found)
+        if consumed is None:
+            return False
+        if not consumed:
+            break
+        start += consumed
+    if start > end:
+        stream[_SKIP] = start - end
+
+    if data is buffer:
+        del buffer[: min(start, end)]
+    elif start < end:
+        buffer += memoryview(data)[start:end]
+    return len(buffer) <= MAX_BUFFER_SIZE
+
+
+_REQUEST_LINE = re.compile(rb"[A-Z]{3,16} [^ \r\n]+ HTTP/1\.[01]\r\n")
+_REQUEST_START = re.compile(rb"[A-Z]{1,16}(?: |$)")
+_HOST = re.compile(rb"\r\n(host[ \t]*:[^\r\n]*)", re.IGNORECASE)
+_CONTENT_LENGTH = re.compile(rb"\r\ncontent-length[ \t]*:[ \t]*(\d+)", re.IGNORECASE)
+_CHUNKED = re.compile(rb"\r\ntransfer-encoding[ \t]*:[^\r\n]*chunked", re.IGNORECASE)
+
+
+def scan_http_request(data: Buffer, start: int, end: int) -> tuple[Optional[int], list]:
+    """
+    Scanner of HTTP/1.x requests that returns the Host header line of each request
+    (e.g., b"Host: example.com"). Request bodies with Content-Length are skipped,
+    so all requests of a persistent connection are found.
+    Scanning stops at chunked request bodies.
+    """
+    line_end = data.find(b"\r\n", start, end)
+    if line_end < 0:
+        if not _REQUEST_START.match(data, start, min(end, start + 17)):
+            return None, []
+        return (0, []) if end - start < MAX_BUFFER_SIZE else (None, [])
+
+    request = _REQUEST_LINE.match(data, start, line_end + 2)
+    if request is None:
+        return None, []
+    headers_end = data.find(b"\r\n\r\n", line_end, end)
+    if headers_end < 0:
+        return (0, []) if end - start < MAX_BUFFER_SIZE else (None, [])
+
+    headers_end += 2
+    host = _HOST.search(data, line_end, headers_end)
+    found = [bytes(host.group(1))] if host else []
+    if _CHUNKED.search(data, line_end, headers_end):
+        return None, found
+    body = _CONTENT_LENGTH.search(data, line_end, headers_end)
+    return headers_end + 2 - start + (int(body.group(1)) if body else 0), found
+
+
+def scan_tls_client_hello(
+    data: Buffer, start: int, end: int
+) -> tuple[Optional[int], list]:
+    """
+    Scanner of TLS streams that returns the server name (SNI) of the ClientHello.
+    The handshake message can span several TLS records.
+    """
+    if data[start] != 22 or (end - start > 1 and data[start + 1] != 3):
+        return None, []
+
+    fragments = []
+    size = 0
+    position = start
+    while position + 5 <= end:
+        if data[position] != 22:
+            return None, []
+        record_end = position + 5 + _half(data, position + 3)[0]
+        if record_end > end:
+            break
+        fragments.append(memoryview(data)[position + 5 : record_end])
+        size += record_end - position - 5
+        position = record_end
+
+        if size < 4:
+            continue
+        message = fragments[0] if len(fragments) == 1 else b"".join(fragments)
+        if message[0] != 1:  # not a ClientHello
+            return None, []
+        message_end = 4 + int.from_bytes(message[1:4], "big")
+        if size >= message_end:
+            name = _server_name(bytes(message[4:message_end]))
+            return None, [name] if name is not None else []
+
+    return (0, []) if end - start < MAX_BUFFER_SIZE else (None, [])
+
+
+def _server_name(hello: bytes) -> Optional[str]:
+    try:
+        position = 34  # version and random
+        position += 1 + hello[position]  # session id
+        position += 2 + _half(hello, position)[0]  # cipher suites
+        position += 1 + hello[position]  # compression methods
+        extensions_end = position + 2 + _half(hello, position)[0]
+        position += 2
+        while position + 4 <= extensions_end:
+            kind, length = struct.unpack_from("!HH", hello, position)
+            position += 4
+            if kind == 0:  # server_name: list length, name type, name length, name
+                name_length = _half(hello, position + 3)[0]
+                name = hello[position + 5 : position + 5 + name_length]
+                return name.decode("ascii", errors="replace")
+            position += length
+    except (IndexError, struct.error):
+        pass
+    return None
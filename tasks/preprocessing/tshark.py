@@ -1,13 +1,454 @@
-from netunicorn.base import Result, Task
-from netunicorn.library.tasks.tasks_utils import subprocess_run
+"""
+Tasks that run tshark over capture files and return structured results.
+
+Statistics (`-z`) reports are parsed into dataclasses. Per-packet output (`-T fields`, `-T ek`)
+is read line by line while tshark runs, so large captures are summarized in bounded memory.
+"""
+import json
+import re
+import subprocess
+import tempfile
+from dataclasses import dataclass
+from typing import Iterator, Optional, Union
+
+from netunicorn.base import Failure, Result, Success, Task
+from netunicorn.library.tasks.tasks_utils import (
+    ProcessResult,
+    subprocess_run,
+    subprocess_stream,
+)
+
+_CONVERSATION = re.compile(r"^(\S+)\s+<->\s+(\S+)\s+(.+)$")
+# a number optionally followed by a unit, e.g., "12", "6,543 bytes", "16 kB", "0.123"
+_VALUE = re.compile(r"([\d,]+(?:\.\d+)?)(?:\s+(bytes|[kKMGT]i?B)\b)?")
+_UNITS = {
+    "": 1,
+    "bytes": 1,
+    "kB": 10**3,
+    "KB": 10**3,
+    "KiB": 2**10,
+    "MB": 10**6,
+    "MiB": 2**20,
+    "GB": 10**9,
+    "GiB": 2**30,
+    "TB": 10**12,
+    "TiB": 2**40,
+}
+_INTERVAL = re.compile(r"^\|\s*([\d.]+)\s*<>\s*([\d.]+|Dur)\s*\|(.*)$")
+_DURATION = re.compile(r"Duration:\s*([\d.]+)")
+_HIERARCHY = re.compile(r"^( *)(\S+)\s+frames:(\d+)\s+bytes:(\d+)")
+
+_FLOW_FIELDS = [
+    "frame.time_epoch",
+    "frame.len",
+    "ip.src",
+    "ipv6.src",
+    "ip.dst",
+    "ipv6.dst",
+    "tcp.stream",
+    "tcp.srcport",
+    "tcp.dstport",
+    "udp.stream",
+    "udp.srcport",
+    "udp.dstport",
+]
+
+
+@dataclass
+class Conversation:
+    address_a: str
+    port_a: Optional[int]  # None for conversations without ports (e.g., ip, eth)
+    address_b: str
+    port_b: Optional[int]
+    frames_a_to_b: int
+    bytes_a_to_b: int
+    frames_b_to_a: int
+    bytes_b_to_a: int
+    relative_start: float  # seconds since the first packet of the capture
+    duration: float  # seconds
+
+
+@dataclass
+class IOStatInterval:
+    start: float  # seconds since the first packet of the capture
+    end: float
+    frames: list[int]  # for each filter (one column without filters)
+    bytes: list[int]
+
+
+@dataclass
+class ProtocolStatistics:
+    protocol: str
+    path: str  # protocol stack, e.g., "eth:ip:tcp"
+    frames: int
+    bytes: int
+
+
+@dataclass
+class FlowStatistics:
+    protocol: str  # "tcp" or "udp"
+    stream: int  # stream index assigned by tshark
+    address_a: str  # source of the first packet
+    port_a: int
+    address_b: str
+    port_b: int
+    packets_a_to_b: int
+    bytes_a_to_b: int
+    packets_b_to_a: int
+    bytes_b_to_a: int
+    start: float  # UNIX timestamp of the first packet
+    end: float  # UNIX timestamp of the last packet
 
 
 class TsharkCommand(Task):
+    """
+    Runs the tshark command and returns its output, like `subprocess_run`.
+
+    With `stream=True`, `output_path` or `timeout`, the command is run with `subprocess_stream`
+    instead: the output is written to `output_path` (if set) as it is produced,
+    the command is killed after `timeout` seconds, and `ProcessResult` is returned
+    with only the beginning and the end of the output.
+    """
+
     requirements = ["apt-get install -y tshark"]
 
-    def __init__(self, command: list[str], *args, **kwargs):
+    def __init__(
+        self,
+        command: list[str],
+        *args,
+        stream: bool = False,
+        output_path: Optional[str] = None,
+        timeout: Optional[float] = None,
+        **kwargs,
+    ):
         self.command = command
+        self.stream = stream or output_path is not None or timeout is not None
+        self.output_path = output_path
+        self.timeout = timeout
         super().__init__(*args, **kwargs)
 
-    def run(self) -> Result:
-        return subprocess_run(self.command)
+    def run(self) -> Result[Union[str, ProcessResult], Union[str, ProcessResult]]:
+        if not self.stream:
+            return subprocess_run(self.command)
+        return subprocess_stream(self.command, self.output_path, timeout=self.timeout)
+
+
+def iterate_lines(command: list[str]) -> Iterator[str]:
+    """
+    Runs the command and yields lines of its output while it runs.
+    Raises `subprocess.CalledProcessError` with the error output if the command fails.
+    """
+    with tempfile.TemporaryFile() as errors:
+        with subprocess.Popen(
+            command, stdout=subprocess.PIPE, stderr=errors, text=True
+        ) as process:
+            try:
+                for line in process.stdout:
+                    yield line.rstrip("\n")
+            finally:
+                # the generator may be closed before the output ends
+                if process.poll() is None:
+                    process.kill()
+        if process.returncode:
+            errors.seek(0)
+            raise subprocess.CalledProcessError(
+                process.returncode, command, stderr=errors.read().decode()
+            )
+
+
+def iterate_fields(
+    filename: str, fields: list[str], display_filter: Optional[str] = None
+) -> Iterator[list[str]]:
+    """
+    Yields values of the fields for each packet (`-T fields`), empty strings for missing fields.
+    Only the first occurrence of a field is returned (e.g., the outer header of tunneled packets).
+    """
+    command = ["tshark", "-r", filename, "-n", "-T", "fields"]
+    command += ["-E", "separator=/t", "-E", "occurrence=f"]
+    for name in fields:
+        command += ["-e", name]
+    if display_filter:
+        command += ["-Y", display_filter]
+    for line in iterate_lines(command):
+        values = line.split("\t")
+        yield values + [""] * (len(fields) - len(values))
+
+
+def iterate_ek(
+    filename: str,
+    fields: Optional[list[str]] = None,
+    display_filter: Optional[str] = None,
+) -> Iterator[dict]:
+    """
+    Yields the decoded packets (`-T ek`) as dictionaries with "timestamp" and "layers" keys.
+    If `fields` are given, only these fields are included.
+    """
+    command = ["tshark", "-r", filename, "-n", "-T", "ek"]
+    for name in fields or []:
+        command += ["-e", name]
+    if display_filter:
+        command += ["-Y", display_filter]
+    for line in iterate_lines(command):
+        # bulk index lines ({"index": ...}) alternate with packets
+        if line and not line.startswith('{"index"'):
+            yield json.loads(line)
+
+
+def _value(number: str, unit: str) -> float:
+    return float(number.replace(",", "")) * _UNITS[unit]
+
+
+def _endpoint(value: str, ports: bool) -> tuple[str, Optional[int]]:
+    if not ports:
+        return value, None
+    address, _, port = value.rpartition(":")
+    return address.strip("[]"), int(port)
+
+
+def parse_conversations(text: str, ports: bool = True) -> list[Conversation]:
+    """
+    Parses the output of `-z conv,<type>`. Newer tshark versions print byte counts with units
+    (e.g., "16 kB"), so counts above a kilobyte are approximate.
+    """
+    conversations = []
+    for line in text.splitlines():
+        if not (match := _CONVERSATION.match(line.strip())):
+            continue
+        values = [_value(*x) for x in _VALUE.findall(match[3])]
+        if len(values) < 8:
+            continue
+        address_a, port_a = _endpoint(match[1], ports)
+        address_b, port_b = _endpoint(match[2], ports)
+        # columns: <- frames, bytes | -> frames, bytes | total frames, bytes | start | duration
+        conversations.append(
+            Conversation(
+                address_a,
+                port_a,
+                address_b,
+                port_b,
+                frames_a_to_b=int(values[2]),
+                bytes_a_to_b=int(values[3]),
+                frames_b_to_a=int(values[0]),
+                bytes_b_to_a=int(values[1]),
+                relative_start=values[6],
+                duration=values[7],
+            )
+        )
+    return conversations
+
+
+def parse_io_stat(text: str) -> list[IOStatInterval]:
+    """
+    Parses the output of `-z io,stat,<interval>[,<filter>...]`.
+    """
+    duration = None
+    if match := _DURATION.search(text):
+        duration = float(match[1])
+    intervals = []
+    for line in text.splitlines():
+        if not (match := _INTERVAL.match(line.strip())):
+            continue
+        values = [int(x) for x in re.findall(r"\d+", match[3])]
+        end = match[2]
+        intervals.append(
+            IOStatInterval(
+                start=float(match[1]),
+                # the last interval ends at the end of the capture
+                end=float(end) if end != "Dur" else duration or float(match[1]),
+                frames=values[0::2],
+                bytes=values[1::2],
+            )
+        )
+    return intervals
+
+
+def parse_protocol_hierarchy(text: str) -> list[ProtocolStatistics]:
+    """
+    Parses the output of `-z io,phs` into a flat list in the order of tshark.
+    """
+    statistics = []
+    stack = []
+    for line in text.splitlines():
+        if not (match := _HIERARCHY.match(line)):
+            continue
+        depth = len(match[1]) // 2
+        del stack[depth:]
+        stack.append(match[2])
+        statistics.append(
+            ProtocolStatistics(match[2], ":".join(stack), int(match[3]), int(match[4]))
+        )
+    return statistics
+
+
+class _TsharkStatistics(Task):
+    requirements = ["apt-get install -y tshark"]
+
+    def __init__(
+        self, filename: str, display_filter: Optional[str] = None, *args, **kwargs
+    ):
+        self.filename = filename
+        self.display_filter = display_filter
+        super().__init__(*args, **kwargs)
+
+    def _statistics(self, statistics: str) -> Result[str, str]:
+        # the filter is a part of the statistics argument, -Y does not apply to statistics
+        if self.display_filter:
+            statistics += f",{self.display_filter}"
+        return subprocess_run(
+            ["tshark", "-r", self.filename, "-n", "-q", "-z", statistics]
+        )
+
+
+class TsharkConversations(_TsharkStatistics):
+    """
+    Returns the conversation table (`-z conv`) of the capture for the conversation type:
+    "tcp", "udp", "ip", "ipv6" or "eth".
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        conversation_type: str = "tcp",
+        display_filter: Optional[str] = None,
+        *args,
+        **kwargs,
+    ):
+        self.conversation_type = conversation_type
+        super().__init__(filename, display_filter, *args, **kwargs)
+
+    def run(self) -> Result[list[Conversation], str]:
+        output = self._statistics(f"conv,{self.conversation_type}")
+        if isinstance(output, Failure):
+            return output
+        return Success(
+            parse_conversations(
+                output.unwrap(), ports=self.conversation_type in {"tcp", "udp"}
+            )
+        )
+
+
+class TsharkIOStat(_TsharkStatistics):
+    """
+    Returns the number of frames and bytes in each `interval` seconds of the capture (`-z io,stat`),
+    with a column for each of `filters` (display filters) or one column for all packets.
+    """
+
+    def __init__(
+        self,
+        filename: str,
+        interval: float = 1,
+        filters: Optional[list[str]] = None,
+        display_filter: Optional[str] = None,
+        *args,
+        **kwargs,
+    ):
+        self.interval = interval
+        self.filters = filters or []
+        super().__init__(filename, display_filter, *args, **kwargs)
+
+    def run(self) -> Result[list[IOStatInterval], str]:
+        if not self.filters:
+            output = self._statistics(f"io,stat,{self.interval}")
+        else:
+            # display filter is applied to each column
+            filters = [
+                f"({self.display_filter}) and ({x})" if self.display_filter else x
+                for x in self.filters
+            ]
+            output = subprocess_run(
+                ["tshark", "-r", self.filename, "-n", "-q", "-z"]
+                + [",".join([f"io,stat,{self.interval}"] + filters)]
+            )
+        if isinstance(output, Failure):
+            return output
+        return Success(parse_io_stat(output.unwrap()))
+
+
+class TsharkProtocolHierarchy(_TsharkStatistics):
+    """
+    Returns the number of frames and bytes of each protocol in the capture (`-z io,phs`).
+    """
+
+    def run(self) -> Result[list[ProtocolStatistics], str]:
+        output = self._statistics("io,phs")
+        if isinstance(output, Failure):
+            return output
+        return Success(parse_protocol_hierarchy(output.unwrap()))
+
+
+class TsharkFlowStatistics(Task):
+    """
+    Returns packet and byte counts of each TCP and UDP stream (as numbered by tshark)
+    in both directions. tshark output is aggregated while it is read,
+    so memory depends on the number of flows, not on the capture size.
+    """
+
+    requirements = ["apt-get install -y tshark"]
+
+    def __init__(
+        self, filename: str, display_filter: Optional[str] = None, *args, **kwargs
+    ):
+        self.filename = filename
+        self.display_filter = display_filter
+        super().__init__(*args, **kwargs)
+
+    def run(self) -> Result[list[FlowStatistics], str]:
+        flows = {}
+        try:
+            for values in iterate_fields(
+                self.filename, _FLOW_FIELDS, self.display_filter
+            ):
+                _update_flows(flows, values)
+        except subprocess.CalledProcessError as e:
+            return Failure(f"tshark failed: {e.stderr}")
+        return Success(list(flows.values()))
+
+
+def _update_flows(flows: dict, values: list[str]) -> None:
+    (
+        timestamp,
+        length,
+        ip_src,
+        ipv6_src,
+        ip_dst,
+        ipv6_dst,
+        tcp_stream,
+        tcp_sport,
+        tcp_dport,
+        udp_stream,
+        udp_sport,
+        udp_dport,
+    ) = values
+    if tcp_stream:
+        key, sport, dport = ("tcp", int(tcp_stream)), tcp_sport, tcp_dport
+    elif udp_stream:
+        key, sport, dport = ("udp", int(udp_stream)), udp_sport, udp_dport
+    else:
+        return
+    timestamp = float(timestamp)
+    length = int(length)
+    source = ip_src or ipv6_src
+
+    flow = flows.get(key)
+    if flow is None:
+        flow = flows[key] = FlowStatistics(
+            *key,
+            source,
+            int(sport),
+            ip_dst or ipv6_dst,
+            int(dport),
+            0,
+            0,
+            0,
+            0,
+            timestamp,
+            timestamp,
+        )
+    if source == flow.address_a and int(sport) == flow.port_a:
+        flow.packets_a_to_b += 1
+        flow.bytes_a_to_b += length
+    else:
+        flow.packets_b_to_a += 1
+        flow.bytes_b_to_a += length
+    flow.start = min(flow.start, timestamp)
+    flow.end = max(flow.end, timestamp)
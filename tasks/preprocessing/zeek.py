@@ -1,8 +1,40 @@
+import json
+import os
+import shutil
+import struct
+import zlib
 from abc import ABC
-from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, replace
+from itertools import chain
+from typing import Callable, Iterator, Optional, Union
 
-from netunicorn.base import Architecture, Node, Result, Task, TaskDispatcher
-from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.base import (
+    Architecture,
+    Failure,
+    Node,
+    Result,
+    Success,
+    Task,
+    TaskDispatcher,
+)
+from netunicorn.library.tasks.tasks_utils import (
+    ProcessResult,
+    subprocess_run,
+    subprocess_stream,
+)
+
+ZEEK = "/opt/zeek/bin/zeek"
+# fragments held back by `split_by_connection` until the first fragment of their datagram,
+# and fragmented datagrams it remembers
+_MAX_PENDING_FRAGMENTS = 10000
+
+
+@dataclass
+class ZeekParallelResult:
+    log_directory: str
+    logs: dict[str, str]  # log name -> merged log file
+    workers: list[ProcessResult]  # Zeek run of each input part
 
 
 class _ZeekDebian12(Task, ABC):
@@ -20,26 +52,380 @@ class _ZeekDebian12(Task, ABC):
 
 
 class ZeekPCAPAnalysisLinuxImplementation(Task):
+    """
+    Runs Zeek over the capture and returns its output, like `subprocess_run`.
+    With `stream=True` or `output_path`, Zeek is run with `subprocess_stream` instead:
+    its output is written to `output_path` (if set) as it is produced,
+    and `ProcessResult` is returned with only the beginning and the end of the output.
+    """
+
     def __init__(
-        self, pcap_filename: str, flags: Optional[list[str]] = None, *args, **kwargs
+        self,
+        pcap_filename: str,
+        flags: Optional[list[str]] = None,
+        *args,
+        stream: bool = False,
+        output_path: Optional[str] = None,
+        **kwargs,
     ):
         self.flags = flags or []
         self.pcap_filename = pcap_filename
+        self.stream = stream or output_path is not None
+        self.output_path = output_path
+        super().__init__(*args, **kwargs)
+
+    def run(self) -> Result[Union[str, ProcessResult], Union[str, ProcessResult]]:
+        command = [ZEEK] + self.flags + ["-r", self.pcap_filename]
+        if not self.stream:
+            return subprocess_run(command)
+        return subprocess_stream(command, self.output_path)
+
+
+class ParallelZeekPCAPAnalysisLinuxImplementation(Task):
+    """
+    Runs up to `workers` Zeek processes in parallel and merges their logs into one log
+    of each kind (conn.log, dns.log, ...) in `log_directory`.
+
+    If `pcap_filename` is a list of files (e.g., segments of a rotated capture,
+    see `segments.segments_between`), each file is analyzed by its own Zeek process;
+    connections that span several files are split at the file boundaries.
+    A single pcap file is first split into `workers` parts by a hash of the connection
+    (addresses, ports and protocol in both directions), so that all packets
+    of a connection are analyzed by the same process (see `split_by_connection`).
+
+    Each process runs in its own directory, so `flags` that are paths of existing files
+    (e.g., scripts) are made absolute. The output of the processes is written
+    to `output_path` (if set) one after another.
+    """
+
+    def __init__(
+        self,
+        pcap_filename: Union[str, list[str]],
+        flags: Optional[list[str]] = None,
+        *args,
+        workers: int = 2,
+        log_directory: str = ".",
+        output_path: Optional[str] = None,
+        **kwargs,
+    ):
+        self.pcap_filename = pcap_filename
+        self.flags = flags or []
+        self.workers = max(1, workers)
+        self.log_directory = log_directory
+        self.output_path = output_path
         super().__init__(*args, **kwargs)
 
-    def run(self) -> Result:
-        return subprocess_run(
-            ["/opt/zeek/bin/zeek"] + self.flags + ["-r", self.pcap_filename]
+    def run(self) -> Result[ZeekParallelResult, str]:
+        # Zeek is run in its own directory, so paths must not be relative
+        work_directory = os.path.abspath(
+            os.path.join(self.log_directory, ".zeek_workers")
+        )
+        flags = [
+            os.path.abspath(x) if not x.startswith("-") and os.path.exists(x) else x
+            for x in self.flags
+        ]
+        os.makedirs(work_directory, exist_ok=True)
+        try:
+            if isinstance(self.pcap_filename, str):
+                parts = split_by_connection(
+                    self.pcap_filename, self.workers, work_directory
+                )
+            else:
+                parts = [os.path.abspath(x) for x in self.pcap_filename]
+
+            directories = []
+            for i in range(len(parts)):
+                directories.append(os.path.join(work_directory, str(i)))
+                os.makedirs(directories[-1], exist_ok=True)
+            with ThreadPoolExecutor(self.workers) as executor:
+                results = list(
+                    executor.map(
+                        lambda x: subprocess_stream(
+                            [ZEEK] + flags + ["-r", x[0]],
+                            os.path.join(x[1], "output") if self.output_path else None,
+                            cwd=x[1],
+                        ),
+                        zip(parts, directories),
+                    )
+                )
+            if self.output_path:
+                results = _join_outputs(results, self.output_path)
+            failed = [x.failure() for x in results if isinstance(x, Failure)]
+            if failed:
+                return Failure(
+                    f"{len(failed)} of {len(parts)} Zeek workers failed:\n"
+                    + "\n".join(x.output for x in failed)
+                )
+            logs = merge_logs(directories, self.log_directory)
+            return Success(
+                ZeekParallelResult(
+                    self.log_directory, logs, [x.unwrap() for x in results]
+                )
+            )
+        finally:
+            shutil.rmtree(work_directory, ignore_errors=True)
+
+
+def _join_outputs(
+    results: list[Result[ProcessResult, ProcessResult]], output_path: str
+) -> list[Result[ProcessResult, ProcessResult]]:
+    """
+    Concatenates the outputs of the workers into `output_path`.
+    """
+    joined = []
+    with open(output_path, "wb") as output:
+        for result in results:
+            process = (
+                result.unwrap() if isinstance(result, Success) else result.failure()
+            )
+            with open(process.output_path, "rb") as f:
+                shutil.copyfileobj(f, output)
+            process = replace(process, output_path=output_path)
+            joined.append(type(result)(process))
+    return joined
+
+
+def split_by_connection(filename: str, parts: int, directory: str) -> list[str]:
+    """
+    Splits the capture into pcap files `<directory>/part_<i>.pcap` by a hash of the connection,
+    so that both directions of a connection are in the same file. Non-IP packets
+    are written to the first file. Fragments of an IP datagram are written with its first
+    fragment, so that they are reassembled by the same Zeek process; fragments that arrive
+    before the first one are held back until it arrives. At most `_MAX_PENDING_FRAGMENTS` are
+    held back, the datagram held back longest is written first when there are more.
+    Returns the paths of the files.
+    Raises ValueError if the capture has several link types.
+    """
+    from netunicorn.library.tasks.preprocessing import rawpcap
+
+    paths = [os.path.join(directory, f"part_{i}.pcap") for i in range(parts)]
+    # datagram (addresses, protocol, identification) -> index of the file
+    datagrams: dict[tuple, int] = {}
+    # fragments of datagrams whose first fragment has not been seen yet
+    pending: dict[tuple, list[rawpcap.PcapRecord]] = {}
+    linktype = None
+    files = []
+
+    def write(index: int, record: rawpcap.PcapRecord) -> None:
+        microseconds = round(record.timestamp * 1e6)
+        files[index].write(
+            struct.pack(
+                "<IIII",
+                microseconds // 10**6,
+                microseconds % 10**6,
+                len(record.data),
+                record.length,
+            )
+            + record.data
         )
 
+    def flush(datagram: tuple) -> None:
+        # the first fragment was not seen, the rest cannot be reassembled anyway
+        nonlocal pending_count
+        records = pending.pop(datagram)
+        pending_count -= len(records)
+        for record in records:
+            write(zlib.crc32(repr(datagram).encode()) % parts, record)
+
+    pending_count = 0
+    try:
+        files = [open(x, "wb") for x in paths]
+        for record in rawpcap.read_records(filename):
+            if linktype is None:
+                linktype = record.linktype
+                header = struct.pack(
+                    "<IHHiIII", 0xA1B2C3D4, 2, 4, 0, 0, 1 << 18, linktype
+                )
+                for f in files:
+                    f.write(header)
+            elif record.linktype != linktype:
+                raise ValueError(
+                    f"{filename} has packets of link types {linktype} and {record.linktype}, "
+                    "which cannot be written to one pcap file"
+                )
+            packet = rawpcap.decode(record)
+            index = 0
+            if packet.version:
+                datagram = None
+                if packet.fragment is not None:
+                    datagram = (
+                        packet.src,
+                        packet.dst,
+                        packet.proto,
+                        packet.fragment[0],
+                    )
+                    if packet.fragment[1]:
+                        if datagram in datagrams:
+                            write(datagrams[datagram], record)
+                        else:
+                            pending.setdefault(datagram, []).append(record)
+                            pending_count += 1
+                            if pending_count > _MAX_PENDING_FRAGMENTS:
+                                flush(next(iter(pending)))
+                        continue
+                source = packet.src + packet.sport.to_bytes(2, "big")
+                destination = packet.dst + packet.dport.to_bytes(2, "big")
+                key = min(source, destination) + max(source, destination)
+                index = zlib.crc32(key + bytes([packet.proto])) % parts
+                if datagram is not None:
+                    datagrams[datagram] = index
+                    if len(datagrams) > _MAX_PENDING_FRAGMENTS:
+                        # identifications are reused, old datagrams are complete
+                        del datagrams[next(iter(datagrams))]
+                    write(index, record)
+                    fragments = pending.pop(datagram, ())
+                    pending_count -= len(fragments)
+                    for fragment in fragments:
+                        write(index, fragment)
+                    continue
+            write(index, record)
+        for datagram in list(pending):
+            flush(datagram)
+    finally:
+        for f in files:
+            f.close()
+    return paths
+
+
+def merge_logs(directories: list[str], log_directory: str) -> dict[str, str]:
+    """
+    Merges logs with the same name from the directories into `<log_directory>/<name>.log`.
+    Rows are sorted by their `ts` column (if the log has one) in memory, so the rows
+    of each log must fit in memory. TSV logs keep the header of the first log; their columns
+    must be the same. Returns merged log files by log name.
+    """
+    names = sorted(
+        {
+            x[: -len(".log")]
+            for directory in directories
+            for x in os.listdir(directory)
+            if x.endswith(".log")
+        }
+    )
+    merged = {}
+    for name in names:
+        sources = [
+            os.path.join(x, name + ".log")
+            for x in directories
+            if os.path.exists(os.path.join(x, name + ".log"))
+        ]
+        path = merged[name] = os.path.join(log_directory, name + ".log")
+        with open(path + ".tmp", "wb") as output:
+            _merge_log(sources, output)
+        os.replace(path + ".tmp", path)
+    return merged
+
+
+def _merge_log(sources: list[str], output) -> None:
+    files = [open(x, "rb") for x in sources]
+    try:
+        headers = [_read_header(f) for f in files]
+        fields = [
+            next((x for x in h if x.startswith(b"#fields")), None) for h in headers
+        ]
+        for source, other in zip(sources[1:], fields[1:]):
+            if other != fields[0]:
+                raise ValueError(f"Columns of {source} differ from {sources[0]}")
+        output.writelines(headers[0])
+
+        close = []
+        rows = [_rows(f, close) for f in files]
+        if fields[0] is not None:
+            separator = b"\t"
+            for line in headers[0]:
+                if line.startswith(b"#separator "):
+                    separator = line[len(b"#separator ") :].strip()
+                    separator = separator.decode("unicode_escape").encode()
+            names = fields[0].rstrip(b"\n").split(separator)[1:]
+            time = _tsv_time(names.index(b"ts"), separator) if b"ts" in names else None
+        else:
+            time = _json_time
+        # Zeek writes most rows when a connection ends, so the logs are not sorted by ts
+        output.writelines(sorted(chain(*rows), key=time) if time else chain(*rows))
+        if close:
+            output.write(close[-1])
+    finally:
+        for f in files:
+            f.close()
+
+
+def _read_header(f) -> list[bytes]:
+    header = []
+    while True:
+        position = f.tell()
+        line = f.readline()
+        if not line.startswith(b"#") or line.startswith(b"#close"):
+            f.seek(position)
+            return header
+        header.append(line)
+
+
+def _rows(f, close: list[bytes]) -> Iterator[bytes]:
+    for line in f:
+        if not line.startswith(b"#"):
+            yield line
+        elif line.startswith(b"#close"):
+            close.append(line)
+
+
+def _tsv_time(index: int, separator: bytes) -> Callable[[bytes], float]:
+    def time(line: bytes) -> float:
+        try:
+            return float(line.split(separator, index + 1)[index])
+        except (IndexError, ValueError):
+            return 0.0  # unset
+
+    return time
+
+
+def _json_time(line: bytes) -> float:
+    # Zeek writes ts of JSON logs as epoch seconds by default
+    try:
+        return float(json.loads(line).get("ts", 0))
+    except (ValueError, TypeError, AttributeError):
+        return 0.0
+
 
 class ZeekPCAPAnalysis(TaskDispatcher):
+    """
+    Runs Zeek over the capture. With a list of files or `workers` > 1, several Zeek processes
+    are run in parallel (see `ParallelZeekPCAPAnalysisLinuxImplementation`) and their logs
+    are merged into `log_directory`; `stream` cannot be set then.
+    """
+
     def __init__(
-        self, pcap_filename: str, flags: Optional[list[str]] = None, *args, **kwargs
+        self,
+        pcap_filename: Union[str, list[str]],
+        flags: Optional[list[str]] = None,
+        *args,
+        stream: bool = False,
+        output_path: Optional[str] = None,
+        workers: int = 1,
+        log_directory: str = ".",
+        **kwargs,
     ):
-        self.linux_debian_implementation = ZeekPCAPAnalysisLinuxImplementation(
-            pcap_filename=pcap_filename, flags=flags
-        )
+        if isinstance(pcap_filename, str) and workers <= 1:
+            self.linux_debian_implementation = ZeekPCAPAnalysisLinuxImplementation(
+                pcap_filename=pcap_filename,
+                flags=flags,
+                stream=stream,
+                output_path=output_path,
+            )
+        else:
+            if stream:
+                raise ValueError(
+                    "stream applies to a single Zeek process, the output of parallel "
+                    "workers is always streamed (use output_path to keep it)"
+                )
+            self.linux_debian_implementation = (
+                ParallelZeekPCAPAnalysisLinuxImplementation(
+                    pcap_filename=pcap_filename,
+                    flags=flags,
+                    workers=workers,
+                    log_directory=log_directory,
+                    output_path=output_path,
+                )
+            )
         super().__init__(*args, **kwargs)
 
     def dispatch(self, node: Node) -> Task:
@@ -0,0 +1,359 @@
+"""
+Parsing of Zeek logs (e.g., conn.log, dns.log, http.log, ssl.log) into typed columns.
+
+Logs in Zeek's TSV format and in JSON (one object per line) are read line by line.
+TSV columns get types from the `#types` header, JSON columns from their first value.
+Numeric columns are stored in arrays, so they can be written to Parquet without conversion
+(see `export.write_columns`). Logs can also be aggregated while they are read,
+so that only a compact summary is kept in memory.
+"""
+import glob
+import gzip
+import itertools
+import json
+import os
+from array import array
+from dataclasses import dataclass, field
+from typing import IO, Any, Iterator, Optional, Sequence, Union
+
+from netunicorn.base import Task
+from netunicorn.library.tasks.preprocessing import export
+
+_TYPECODES = {
+    "time": "d",
+    "interval": "d",
+    "double": "d",
+    "count": "Q",
+    "int": "q",
+    "port": "H",
+}
+_FLOAT_TYPES = {"time", "interval", "double"}
+_INTEGER_TYPES = {"count", "int", "port"}
+
+
+@dataclass
+class ZeekLog:
+    """
+    Columns of a Zeek log with their Zeek types (e.g., "time", "addr", "count", "set[string]").
+    Unset values are None, sets and vectors are lists.
+    """
+
+    path: str  # name of the log, e.g., "conn"
+    types: dict[str, str]
+    columns: dict[str, Sequence[Any]]
+
+    def __len__(self) -> int:
+        return len(next(iter(self.columns.values()), ()))
+
+    def rows(self) -> Iterator[dict[str, Any]]:
+        for i in range(len(self)):
+            yield {name: column[i] for name, column in self.columns.items()}
+
+
+@dataclass
+class ZeekAggregation:
+    """
+    Groups rows of a log by the values of `group_by` columns and counts them.
+    Values of `sum_columns` are summed (unset values are skipped) into `<column>_sum` columns.
+    """
+
+    group_by: list[str]
+    sum_columns: list[str] = field(default_factory=list)
+
+
+class _Column:
+    def __init__(self, type: Optional[str], rows: int = 0):
+        self.type = type  # None until the first value of a JSON column is seen
+        typecode = _TYPECODES.get(type)
+        # arrays cannot store unset values, columns with them become lists
+        self.values = array(typecode) if typecode and not rows else [None] * rows
+
+    def append(self, value: Any) -> None:
+        type = _promoted_type(self.type, value)
+        if type != self.type:
+            if self.type is not None and isinstance(self.values, array):
+                # a float in a JSON column that started with integers
+                self.values = array(_TYPECODES[type], self.values)
+            self.type = type
+        if isinstance(self.values, array):
+            try:
+                self.values.append(value)
+                return
+            except TypeError:
+                # unset value
+                self.values = self.values.tolist()
+        self.values.append(value)
+
+
+def _open(path: str) -> IO[str]:
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", errors="replace")
+    return open(path, errors="replace")
+
+
+def _log_name(path: str) -> str:
+    # conn.log, conn.log.gz, conn.09:00:00-10:00:00.log.gz -> conn
+    return os.path.basename(path).split(".", 1)[0]
+
+
+def _converter(type: str, set_separator: str, empty: str):
+    if type in _FLOAT_TYPES:
+        return float
+    if type in _INTEGER_TYPES:
+        return int
+    if type == "bool":
+        return lambda x: x == "T"
+    if type.endswith("]") and "[" in type:
+        inner = _converter(type[type.index("[") + 1 : -1], set_separator, empty)
+        return lambda x: (
+            [] if x == empty else [inner(y) for y in x.split(set_separator)]
+        )
+    return str
+
+
+def iterate_log(
+    path: str, columns: Optional[list[str]] = None
+) -> tuple[str, dict[str, str], Iterator[dict[str, Any]]]:
+    """
+    Opens a Zeek log in TSV or JSON format and returns the log name, column types
+    and an iterator over the rows with typed values. For JSON logs, types are known
+    only after the first row is read. Only `columns` are returned if given.
+    """
+    f = _open(path)
+    first = f.readline()
+    if first.startswith("#"):
+        return _iterate_tsv(f, first, path, columns)
+    return _log_name(path), {}, _iterate_json(f, first, columns)
+
+
+def _iterate_tsv(
+    f: IO[str], first: str, path: str, columns: Optional[list[str]]
+) -> tuple[str, dict[str, str], Iterator[dict[str, Any]]]:
+    headers = {}
+    line = first
+    while line.startswith("#"):
+        key, _, value = line.rstrip("\n").partition(
+            " " if line.startswith("#separator") else headers.get("separator", "\t")
+        )
+        if key == "#separator":
+            value = value.encode().decode("unicode_escape")
+        headers[key[1:]] = value
+        if key == "#types":
+            break
+        line = f.readline()
+
+    separator = headers.get("separator", "\t")
+    names = headers["fields"].split(separator)
+    types = dict(zip(names, headers["types"].split(separator)))
+    unset = headers.get("unset_field", "-")
+    empty = headers.get("empty_field", "(empty)")
+    set_separator = headers.get("set_separator", ",")
+    selected = [
+        (i, name, _converter(types[name], set_separator, empty))
+        for i, name in enumerate(names)
+        if columns is None or name in columns
+    ]
+
+    def rows() -> Iterator[dict[str, Any]]:
+        with f:
+            for line in f:
+                if line.startswith("#"):
+                    continue
+                values = line.rstrip("\n").split(separator)
+                yield {
+                    name: None if values[i] == unset else convert(values[i])
+                    for i, name, convert in selected
+                }
+
+    return (
+        headers.get("path", _log_name(path)),
+        {name: types[name] for _, name, _ in selected},
+        rows(),
+    )
+
+
+def _iterate_json(
+    f: IO[str], first: str, columns: Optional[list[str]]
+) -> Iterator[dict[str, Any]]:
+    with f:
+        for line in itertools.chain([first], f):
+            if line.strip():
+                row = json.loads(line)
+                yield row if columns is None else {x: row.get(x) for x in columns}
+
+
+def _json_type(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return "bool"
+    if isinstance(value, int):
+        return "int"
+    if isinstance(value, float):
+        return "double"
+    if isinstance(value, list):
+        return "vector[string]"
+    return "string"
+
+
+def _promoted_type(type: Optional[str], value: Any) -> Optional[str]:
+    """
+    Type of a column after the value: the type of the first value of a JSON column,
+    promoted from "int" to "double" if a float follows integers.
+    """
+    if value is None:
+        return type
+    if type is None:
+        return _json_type(value)
+    if type == "int" and isinstance(value, float):
+        return "double"
+    return type
+
+
+def read_log(
+    path: Union[str, list[str]],
+    columns: Optional[list[str]] = None,
+    aggregation: Optional[ZeekAggregation] = None,
+) -> ZeekLog:
+    """
+    Reads a Zeek log (TSV or JSON, optionally gzip-compressed) into typed columns,
+    or aggregates its rows while reading them. `path` can also be a list of files
+    of the same log (e.g., rotated logs), which are read in the given order.
+    """
+    if aggregation is not None:
+        columns = list(dict.fromkeys(aggregation.group_by + aggregation.sum_columns))
+    paths = [path] if isinstance(path, str) else path
+    name, types, rows = iterate_log(paths[0], columns)
+    if len(paths) > 1:
+        # later files are opened only when the previous ones are read
+        rows = itertools.chain(
+            rows,
+            itertools.chain.from_iterable(
+                iterate_log(x, columns)[2] for x in paths[1:]
+            ),
+        )
+    if aggregation is not None:
+        return _aggregate(name, types, rows, aggregation)
+
+    result: dict[str, _Column] = {x: _Column(y) for x, y in types.items()}
+    count = 0
+    for row in rows:
+        for key, value in row.items():
+            column = result.get(key)
+            if column is None:
+                # a column that first appears in this row of a JSON log
+                column = result[key] = _Column(_json_type(value), count)
+            column.append(value)
+        count += 1
+        for column in result.values():
+            if len(column.values) < count:
+                column.append(None)
+
+    return ZeekLog(
+        name,
+        {x: y.type or "string" for x, y in result.items()},
+        {x: y.values for x, y in result.items()},
+    )
+
+
+def _aggregate(
+    name: str,
+    types: dict[str, str],
+    rows: Iterator[dict[str, Any]],
+    aggregation: ZeekAggregation,
+) -> ZeekLog:
+    groups: dict[tuple, list] = {}
+    width = len(aggregation.sum_columns)
+    # types of JSON columns are known only from their values
+    sum_types = {x: types.get(x) for x in aggregation.sum_columns}
+    for row in rows:
+        key = tuple(
+            tuple(x) if isinstance(x, list) else x
+            for x in (row.get(x) for x in aggregation.group_by)
+        )
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = [0] + [0] * width
+        group[0] += 1
+        for i, column in enumerate(aggregation.sum_columns, 1):
+            if (value := row.get(column)) is not None:
+                group[i] += value
+                sum_types[column] = _promoted_type(sum_types[column], value)
+
+    columns = {
+        column: [key[i] for key in groups]
+        for i, column in enumerate(aggregation.group_by)
+    }
+    columns["count"] = array("Q", (x[0] for x in groups.values()))
+    for i, column in enumerate(aggregation.sum_columns, 1):
+        columns[f"{column}_sum"] = [x[i] for x in groups.values()]
+    result_types = {x: types.get(x, "string") for x in aggregation.group_by}
+    result_types["count"] = "count"
+    for column in aggregation.sum_columns:
+        result_types[f"{column}_sum"] = sum_types[column] or "double"
+    return ZeekLog(name, result_types, columns)
+
+
+def find_logs(directory: str, logs: Optional[list[str]] = None) -> dict[str, list[str]]:
+    """
+    Returns paths of the Zeek logs in the directory (including rotated and compressed ones)
+    by log name, optionally only `logs`.
+    """
+    paths = sorted(
+        glob.glob(os.path.join(glob.escape(directory), "*.log"))
+        + glob.glob(os.path.join(glob.escape(directory), "*.log.gz"))
+    )
+    result = {}
+    for path in paths:
+        if logs is None or _log_name(path) in logs:
+            result.setdefault(_log_name(path), []).append(path)
+    return result
+
+
+class ParseZeekLogs(Task):
+    """
+    Reads Zeek logs from `directory` (all logs or only `logs`, e.g., ["conn", "dns"])
+    and returns a `ZeekLog` for each log name.
+
+    `columns` selects columns of each log (log name -> columns), `aggregations` replaces
+    the rows of a log by a `ZeekAggregation` computed while reading.
+    If `output_path` is set, tables are written to files `<output_path>/<log name><extension>`
+    (see `export.write_columns`) and `export.ExportedFile` is returned for each log instead.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        logs: Optional[list[str]] = None,
+        columns: Optional[dict[str, list[str]]] = None,
+        aggregations: Optional[dict[str, ZeekAggregation]] = None,
+        output_path: Optional[str] = None,
+        output_format: export.ExportFormat = "auto",
+        *args,
+        **kwargs,
+    ):
+        self.directory = directory
+        self.logs = logs
+        self.columns = columns or {}
+        self.aggregations = aggregations or {}
+        self.output_path = output_path
+        self.output_format = output_format
+        super().__init__(*args, **kwargs)
+        if output_format in {"parquet", "arrow"}:
+            self.add_requirement("pip install pyarrow")
+
+    def run(self) -> dict[str, Any]:
+        results = {}
+        for name, paths in find_logs(self.directory, self.logs).items():
+            log = read_log(paths, self.columns.get(name), self.aggregations.get(name))
+            if self.output_path is None:
+                results[name] = log
+                continue
+            results[name] = export.write_columns(
+                log.columns,
+                os.path.join(
+                    self.output_path, name + export.extension(self.output_format)
+                ),
+                self.output_format,
+            )
+        return results
@@ -1,24 +1,24 @@
 import os
 import subprocess
-import time
 from typing import Optional
 
 from jinja2 import Environment, FileSystemLoader
 from netunicorn.base import Failure, Success, Task, TaskDispatcher, is_successful
 from netunicorn.base.architecture import Architecture
 from netunicorn.base.nodes import Node
+from netunicorn.library.tasks.tasks_utils import port_listening, wait_until_ready
 
 
 class StartQoECollectionServer(TaskDispatcher):
     def __init__(
-        self, data_folder: str = ".", interface: str = "0.0.0.0", port: int = 34543, *args, **kwargs,
+        self, data_folder: str = ".", interface: str = "0.0.0.0", port: int = 34543, *args, timeout: float = 10, **kwargs,
     ):
         super().__init__(*args, **kwargs)
         self.data_folder = data_folder
         self.interface = interface
         self.port = port
         self.linux_implementation = StartQoECollectionServerLinuxImplementation(
-                self.data_folder, self.interface, self.port, name=self.name
+                self.data_folder, self.interface, self.port, timeout=timeout, name=self.name
             )
 
     def dispatch(self, node: Node) -> Task:
@@ -38,11 +38,12 @@ class StartQoECollectionServerLinuxImplementation(Task):
     ]
 
     def __init__(
-        self, data_folder: str = ".", interface: str = "0.0.0.0", port: int = 34543, *args, **kwargs,
+        self, data_folder: str = ".", interface: str = "0.0.0.0", port: int = 34543, *args, timeout: float = 10, **kwargs,
     ):
         self.data_folder = data_folder
         self.interface = interface
         self.port = port
+        self.timeout = timeout
         super().__init__(*args, **kwargs)
 
     def run(self):
@@ -62,11 +63,13 @@ class StartQoECollectionServerLinuxImplementation(Task):
             ],
             env=env,
         )
-        time.sleep(3)
-
-        if (exitcode := process.poll()) is not None:
+        # the server is ready when it listens on the port
+        ready = wait_until_ready(process, port_listening(self.port, process.pid), self.timeout)
+        if isinstance(ready, Failure):
+            if process.poll() is None:
+                process.kill()
             return Failure(
-                f"QoE collection server failed to start: exitcode={exitcode}"
+                f"QoE collection server failed to start: {ready.failure()}"
             )
 
         return (
@@ -1,7 +1,32 @@
+import os
+import re
+import selectors
 import subprocess
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
 
 from netunicorn.base import Failure, Result, Success
 
+Probe = Callable[[], bool]
+
+_TCP_LISTEN = "0A"
+_READ_SIZE = 1 << 16
+
+
+@dataclass
+class ProcessResult:
+    returncode: int  # negative if the process was killed by a signal
+    output: str  # beginning and end of stdout and stderr, the middle part is skipped
+    output_bytes: int  # total size of the output
+    output_path: Optional[str]  # file with the whole output
+    timed_out: bool  # the process was killed after the timeout
+    wall_time: float  # seconds
+    user_time: Optional[float]  # CPU seconds, None if not available
+    system_time: Optional[float]
+    # bytes, Linux counts the memory of the forking process before exec as well
+    peak_rss: Optional[int]
+
 
 def subprocess_run(arguments: list[str]) -> Result:
     result = subprocess.run(arguments, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
@@ -11,3 +36,218 @@ def subprocess_run(arguments: list[str]) -> Result:
     if result.stderr:
         text += result.stderr.decode("utf-8")
     return Success(text) if result.returncode == 0 else Failure(text)
+
+
+def subprocess_stream(
+    arguments: list[str],
+    output_path: Optional[str] = None,
+    on_line: Optional[Callable[[str], None]] = None,
+    timeout: Optional[float] = None,
+    head_size: int = 1 << 16,
+    tail_size: int = 1 << 16,
+    **kwargs,
+) -> Result[ProcessResult, ProcessResult]:
+    """
+    Runs the command like `subprocess_run`, but reads its output (stdout and stderr combined)
+    while it runs instead of buffering it: the output is written to `output_path`,
+    passed line by line to `on_line`, and only the first `head_size` and the last `tail_size`
+    bytes are kept in memory. The process is killed after `timeout` seconds.
+    Other keyword arguments are passed to `subprocess.Popen`.
+    """
+    if head_size < 0 or tail_size < 0:
+        raise ValueError("head_size and tail_size must not be negative")
+    start = time.monotonic()
+    head = bytearray()
+    tail = bytearray()
+    partial = b""
+    total = 0
+    timed_out = finished = False
+    output = open(output_path, "wb") if output_path else None
+    process = subprocess.Popen(
+        arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, **kwargs
+    )
+    try:
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ)
+            while True:
+                remaining = None
+                if timeout is not None:
+                    remaining = timeout - (time.monotonic() - start)
+                    if remaining <= 0:
+                        timed_out = True
+                        process.kill()
+                        break
+                if not selector.select(remaining):
+                    continue
+                chunk = os.read(process.stdout.fileno(), _READ_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if output is not None:
+                    output.write(chunk)
+                if len(head) < head_size:
+                    head += chunk[: head_size - len(head)]
+                if tail_size:
+                    tail += chunk
+                    del tail[:-tail_size]
+                if on_line is not None:
+                    *lines, partial = (partial + chunk).split(b"\n")
+                    for line in lines:
+                        on_line(line.decode("utf-8", errors="replace"))
+        if on_line is not None and partial and not timed_out:
+            on_line(partial.decode("utf-8", errors="replace"))
+        finished = True
+    finally:
+        if output is not None:
+            output.close()
+        process.stdout.close()
+        if not finished:
+            # an exception was raised while reading the output (e.g., in `on_line`)
+            process.kill()
+        returncode, usage = _wait_with_usage(process)
+    wall_time = time.monotonic() - start
+
+    if total <= head_size + tail_size:
+        text = bytes(head + tail[len(tail) - (total - len(head)) :])
+    else:
+        skipped = total - len(head) - len(tail)
+        text = bytes(head) + f"\n[{skipped} bytes skipped]\n".encode() + bytes(tail)
+    result = ProcessResult(
+        returncode=returncode,
+        output=text.decode("utf-8", errors="replace"),
+        output_bytes=total,
+        output_path=output_path,
+        timed_out=timed_out,
+        wall_time=wall_time,
+        user_time=usage.ru_utime if usage else None,
+        system_time=usage.ru_stime if usage else None,
+        peak_rss=usage.ru_maxrss * 1024 if usage else None,
+    )
+    return Success(result) if returncode == 0 and not timed_out else Failure(result)
+
+
+def _wait_with_usage(process: subprocess.Popen):
+    """
+    Waits for the process and returns its return code and resource usage.
+    """
+    try:
+        _, status, usage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # already reaped, e.g., when SIGCHLD is ignored
+        return process.wait(), None
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return process.returncode, usage
+
+
+def wait_until_ready(
+    process: Optional[subprocess.Popen],
+    ready: Probe,
+    timeout: float = 10,
+    interval: float = 0.05,
+) -> Result[float, str]:
+    """
+    Waits until `ready` returns True and returns the number of seconds waited.
+    Fails if the process exits before that or the probe does not succeed in `timeout` seconds.
+    """
+    start = time.monotonic()
+    while True:
+        probed = ready()
+        # a process that failed after the probe succeeded (e.g., on a port still used
+        # by an earlier server) is not ready
+        if process is not None and (exit_code := process.poll()) is not None:
+            return Failure(f"Process terminated with return code {exit_code}")
+        if probed:
+            return Success(time.monotonic() - start)
+        if time.monotonic() - start > timeout:
+            return Failure(f"Process is not ready after {timeout} seconds")
+        time.sleep(interval)
+
+
+def port_listening(port: int, pid: Optional[int] = None) -> Probe:
+    """
+    Ready when a TCP socket listens on the port on any address. With `pid`, the socket must
+    belong to that process, so that a server left over from an earlier run is not taken for it.
+    Reads /proc/net, so that the server does not see a probing connection.
+    """
+    local_port = f":{port:04X}"
+
+    def probe() -> bool:
+        inodes = set()
+        for path in ("/proc/net/tcp", "/proc/net/tcp6"):
+            try:
+                with open(path) as f:
+                    next(f)
+                    for line in f:
+                        fields = line.split()
+                        if fields[1].endswith(local_port) and fields[3] == _TCP_LISTEN:
+                            inodes.add(fields[9])
+            except FileNotFoundError:
+                continue
+        if pid is None or not inodes:
+            return bool(inodes)
+        return bool(inodes & _socket_inodes(pid))
+
+    return probe
+
+
+def _socket_inodes(pid: int) -> set[str]:
+    inodes = set()
+    try:
+        descriptors = os.listdir(f"/proc/{pid}/fd")
+    except OSError:
+        return inodes
+    for descriptor in descriptors:
+        try:
+            target = os.readlink(f"/proc/{pid}/fd/{descriptor}")
+        except OSError:
+            continue
+        if target.startswith("socket:["):
+            inodes.add(target[8:-1])
+    return inodes
+
+
+def file_written(path: str, size: int = 24) -> Probe:
+    """
+    Ready when the file has at least `size` bytes, e.g., a pcap file header (24 bytes).
+    """
+    return lambda: os.path.exists(path) and os.path.getsize(path) >= size
+
+
+def log_line(path: str, pattern: str) -> Probe:
+    """
+    Ready when a line of the log file matches the regular expression.
+    """
+    expression = re.compile(pattern.encode(), re.MULTILINE)
+
+    def probe() -> bool:
+        try:
+            with open(path, "rb") as f:
+                return expression.search(f.read()) is not None
+        except FileNotFoundError:
+            return False
+
+    return probe
+
+
+def http_ok(url: str) -> Probe:
+    """
+    Ready when a GET request to the URL returns status 200.
+    """
+    import urllib.error
+    import urllib.request
+
+    def probe() -> bool:
+        try:
+            with urllib.request.urlopen(url, timeout=1) as response:
+                return response.status == 200
+        except (urllib.error.URLError, OSError):
+            return False
+
+    return probe
+
+
+def any_ready(*probes: Probe) -> Probe:
+    """
+    Ready when any of the probes is ready.
+    """
+    return lambda: any(probe() for probe in probes)
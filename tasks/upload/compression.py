@@ -0,0 +1,169 @@
+"""
+Streaming compression of files while they are uploaded.
+
+Files are compressed in the chunks the upload reads, so no compressed copy is written
+to the disk of the node. zstd (from the `zstandard` package) is used if it can be imported,
+gzip otherwise.
+"""
+import subprocess
+import threading
+import zlib
+from dataclasses import dataclass
+from typing import BinaryIO, Iterator, Literal, Optional, Union
+
+from netunicorn.base import Failure, Result, Success
+
+SUFFIXES = {"zstd": ".zst", "gzip": ".gz"}
+ZSTD_REQUIREMENT = "pip install zstandard"
+
+_READ_SIZE = 1 << 20
+
+
+@dataclass(frozen=True)
+class Compression:
+    algorithm: Literal["zstd", "gzip"] = "zstd"
+    level: Optional[int] = None  # None for the default level: 3 for zstd, 6 for gzip
+    threads: int = 0  # zstd worker threads, 0 to compress in the reading thread
+
+
+@dataclass
+class CompressionStatistics:
+    algorithm: str  # algorithm that was used, gzip if zstd is not available
+    original_bytes: int
+    compressed_bytes: int
+
+    @property
+    def ratio(self) -> float:
+        if not self.compressed_bytes:
+            return 1.0
+        return self.original_bytes / self.compressed_bytes
+
+
+@dataclass
+class CompressedCommandOutput:
+    output: str  # stdout and stderr of the command
+    statistics: CompressionStatistics
+
+
+def available_algorithm(compression: Compression) -> str:
+    if compression.algorithm == "zstd":
+        try:
+            import zstandard  # noqa: F401
+        except ImportError:
+            return "gzip"
+    return compression.algorithm
+
+
+class CompressingReader:
+    """
+    Reads a file compressed: `read` returns the next compressed bytes.
+    Can be passed as a file object to ftplib, or as request data to requests.
+    `file` is a path or a binary file object, which is closed with the reader.
+    """
+
+    def __init__(self, file: Union[str, BinaryIO], compression: Compression):
+        self.algorithm = available_algorithm(compression)
+        if self.algorithm == "zstd":
+            import zstandard
+
+            self._compressor = zstandard.ZstdCompressor(
+                level=3 if compression.level is None else compression.level,
+                threads=compression.threads,
+            ).compressobj()
+        else:
+            self._compressor = zlib.compressobj(
+                6 if compression.level is None else compression.level,
+                zlib.DEFLATED,
+                31,  # gzip header and trailer
+            )
+        self._file: BinaryIO = open(file, "rb") if isinstance(file, str) else file
+        self._buffer = bytearray()
+        self._finished = False
+        self.original_bytes = 0
+        self.compressed_bytes = 0
+
+    def read(self, size: int = -1) -> bytes:
+        while not self._finished and (size < 0 or len(self._buffer) < size):
+            data = self._file.read(_READ_SIZE)
+            if data:
+                self.original_bytes += len(data)
+                self._buffer += self._compressor.compress(data)
+            else:
+                self._buffer += self._compressor.flush()
+                self._finished = True
+        if size < 0 or size > len(self._buffer):
+            size = len(self._buffer)
+        result = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self.compressed_bytes += len(result)
+        return result
+
+    def __iter__(self) -> Iterator[bytes]:
+        # requests sends iterables with chunked transfer encoding
+        while data := self.read(_READ_SIZE):
+            yield data
+
+    def statistics(self) -> CompressionStatistics:
+        return CompressionStatistics(
+            self.algorithm, self.original_bytes, self.compressed_bytes
+        )
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "CompressingReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def run_with_compressed_input(
+    arguments: list[str], file: Union[str, BinaryIO], compression: Compression
+) -> Result[CompressedCommandOutput, CompressedCommandOutput]:
+    """
+    Runs the command (e.g., `curl --upload-file -`) with the compressed file as its standard input.
+    Fails if the command exits with a non-zero code.
+    """
+    with CompressingReader(file, compression) as reader:
+        output, returncode = _run_with_reader(arguments, reader)
+        result = CompressedCommandOutput(output, reader.statistics())
+    return Success(result) if returncode == 0 else Failure(result)
+
+
+def run_with_input(arguments: list[str], file: BinaryIO) -> Result[str, str]:
+    """
+    Runs the command with the file object (e.g., a `dedup.HashingReader`) as its standard input
+    and returns its stdout and stderr. Fails if the command exits with a non-zero code.
+    """
+    with file:
+        output, returncode = _run_with_reader(arguments, file)
+    return Success(output) if returncode == 0 else Failure(output)
+
+
+def _run_with_reader(arguments: list[str], reader) -> tuple[str, int]:
+    process = subprocess.Popen(
+        arguments,
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+    )
+
+    def feed() -> None:
+        try:
+            while data := reader.read(_READ_SIZE):
+                process.stdin.write(data)
+        except BrokenPipeError:
+            # the command exited early, its output tells why
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    output = process.stdout.read().decode("utf-8", errors="replace")
+    writer.join()
+    return output, process.wait()
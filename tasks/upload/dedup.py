@@ -0,0 +1,212 @@
+"""
+Content-addressed deduplication of uploads.
+
+A manifest on the node records, for each upload endpoint, which content (BLAKE2b digest of the file)
+was uploaded to which remote location. An upload of content that is already at the same location
+is skipped, and content that is at another location can be copied on the server instead of sent again.
+Files are hashed while they are uploaded (see `StreamingDigest`), and their digests are cached
+in the manifest by path, size and modification time, so that unchanged files are not read again.
+"""
+import hashlib
+import json
+import os
+import threading
+from typing import BinaryIO, Iterator, Optional
+
+DEFAULT_MANIFEST_DIRECTORY = os.path.join("~", ".cache", "netunicorn", "uploads")
+
+_READ_SIZE = 1 << 20
+
+
+def file_digest(filepath: str) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    with open(filepath, "rb") as f:
+        while data := f.read(_READ_SIZE):
+            digest.update(data)
+    return "blake2b:" + digest.hexdigest()
+
+
+def open_file(filepath: str, streamed: Optional["StreamingDigest"] = None) -> BinaryIO:
+    """
+    Opens the file for reading, hashed by `streamed` if it is given.
+    """
+    file = open(filepath, "rb")
+    return file if streamed is None else streamed.reader(file)
+
+
+class StreamingDigest:
+    """
+    Digest of a file computed from the data an upload reads through `reader`, so that the file
+    is not read a second time. Data read again (e.g., after a retry) is hashed once.
+    """
+
+    def __init__(self):
+        self._hash = hashlib.blake2b(digest_size=20)
+        self.hashed = 0  # bytes hashed from the start of the file
+
+    def update(self, offset: int, data: bytes) -> None:
+        end = offset + len(data)
+        if offset <= self.hashed < end:
+            self._hash.update(memoryview(data)[self.hashed - offset :])
+            self.hashed = end
+
+    def reader(self, file: BinaryIO) -> "HashingReader":
+        return HashingReader(file, self)
+
+    def hexdigest(self, size: int) -> Optional[str]:
+        """
+        Returns the digest if exactly the `size` bytes of the file were read, None otherwise
+        (e.g., a resumed upload did not read the part sent by an earlier run).
+        """
+        if self.hashed != size:
+            return None
+        return "blake2b:" + self._hash.hexdigest()
+
+
+class HashingReader:
+    """
+    File object that passes the data read from `file` to a `StreamingDigest`.
+    Can be passed to ftplib, as request data to requests, or to `compression.CompressingReader`.
+    """
+
+    def __init__(self, file: BinaryIO, digest: StreamingDigest):
+        self._file = file
+        self._digest = digest
+
+    def read(self, size: int = -1) -> bytes:
+        offset = self._file.tell()
+        data = self._file.read(size)
+        self._digest.update(offset, data)
+        return data
+
+    def __iter__(self) -> Iterator[bytes]:
+        while data := self.read(_READ_SIZE):
+            yield data
+
+    def __getattr__(self, name: str):
+        # seek, tell, fileno, mode, ... of the file, requests uses them to find the length
+        return getattr(self._file, name)
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> "HashingReader":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+class UploadManifest:
+    """
+    Uploaded content of one endpoint, stored in `<manifest_directory>/<hash of the endpoint>.json`.
+    Can be used from several threads. `record` writes the manifest, so that uploads recorded
+    before an interruption are kept; other changes are written by `save`.
+
+    `variant` distinguishes uploads of the same content in different forms (e.g., compressed
+    with different algorithms), which are not interchangeable.
+    """
+
+    def __init__(self, endpoint: str, manifest_directory: Optional[str] = None):
+        directory = os.path.expanduser(manifest_directory or DEFAULT_MANIFEST_DIRECTORY)
+        name = hashlib.blake2b(endpoint.encode(), digest_size=16).hexdigest()
+        self.path = os.path.join(directory, name + ".json")
+        self.endpoint = endpoint
+        self._lock = threading.Lock()
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        # content key -> remote locations
+        self._locations: dict[str, list[str]] = data.get("locations", {})
+        # absolute path -> [size, mtime_ns, digest]
+        self._files: dict[str, list] = data.get("files", {})
+
+    def cached_digest(self, filepath: str) -> Optional[str]:
+        """
+        Returns the digest of the file if it did not change since it was last hashed, None otherwise.
+        """
+        path = os.path.abspath(filepath)
+        stat = os.stat(path)
+        with self._lock:
+            cached = self._files.get(path)
+        if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+            return cached[2]
+        return None
+
+    def digest(self, filepath: str) -> str:
+        """
+        Returns the digest of the file, reading it only if it changed since it was last hashed.
+        """
+        if digest := self.cached_digest(filepath):
+            return digest
+        stat = os.stat(filepath)
+        digest = file_digest(filepath)
+        self._cache(filepath, stat, digest)
+        return digest
+
+    def locations(self, digest: str, variant: str = "") -> list[str]:
+        with self._lock:
+            return list(self._locations.get(f"{digest}{variant}", []))
+
+    def record(self, digest: str, location: str, variant: str = "") -> None:
+        with self._lock:
+            locations = self._locations.setdefault(f"{digest}{variant}", [])
+            if location not in locations:
+                locations.append(location)
+        self.save()
+
+    def record_upload(
+        self,
+        filepath: str,
+        stat: os.stat_result,
+        streamed: StreamingDigest,
+        location: str,
+        variant: str = "",
+    ) -> None:
+        """
+        Records the file uploaded to the location, hashed by `streamed` while it was uploaded.
+        `stat` is the status of the file before the upload. The file is read again
+        only if the upload did not read all of it, nothing is recorded if it cannot be read.
+        """
+        digest = streamed.hexdigest(stat.st_size)
+        if digest is None:
+            try:
+                digest = self.digest(filepath)
+            except OSError:
+                return
+        else:
+            self._cache(filepath, stat, digest)
+        self.record(digest, location, variant)
+
+    def forget(self, location: str) -> None:
+        """
+        Removes a location that no longer has the recorded content (e.g., it was deleted).
+        """
+        with self._lock:
+            for locations in self._locations.values():
+                if location in locations:
+                    locations.remove(location)
+
+    def _cache(self, filepath: str, stat: os.stat_result, digest: str) -> None:
+        with self._lock:
+            self._files[os.path.abspath(filepath)] = [
+                stat.st_size,
+                stat.st_mtime_ns,
+                digest,
+            ]
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            data = {
+                "endpoint": self.endpoint,
+                "locations": {x: list(y) for x, y in self._locations.items() if y},
+                "files": dict(self._files),
+            }
+        # tasks on the node may save the same manifest concurrently
+        temporary = f"{self.path}.{os.getpid()}.{threading.get_ident()}"
+        with open(temporary, "w") as f:
+            json.dump(data, f)
+        os.replace(temporary, self.path)
@@ -1,17 +1,36 @@
 """
 Uploads files to file.io -- temporary file storage
 """
+import os
+from typing import Optional
+
 from netunicorn.base import Architecture, Node, Task, TaskDispatcher
 from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.library.tasks.upload.compression import (
+    SUFFIXES,
+    ZSTD_REQUIREMENT,
+    Compression,
+    available_algorithm,
+    run_with_compressed_input,
+)
 
 
 class UploadToFileIO(TaskDispatcher):
-    def __init__(self, filepath: str, expires: str = "14d", *args, **kwargs):
+    def __init__(
+        self,
+        filepath: str,
+        expires: str = "14d",
+        *args,
+        compression: Optional[Compression] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.linux_implementation = UploadToFileIOCurlImplementation(
-            filepath=filepath, expires=expires, name=self.name
+            filepath=filepath, expires=expires, compression=compression, name=self.name
         )
         self.linux_implementation.requirements = ["sudo apt-get install -y curl"]
+        if compression is not None and compression.algorithm == "zstd":
+            self.linux_implementation.add_requirement(ZSTD_REQUIREMENT)
 
     def dispatch(self, node: Node) -> Task:
         if node.architecture in {Architecture.LINUX_AMD64, Architecture.LINUX_ARM64}:
@@ -23,16 +42,42 @@ class UploadToFileIO(TaskDispatcher):
 
 
 class UploadToFileIOCurlImplementation(Task):
-    def __init__(self, filepath: str, expires: str = "14d", *args, **kwargs):
+    """
+    With `compression`, the file is compressed while curl reads it from its standard input
+    and `compression.CompressedCommandOutput` is returned.
+    """
+
+    def __init__(
+        self,
+        filepath: str,
+        expires: str = "14d",
+        *args,
+        compression: Optional[Compression] = None,
+        **kwargs,
+    ):
         super().__init__(*args, **kwargs)
         self.filepath = filepath
         self.expires = expires
+        self.compression = compression
 
     def run(self):
+        if self.compression is None:
+            command = [
+                "curl",
+                "-F",
+                f"file=@{self.filepath}",
+                f"https://file.io?expires={self.expires}",
+            ]
+            return subprocess_run(command)
+
+        filename = (
+            os.path.basename(self.filepath)
+            + SUFFIXES[available_algorithm(self.compression)]
+        )
         command = [
             "curl",
             "-F",
-            f"file=@{self.filepath}",
+            f"file=@-;filename={filename}",
             f"https://file.io?expires={self.expires}",
         ]
-        return subprocess_run(command)
+        return run_with_compressed_input(command, self.filepath, self.compression)
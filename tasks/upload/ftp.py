@@ -1,7 +1,49 @@
+import calendar
+import fnmatch
+import glob
 import os
-from ftplib import FTP, error_perm
+import posixpath
+import queue
+import time
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from ftplib import FTP, all_errors, error_perm
+from typing import Optional, Union
 
 from netunicorn.base import Failure, Result, Success, Task
+from netunicorn.library.tasks.upload.compression import (
+    SUFFIXES,
+    ZSTD_REQUIREMENT,
+    CompressingReader,
+    Compression,
+    CompressionStatistics,
+)
+from netunicorn.library.tasks.upload.dedup import (
+    StreamingDigest,
+    UploadManifest,
+    open_file,
+)
+from netunicorn.library.tasks.upload.resumable import (
+    DEFAULT_CHUNK_SIZE,
+    UploadState,
+    upload_resumable,
+)
+
+_BLOCK_SIZE = 1 << 20
+
+
+@dataclass
+class FTPTransfer:
+    local_filepath: str
+    remote_filepath: str
+    bytes: int  # bytes transferred, 0 if the file was skipped or the transfer failed
+    seconds: float
+    # the destination already has the same size and is not older, or the same content
+    skipped: bool = False
+    error: Optional[str] = None
+    resumed_from: int = 0  # bytes uploaded by an earlier run of a resumable upload
+    compression: Optional[CompressionStatistics] = None  # of a compressed upload
 
 
 class UploadToFTP(Task):
@@ -18,6 +60,11 @@ class UploadToFTP(Task):
         destination_dir: str = "/",
         timeout: int = 30,
         *args,
+        resumable: bool = False,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retries: int = 3,
+        state_directory: Optional[str] = None,
+        compression: Optional[Compression] = None,
         **kwargs,
     ):
         """
@@ -30,6 +77,11 @@ class UploadToFTP(Task):
           password (str): Password credential for FTP auth.
           destination_dir (str): Destination directory on the FTP server where the file will be uploaded to. Defaults to "/".
           timeout (int, optional): Timeout value for FTP connection measued in seconds. Defaults to 30 seconds.
+          resumable (bool, optional): Continue a partially uploaded file after a failure (with REST, or APPE if the server does not support REST) instead of uploading it again. Defaults to False.
+          chunk_size (int, optional): Bytes between saves of the upload state of a resumable upload. Defaults to 8 MiB.
+          retries (int, optional): Retries of a failed resumable upload. Defaults to 3.
+          state_directory (str, optional): Directory for the state of a resumable upload. Defaults to the directory of the file.
+          compression (Compression, optional): Compress the file while it is uploaded, the suffix of the algorithm (e.g., ".zst") is appended to the remote file name. Cannot be combined with `resumable`. Defaults to None.
         """
         super().__init__(*args, **kwargs)
         self.local_filepath = local_filepath
@@ -38,6 +90,16 @@ class UploadToFTP(Task):
         self.password = password
         self.destination_dir = destination_dir
         self.timeout = timeout
+        self.resumable = resumable
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.state_directory = state_directory
+        self.compression = compression
+        if compression is not None:
+            if resumable:
+                raise ValueError("Compressed uploads cannot be resumed")
+            if compression.algorithm == "zstd":
+                self.add_requirement(ZSTD_REQUIREMENT)
 
     def run(self) -> Result:
         """
@@ -51,7 +113,9 @@ class UploadToFTP(Task):
 
         Returns:
           Result:
-            Success: Contains a success message if successful upload.
+            Success: Contains a success message if successful upload, or `FTPTransfer` of the file
+              for a resumable or compressed upload, with the offset a resumable upload continued from
+              and the statistics of a compressed upload.
             --OR--
             Failure: Contains an error message if upload fails.
 
@@ -60,12 +124,51 @@ class UploadToFTP(Task):
             if not os.path.isfile(self.local_filepath):
                 return Failure(f"Local file does not exist: {self.local_filepath}")
 
+            remote_filepath = posixpath.join(
+                self.destination_dir or "/", os.path.basename(self.local_filepath)
+            )
+            if self.resumable:
+                upload = upload_resumable(
+                    self.local_filepath,
+                    f"{self.ftp_url}:{remote_filepath}",
+                    self._attempt,
+                    self.retries,
+                    self.state_directory,
+                )
+                return Success(
+                    FTPTransfer(
+                        self.local_filepath,
+                        remote_filepath,
+                        upload.sent,
+                        upload.seconds,
+                        resumed_from=upload.resumed_from,
+                    )
+                )
+
+            start = time.perf_counter()
             ftp = FTP(self.ftp_url, timeout=self.timeout)  # Modify timeout as needed
             ftp.login(user=self.username, passwd=self.password)
 
             if self.destination_dir:
                 ftp.cwd(self.destination_dir)
 
+            if self.compression is not None:
+                with CompressingReader(self.local_filepath, self.compression) as f:
+                    remote_filename = (
+                        os.path.basename(self.local_filepath) + SUFFIXES[f.algorithm]
+                    )
+                    ftp.storbinary(f"STOR {remote_filename}", f, _BLOCK_SIZE)
+                ftp.quit()
+                return Success(
+                    FTPTransfer(
+                        self.local_filepath,
+                        remote_filepath + SUFFIXES[f.algorithm],
+                        f.compressed_bytes,
+                        time.perf_counter() - start,
+                        compression=f.statistics(),
+                    )
+                )
+
             with open(self.local_filepath, "rb") as f:
                 remote_filename = os.path.basename(self.local_filepath)
                 ftp.storbinary(f"STOR {remote_filename}", f)
@@ -84,6 +187,61 @@ class UploadToFTP(Task):
         except Exception as e:
             return Failure(f"An unexpected error occurred: {str(e)}")
 
+    def _attempt(self, state: UploadState, checkpoint) -> None:
+        ftp = FTP(self.ftp_url, timeout=self.timeout)
+        try:
+            ftp.login(user=self.username, passwd=self.password)
+            if self.destination_dir:
+                ftp.cwd(self.destination_dir)
+            remote_filename = os.path.basename(self.local_filepath)
+
+            # the remote file is continued only if this upload has started it
+            offset = 0
+            if state.offset:
+                ftp.voidcmd("TYPE I")
+                try:
+                    offset = ftp.size(remote_filename) or 0
+                except error_perm:
+                    pass
+                if offset > state.size:
+                    offset = 0
+            checkpoint(offset)
+
+            sent = offset
+
+            def progress(block: bytes) -> None:
+                nonlocal sent
+                sent += len(block)
+                if sent - state.offset >= self.chunk_size:
+                    checkpoint(sent)
+
+            with open(self.local_filepath, "rb") as f:
+                f.seek(offset)
+                if not offset:
+                    ftp.storbinary(f"STOR {remote_filename}", f, _BLOCK_SIZE, progress)
+                else:
+                    try:
+                        ftp.storbinary(
+                            f"STOR {remote_filename}",
+                            f,
+                            _BLOCK_SIZE,
+                            progress,
+                            rest=offset,
+                        )
+                    except error_perm as e:
+                        # 500, 502, 504: REST is not supported, append instead
+                        if str(e)[:3] not in {"500", "502", "504"}:
+                            raise
+                        f.seek(offset)
+                        sent = offset
+                        ftp.storbinary(
+                            f"APPE {remote_filename}", f, _BLOCK_SIZE, progress
+                        )
+            checkpoint(state.size)
+            ftp.quit()
+        finally:
+            ftp.close()
+
 
 class RetrieveFromFTP(Task):
     """
@@ -167,3 +325,422 @@ class RetrieveFromFTP(Task):
 
         except Exception as e:
             return Failure(f"An unexpected error occurred: {str(e)}")
+
+
+def remote_listing(
+    ftp: FTP, directory: str = ""
+) -> Optional[dict[str, tuple[int, float]]]:
+    """
+    Returns the size and the modification time (UNIX timestamp) of the files in the remote directory
+    by name, listed with one MLSD command, or None if the server does not support MLSD.
+    """
+    try:
+        entries = list(ftp.mlsd(directory, facts=["type", "size", "modify"]))
+    except error_perm:
+        return None
+    return {
+        name: (int(facts.get("size", -1)), _parse_ftp_time(facts.get("modify")))
+        for name, facts in entries
+        if facts.get("type") == "file"
+    }
+
+
+def remote_stat(
+    ftp: FTP, name: str, listing: Optional[dict[str, tuple[int, float]]]
+) -> Optional[tuple[int, float]]:
+    """
+    Returns the size and the modification time of the remote file from the listing,
+    or with SIZE and MDTM if there is no listing. Returns None if the file does not exist.
+    """
+    if listing is not None:
+        return listing.get(posixpath.basename(name))
+    try:
+        ftp.voidcmd("TYPE I")
+        size = ftp.size(name)
+        modified = _parse_ftp_time(ftp.voidcmd(f"MDTM {name}").split()[-1])
+    except error_perm:
+        return None
+    return size, modified
+
+
+def _parse_ftp_time(value: Optional[str]) -> float:
+    # YYYYMMDDHHMMSS[.sss] in UTC, 0 if unknown
+    try:
+        return calendar.timegm(time.strptime(value[:14], "%Y%m%d%H%M%S"))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class _FTPBatch(Task, ABC):
+    """
+    Transfers files over up to `sessions` FTP connections, each logged in once
+    and transferring files from a shared queue until it is empty.
+    """
+
+    def __init__(
+        self,
+        ftp_url: str,
+        username: str,
+        password: str,
+        timeout: int = 30,
+        sessions: int = 1,
+        blocksize: int = _BLOCK_SIZE,
+        skip_existing: bool = True,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.ftp_url = ftp_url
+        self.username = username
+        self.password = password
+        self.timeout = timeout
+        self.sessions = max(1, sessions)
+        self.blocksize = blocksize
+        self.skip_existing = skip_existing
+
+    def _connect(self) -> FTP:
+        ftp = FTP(self.ftp_url, timeout=self.timeout)
+        ftp.login(user=self.username, passwd=self.password)
+        return ftp
+
+    def _run_batch(self, ftp: FTP, items: list[tuple]) -> dict[int, FTPTransfer]:
+        """
+        Runs `_transfer` for every (index, ...) item in the sessions,
+        the first of them being the already connected `ftp`, and returns the transfers by index.
+        An error of an item is reported in its transfer.
+        """
+        pending = queue.SimpleQueue()
+        for item in items:
+            pending.put(item)
+        results = {}
+
+        def work(connection: Optional[FTP]) -> None:
+            while True:
+                try:
+                    item = pending.get_nowait()
+                except queue.Empty:
+                    break
+                start = time.perf_counter()
+                try:
+                    if connection is None:
+                        connection = self._connect()
+                    results[item[0]] = self._transfer(connection, *item[1:])
+                except Exception as e:
+                    results[item[0]] = FTPTransfer(
+                        *self._paths(*item[1:]),
+                        0,
+                        time.perf_counter() - start,
+                        error=str(e),
+                    )
+                    if not isinstance(e, error_perm) and connection is not None:
+                        # the connection may be broken, the next file uses a new one
+                        connection.close()
+                        connection = None
+            if connection is not None:
+                try:
+                    connection.quit()
+                except all_errors:
+                    connection.close()
+
+        sessions = [ftp] + [None] * (min(self.sessions, len(items)) - 1)
+        with ThreadPoolExecutor(len(sessions)) as executor:
+            list(executor.map(work, sessions))
+        return results
+
+    @abstractmethod
+    def _transfer(self, ftp: FTP, *item) -> FTPTransfer:
+        """
+        Transfers the file of the item (without the index) over the connection.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def _paths(self, *item) -> tuple[str, str]:
+        """
+        Returns the local and the remote path of the file of the item.
+        """
+        raise NotImplementedError
+
+
+class UploadBatchToFTP(_FTPBatch):
+    """
+    Task for uploading many local files to a directory on an FTP server. Files are uploaded over one
+    logged in connection, or over up to `sessions` connections in parallel, instead of connecting
+    and logging in for every file.
+    """
+
+    def __init__(
+        self,
+        local_filepaths: Union[str, list[str]],
+        ftp_url: str,
+        username: str,
+        password: str,
+        destination_dir: str = "/",
+        timeout: int = 30,
+        sessions: int = 1,
+        blocksize: int = _BLOCK_SIZE,
+        skip_existing: bool = True,
+        deduplicate: bool = False,
+        manifest_directory: Optional[str] = None,
+        *args,
+        **kwargs,
+    ):
+        """
+        Initializes the UploadBatchToFTP task with parameters.
+
+        Parameters:
+          local_filepaths (str or list): Paths of local files to upload, or a glob pattern (e.g., "/tmp/capture*.pcap").
+          ftp_url (str): URL or IP address of FTP.
+          username (str): Username credential for FTP auth.
+          password (str): Password credential for FTP auth.
+          destination_dir (str): Destination directory on the FTP server where the files will be uploaded to. Defaults to "/".
+          timeout (int, optional): Timeout value for FTP connections measured in seconds. Defaults to 30 seconds.
+          sessions (int, optional): Maximal number of parallel FTP connections. Defaults to 1.
+          blocksize (int, optional): Size of the blocks files are sent in. Defaults to 1 MiB.
+          skip_existing (bool, optional): Skip files that exist on the server with the same size and are not older than the local files. Defaults to True.
+          deduplicate (bool, optional): Also skip files whose content was already uploaded to the same remote path from this node, regardless of their modification time (see `dedup.UploadManifest`). Defaults to False.
+          manifest_directory (str, optional): Directory of the manifests of uploaded content. Defaults to `dedup.DEFAULT_MANIFEST_DIRECTORY`.
+        """
+        super().__init__(
+            ftp_url,
+            username,
+            password,
+            timeout,
+            sessions,
+            blocksize,
+            skip_existing,
+            *args,
+            **kwargs,
+        )
+        self.local_filepaths = local_filepaths
+        self.destination_dir = destination_dir
+        self.deduplicate = deduplicate
+        self.manifest_directory = manifest_directory
+
+    def run(self) -> Result:
+        """
+        Uploads the local files to the FTP server.
+
+        Returns:
+          Result:
+            Success: Contains `FTPTransfer` of each file if all files were uploaded or skipped.
+            --OR--
+            Failure: Contains `FTPTransfer` of each file if any upload failed,
+              or an error message if the server is not available.
+        """
+        if isinstance(self.local_filepaths, str):
+            filepaths = sorted(glob.glob(self.local_filepaths))
+        else:
+            filepaths = list(self.local_filepaths)
+        check_remote = self.skip_existing or self.deduplicate
+        try:
+            ftp = self._connect()
+            listing = remote_listing(ftp) if check_remote else None
+        except all_errors as e:
+            return Failure(f"FTP connection failed: {e}")
+
+        manifest = None
+        if self.deduplicate:
+            manifest = UploadManifest(
+                f"ftp://{self.username}@{self.ftp_url}", self.manifest_directory
+            )
+        results = {}
+        items = []
+        for index, filepath in enumerate(filepaths):
+            if check_remote:
+                remote = remote_stat(ftp, os.path.basename(filepath), listing)
+                stat = os.stat(filepath)
+                skipped = (
+                    self.skip_existing
+                    and remote is not None
+                    and remote[0] == stat.st_size
+                    and remote[1] >= int(stat.st_mtime)
+                )
+                if manifest is not None and not skipped:
+                    # files that changed are hashed while they are uploaded
+                    digest = manifest.cached_digest(filepath)
+                    skipped = (
+                        digest is not None
+                        and remote is not None
+                        and remote[0] == stat.st_size
+                        and self._paths(filepath)[1] in manifest.locations(digest)
+                    )
+                if skipped:
+                    results[index] = FTPTransfer(
+                        *self._paths(filepath), 0, 0.0, skipped=True
+                    )
+                    continue
+            items.append((index, filepath, manifest))
+
+        results.update(self._run_batch(ftp, items))
+        transfers = [results[x] for x in range(len(filepaths))]
+        container_type = Success if all(x.error is None for x in transfers) else Failure
+        return container_type(transfers)
+
+    def _connect(self) -> FTP:
+        ftp = super()._connect()
+        if self.destination_dir:
+            ftp.cwd(self.destination_dir)
+        return ftp
+
+    def _paths(self, filepath: str, manifest=None) -> tuple[str, str]:
+        return filepath, posixpath.join(
+            self.destination_dir or "", os.path.basename(filepath)
+        )
+
+    def _transfer(
+        self, ftp: FTP, filepath: str, manifest: Optional[UploadManifest] = None
+    ) -> FTPTransfer:
+        start = time.perf_counter()
+        name = os.path.basename(filepath)
+        stat = os.stat(filepath)
+        streamed = StreamingDigest() if manifest is not None else None
+        with open_file(filepath, streamed) as f:
+            ftp.storbinary(f"STOR {name}", f, self.blocksize)
+            size = f.tell()
+        if manifest is not None:
+            manifest.record_upload(filepath, stat, streamed, self._paths(filepath)[1])
+        try:
+            # keep the modification time, so that the file is skipped next time
+            modified = time.strftime(
+                "%Y%m%d%H%M%S", time.gmtime(os.stat(filepath).st_mtime)
+            )
+            ftp.voidcmd(f"MFMT {modified} {name}")
+        except error_perm:
+            pass
+        return FTPTransfer(*self._paths(filepath), size, time.perf_counter() - start)
+
+
+class RetrieveBatchFromFTP(_FTPBatch):
+    """
+    Task for retrieving many files from an FTP server to a local directory. Files are downloaded over one
+    logged in connection, or over up to `sessions` connections in parallel, instead of connecting
+    and logging in for every file.
+    """
+
+    def __init__(
+        self,
+        ftp_remote_filepaths: Union[str, list[str]],
+        ftp_url: str,
+        username: str,
+        password: str,
+        local_dir: str = "./",
+        timeout: int = 30,
+        sessions: int = 1,
+        blocksize: int = _BLOCK_SIZE,
+        skip_existing: bool = True,
+        *args,
+        **kwargs,
+    ):
+        """
+        Initializes the RetrieveBatchFromFTP task with parameters.
+
+        Parameters:
+          ftp_remote_filepaths (str or list): Full paths of the files on the FTP server to retrieve, or a glob pattern of file names in a remote directory (e.g., "/captures/*.pcap").
+          ftp_url (str): URL or IP address of the FTP server.
+          username (str): Username for FTP authentication.
+          password (str): Password for FTP authentication.
+          local_dir (str, optional): Local directory to save the retrieved files. Defaults to "./".
+          timeout (int, optional): Timeout value for FTP connections measured in seconds. Defaults to 30 seconds.
+          sessions (int, optional): Maximal number of parallel FTP connections. Defaults to 1.
+          blocksize (int, optional): Size of the blocks files are received in. Defaults to 1 MiB.
+          skip_existing (bool, optional): Skip files that exist locally with the same size and are not older than the remote files. Defaults to True.
+        """
+        super().__init__(
+            ftp_url,
+            username,
+            password,
+            timeout,
+            sessions,
+            blocksize,
+            skip_existing,
+            *args,
+            **kwargs,
+        )
+        self.ftp_remote_filepaths = ftp_remote_filepaths
+        self.local_dir = local_dir
+
+    def run(self) -> Result:
+        """
+        Downloads the remote files to the local directory.
+
+        Returns:
+          Result:
+            Success: Contains `FTPTransfer` of each file if all files were downloaded or skipped.
+            --OR--
+            Failure: Contains `FTPTransfer` of each file if any download failed,
+              or an error message if the server is not available.
+        """
+        os.makedirs(self.local_dir, exist_ok=True)
+        try:
+            ftp = self._connect()
+            listings = {}
+            if isinstance(self.ftp_remote_filepaths, str):
+                directory, pattern = posixpath.split(self.ftp_remote_filepaths)
+                listing = remote_listing(ftp, directory)
+                names = (
+                    list(listing)
+                    if listing is not None
+                    else [posixpath.basename(x) for x in ftp.nlst(directory)]
+                )
+                listings[directory] = listing
+                remote_filepaths = sorted(
+                    posixpath.join(directory, x) for x in fnmatch.filter(names, pattern)
+                )
+            else:
+                remote_filepaths = list(self.ftp_remote_filepaths)
+                if self.skip_existing:
+                    for directory in {posixpath.dirname(x) for x in remote_filepaths}:
+                        listings[directory] = remote_listing(ftp, directory)
+        except all_errors as e:
+            return Failure(f"FTP connection failed: {e}")
+
+        results = {}
+        items = []
+        for index, remote_filepath in enumerate(remote_filepaths):
+            remote = None
+            if self.skip_existing:
+                remote = remote_stat(
+                    ftp,
+                    remote_filepath,
+                    listings.get(posixpath.dirname(remote_filepath)),
+                )
+                local_filepath = self._paths(remote_filepath)[0]
+                if remote is not None and os.path.exists(local_filepath):
+                    stat = os.stat(local_filepath)
+                    if stat.st_size == remote[0] and int(stat.st_mtime) >= remote[1]:
+                        results[index] = FTPTransfer(
+                            *self._paths(remote_filepath), 0, 0.0, skipped=True
+                        )
+                        continue
+            items.append((index, remote_filepath, remote))
+
+        results.update(self._run_batch(ftp, items))
+        transfers = [results[x] for x in range(len(remote_filepaths))]
+        container_type = Success if all(x.error is None for x in transfers) else Failure
+        return container_type(transfers)
+
+    def _paths(self, remote_filepath: str, remote=None) -> tuple[str, str]:
+        return (
+            os.path.join(self.local_dir, posixpath.basename(remote_filepath)),
+            remote_filepath,
+        )
+
+    def _transfer(self, ftp: FTP, remote_filepath: str, remote) -> FTPTransfer:
+        start = time.perf_counter()
+        local_filepath = self._paths(remote_filepath)[0]
+        with open(local_filepath, "wb") as f:
+            try:
+                ftp.retrbinary(f"RETR {remote_filepath}", f.write, self.blocksize)
+            except Exception:
+                # do not leave a partial file, it would be skipped next time
+                f.close()
+                os.remove(local_filepath)
+                raise
+            size = f.tell()
+        if remote is not None and remote[1]:
+            # keep the modification time, so that the file is skipped next time
+            os.utime(local_filepath, (time.time(), remote[1]))
+        return FTPTransfer(
+            local_filepath, remote_filepath, size, time.perf_counter() - start
+        )
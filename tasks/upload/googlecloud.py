@@ -1,15 +1,82 @@
 """
 Uploads files to Google Cloud Storage with optional OAuth token
 """
-from netunicorn.base import Architecture, Node, Task, TaskDispatcher
+import os
+import urllib.error
+import urllib.request
+from dataclasses import dataclass
+from typing import Any, Callable, Optional
+
+from netunicorn.base import (
+    Architecture,
+    Failure,
+    Node,
+    Result,
+    Success,
+    Task,
+    TaskDispatcher,
+)
 from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.library.tasks.upload.compression import (
+    SUFFIXES,
+    ZSTD_REQUIREMENT,
+    Compression,
+    available_algorithm,
+    run_with_compressed_input,
+    run_with_input,
+)
+from netunicorn.library.tasks.upload.dedup import (
+    StreamingDigest,
+    UploadManifest,
+    open_file,
+)
+from netunicorn.library.tasks.upload.resumable import (
+    DEFAULT_CHUNK_SIZE,
+    UploadState,
+    upload_resumable,
+)
+
+_STORAGE = "https://storage.googleapis.com"
+# chunks of a resumable upload, except the last one, must be multiples of 256 KiB
+_GCS_CHUNK_MULTIPLE = 256 << 10
+
+
+@dataclass
+class DeduplicatedUpload:
+    """
+    Result of a deduplicated upload (see `upload_deduplicated`).
+    """
+
+    filepath: str
+    url: str
+    # result of the upload (curl output, `compression.CompressedCommandOutput`
+    # or `resumable.ResumableUpload`), None if the object was skipped or copied
+    output: Any = None
+    skipped: bool = False  # the same content was already uploaded to the URL
+    copied_from: Optional[str] = None  # URL of the same content copied in Cloud Storage
+
 
 class UploadToGoogleCloudStorage(TaskDispatcher):
     """
     TaskDispatcher to upload a file to Google Cloud Storage.
     """
 
-    def __init__(self, local_filepath: str, bucket: str, target_filepath: str = "", auth_token: str = None, *args, **kwargs):
+    def __init__(
+        self,
+        local_filepath: str,
+        bucket: str,
+        target_filepath: str = "",
+        auth_token: str = None,
+        *args,
+        resumable: bool = False,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retries: int = 3,
+        state_directory: Optional[str] = None,
+        compression: Optional[Compression] = None,
+        deduplicate: bool = False,
+        manifest_directory: Optional[str] = None,
+        **kwargs,
+    ):
         """
         Initializes the UploadToGoogleCloudStorage TaskDispatcher.
 
@@ -18,13 +85,40 @@ class UploadToGoogleCloudStorage(TaskDispatcher):
             bucket (str): Name of the Google Cloud Storage bucket to upload to.
             target_filepath (str, optional): Path in the bucket where the file will be uploaded. Defaults to root directory ("").
             auth_token (str, optional): Google OAuth token used to authorize upload. Required to upload to a private bucket. Defaults to None.
+            resumable (bool, optional): Upload the file in chunks with a resumable upload session, see `UploadToGoogleCloudStorageResumableImplementation`. Defaults to False.
+            chunk_size (int, optional): Size of the chunks of a resumable upload, rounded down to a multiple of 256 KiB. Defaults to 8 MiB.
+            retries (int, optional): Retries of a failed resumable upload. Defaults to 3.
+            state_directory (str, optional): Directory for the state of a resumable upload. Defaults to the directory of the file.
+            compression (Compression, optional): Compress the file while it is uploaded, the suffix of the algorithm (e.g., ".zst") is appended to the target. Cannot be combined with `resumable`. Defaults to None.
+            deduplicate (bool, optional): Skip the upload if the same content was already uploaded from this node to the target and the object still exists, or copy an object with the same content in Cloud Storage instead of uploading it (see `dedup.UploadManifest`); the task then returns `DeduplicatedUpload`. Defaults to False.
+            manifest_directory (str, optional): Directory of the manifests of uploaded content. Defaults to `dedup.DEFAULT_MANIFEST_DIRECTORY`.
         """
 
         super().__init__(*args, **kwargs)
-        self.linux_implementation = UploadToGoogleCloudStorageCurlImplementation(
-            local_filepath=local_filepath, bucket=bucket, target_filepath=target_filepath, auth_token=auth_token, name=self.name
-        )
-        self.linux_implementation.requirements = ["sudo apt-get install -y curl"]
+        if resumable and compression is not None:
+            raise ValueError("Compressed uploads cannot be resumed")
+        if resumable:
+            self.linux_implementation = (
+                UploadToGoogleCloudStorageResumableImplementation(
+                    local_filepath=local_filepath,
+                    bucket=bucket,
+                    target_filepath=target_filepath,
+                    auth_token=auth_token,
+                    chunk_size=chunk_size,
+                    retries=retries,
+                    state_directory=state_directory,
+                    deduplicate=deduplicate,
+                    manifest_directory=manifest_directory,
+                    name=self.name,
+                )
+            )
+        else:
+            self.linux_implementation = UploadToGoogleCloudStorageCurlImplementation(
+                local_filepath=local_filepath, bucket=bucket, target_filepath=target_filepath, auth_token=auth_token, compression=compression, deduplicate=deduplicate, manifest_directory=manifest_directory, name=self.name
+            )
+            self.linux_implementation.requirements = ["sudo apt-get install -y curl"]
+            if compression is not None and compression.algorithm == "zstd":
+                self.linux_implementation.add_requirement(ZSTD_REQUIREMENT)
 
     def dispatch(self, node: Node) -> Task:
         """
@@ -45,14 +139,21 @@ class UploadToGoogleCloudStorageCurlImplementation(Task):
     Task to upload a file to Google Cloud Storage using cURL.
 
     Requirements: curl package is installed on the node.
+
+    With `compression`, the file is compressed while curl reads it from its standard input
+    and `compression.CompressedCommandOutput` is returned.
+    With `deduplicate`, the file is also piped to curl, so that it is hashed while it is uploaded.
     """
     
-    def __init__(self, local_filepath: str, bucket: str, target_filepath: str, auth_token: str, *args, **kwargs):
+    def __init__(self, local_filepath: str, bucket: str, target_filepath: str, auth_token: str, *args, compression: Optional[Compression] = None, deduplicate: bool = False, manifest_directory: Optional[str] = None, **kwargs):
         super().__init__(*args, **kwargs)
         self.local_filepath = local_filepath
         self.bucket = bucket
         self.target_filepath = target_filepath
         self.auth_token = auth_token
+        self.compression = compression
+        self.deduplicate = deduplicate
+        self.manifest_directory = manifest_directory
 
     def run(self):
         """
@@ -61,15 +162,255 @@ class UploadToGoogleCloudStorageCurlImplementation(Task):
         Returns: 
             Success or Failure, depending on if an error occurred. 
         """
+        suffix = ""
+        if self.compression is not None:
+            suffix = SUFFIXES[available_algorithm(self.compression)]
+        url = (
+            _object_url(self.bucket, self.target_filepath, self.local_filepath) + suffix
+        )
+        if not self.deduplicate:
+            return self._upload(url)
+        return upload_deduplicated(
+            self.local_filepath,
+            url,
+            suffix,
+            self.auth_token,
+            self.manifest_directory,
+            lambda streamed: self._upload(url, streamed),
+        )
 
+    def _upload(self, url: str, streamed: Optional[StreamingDigest] = None) -> Result:
+        # the file is piped to curl if it is compressed or hashed while it is read
+        piped = self.compression is not None or streamed is not None
         command = [
             "curl",
             "--fail",
             "-v",
             "--upload-file",
-            f"{self.local_filepath}",
+            "-" if piped else f"{self.local_filepath}",
         ]
         if self.auth_token is not None:
             command += ["-H", f"Authorization: Bearer {self.auth_token}"]
-        command.append(f"https://storage.googleapis.com/{self.bucket}/{self.target_filepath}")
-        return subprocess_run(command)
\ No newline at end of file
+        command.append(url)
+        if not piped:
+            return subprocess_run(command)
+        file = open_file(self.local_filepath, streamed)
+        if self.compression is None:
+            return run_with_input(command, file)
+        return run_with_compressed_input(command, file, self.compression)
+
+
+class UploadToGoogleCloudStorageResumableImplementation(Task):
+    """
+    Task to upload a file to Google Cloud Storage in chunks using a resumable upload session.
+
+    The session URL and the acknowledged offset are saved on disk (see `resumable.upload_resumable`),
+    so that a retry, or a rerun of the task after a failure, continues from the last chunk
+    received by Cloud Storage instead of uploading the whole file again.
+    Sessions expire after a week, an expired session is replaced by a new one.
+    """
+
+    requirements = ["pip install requests"]
+
+    def __init__(
+        self,
+        local_filepath: str,
+        bucket: str,
+        target_filepath: str = "",
+        auth_token: Optional[str] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retries: int = 3,
+        state_directory: Optional[str] = None,
+        timeout: float = 60,
+        deduplicate: bool = False,
+        manifest_directory: Optional[str] = None,
+        *args,
+        **kwargs,
+    ):
+        super().__init__(*args, **kwargs)
+        self.local_filepath = local_filepath
+        self.bucket = bucket
+        self.target_filepath = target_filepath
+        self.auth_token = auth_token
+        self.chunk_size = max(
+            _GCS_CHUNK_MULTIPLE, chunk_size - chunk_size % _GCS_CHUNK_MULTIPLE
+        )
+        self.retries = retries
+        self.state_directory = state_directory
+        self.timeout = timeout
+        self.deduplicate = deduplicate
+        self.manifest_directory = manifest_directory
+
+    def run(self):
+        url = _object_url(self.bucket, self.target_filepath, self.local_filepath)
+        if not self.deduplicate:
+            return self._upload(url)
+        return upload_deduplicated(
+            self.local_filepath,
+            url,
+            "",
+            self.auth_token,
+            self.manifest_directory,
+            lambda streamed: self._upload(url, streamed),
+        )
+
+    def _upload(self, url: str, streamed: Optional[StreamingDigest] = None) -> Result:
+        import requests
+
+        with requests.Session() as session:
+            try:
+                return Success(
+                    upload_resumable(
+                        self.local_filepath,
+                        url,
+                        lambda state, checkpoint: self._attempt(
+                            session, state, checkpoint, streamed
+                        ),
+                        self.retries,
+                        self.state_directory,
+                    )
+                )
+            except Exception as e:
+                return Failure(f"Upload of {self.local_filepath} to {url} failed: {e}")
+
+    def _attempt(
+        self,
+        session,
+        state: UploadState,
+        checkpoint,
+        streamed: Optional[StreamingDigest] = None,
+    ) -> None:
+        if state.session is not None:
+            # ask how much of the file was received before the failure
+            response = session.put(
+                state.session,
+                headers={"Content-Range": f"bytes */{state.size}"},
+                timeout=self.timeout,
+            )
+            if response.status_code in {200, 201}:
+                checkpoint(state.size)
+                return
+            if response.status_code == 308:
+                checkpoint(_acknowledged(response))
+            else:
+                # expired or unknown session
+                state.session = None
+                checkpoint(0)
+
+        if state.session is None:
+            headers = {"x-goog-resumable": "start"}
+            if self.auth_token is not None:
+                headers["Authorization"] = f"Bearer {self.auth_token}"
+            response = session.post(
+                state.destination, headers=headers, timeout=self.timeout
+            )
+            response.raise_for_status()
+            state.session = response.headers["Location"]
+            checkpoint(0)
+
+        with open_file(self.local_filepath, streamed) as f:
+            while True:
+                f.seek(state.offset)
+                data = f.read(self.chunk_size)
+                end = state.offset + len(data)
+                content_range = (
+                    f"bytes {state.offset}-{end - 1}/{state.size}"
+                    if data
+                    else f"bytes */{state.size}"
+                )
+                response = session.put(
+                    state.session,
+                    data=data,
+                    headers={"Content-Range": content_range},
+                    timeout=self.timeout,
+                )
+                if response.status_code != 308:
+                    response.raise_for_status()
+                    checkpoint(state.size)
+                    return
+                offset = _acknowledged(response)
+                if offset <= state.offset:
+                    raise RuntimeError(
+                        f"Chunk at offset {state.offset} was not received"
+                    )
+                checkpoint(offset)
+
+
+def _acknowledged(response) -> int:
+    # "Range: bytes=0-N" of a 308 response, no header if nothing was received yet
+    received = response.headers.get("Range")
+    return int(received.rsplit("-", 1)[1]) + 1 if received else 0
+
+
+def _object_url(bucket: str, target_filepath: str, local_filepath: str) -> str:
+    # as with curl --upload-file, the file name is appended to a target ending with "/"
+    if not target_filepath or target_filepath.endswith("/"):
+        target_filepath += os.path.basename(local_filepath)
+    return f"{_STORAGE}/{bucket}/{target_filepath}"
+
+
+def upload_deduplicated(
+    filepath: str,
+    url: str,
+    variant: str,
+    auth_token: Optional[str],
+    manifest_directory: Optional[str],
+    upload: Callable[[StreamingDigest], Result],
+) -> Result:
+    """
+    Skips the upload of the unchanged file to the object URL if its content was uploaded there
+    before and the object still exists, or copies an object with the same content within
+    Cloud Storage. Otherwise runs `upload`, which hashes the file with the given `StreamingDigest`
+    while it reads it, and records the content of the object if it succeeds.
+    Returns `DeduplicatedUpload` in all three cases, or the failure of `upload`.
+    """
+    manifest = UploadManifest(_STORAGE, manifest_directory)
+    stat = os.stat(filepath)
+    digest = manifest.cached_digest(filepath)
+    # the URL itself first, copies are needed only if it lacks the content
+    locations = manifest.locations(digest, variant) if digest else []
+    for location in sorted(locations, key=lambda x: x != url):
+        if location == url:
+            status = _request("HEAD", url, auth_token)
+            if status == 200:
+                return Success(DeduplicatedUpload(filepath, url, skipped=True))
+        else:
+            status = _request(
+                "PUT",
+                url,
+                auth_token,
+                {"x-goog-copy-source": location[len(_STORAGE) + 1 :]},
+            )
+            if status == 200:
+                manifest.record(digest, url, variant)
+                return Success(
+                    DeduplicatedUpload(filepath, url, copied_from=location)
+                )
+        if status == 404:
+            manifest.forget(location)
+
+    streamed = StreamingDigest()
+    result = upload(streamed)
+    if not isinstance(result, Success):
+        manifest.save()
+        return result
+    manifest.record_upload(filepath, stat, streamed, url, variant)
+    return Success(DeduplicatedUpload(filepath, url, result.unwrap()))
+
+
+def _request(
+    method: str, url: str, auth_token: Optional[str], headers: Optional[dict] = None
+) -> Optional[int]:
+    # returns the status code, or None if the request failed without a response
+    request = urllib.request.Request(
+        url, data=b"" if method == "PUT" else None, headers=headers or {}, method=method
+    )
+    if auth_token is not None:
+        request.add_header("Authorization", f"Bearer {auth_token}")
+    try:
+        with urllib.request.urlopen(request, timeout=60) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, OSError):
+        return None
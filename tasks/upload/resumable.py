@@ -0,0 +1,136 @@
+"""
+State of resumable uploads, persisted on disk between attempts.
+
+The state of a file is kept in `<state directory>/<file name>.upload` (by default, next to the file)
+while the file is being uploaded and removed when the upload is complete. A retry of the upload
+(in the same task or a later run) continues from the last offset acknowledged by the server,
+as long as the file and the destination are the same.
+"""
+import json
+import os
+import time
+from dataclasses import asdict, dataclass
+from typing import Callable, Optional
+
+DEFAULT_CHUNK_SIZE = 8 << 20
+STATE_SUFFIX = ".upload"
+
+
+@dataclass
+class UploadState:
+    filepath: str
+    destination: str  # URL or remote path the file is uploaded to
+    size: int  # size and modification time of the file when the upload was started
+    mtime_ns: int
+    offset: int = 0  # bytes acknowledged by the server
+    # protocol-specific session, e.g., resumable upload URL
+    session: Optional[str] = None
+
+
+@dataclass
+class ResumableUpload:
+    filepath: str
+    destination: str
+    bytes: int  # size of the file
+    sent: int  # bytes acknowledged during this task, excluding earlier runs
+    resumed_from: int  # offset this task started from
+    attempts: int
+    seconds: float
+
+
+def state_path(filepath: str, state_directory: Optional[str] = None) -> str:
+    directory = state_directory or os.path.dirname(os.path.abspath(filepath))
+    return os.path.join(directory, os.path.basename(filepath) + STATE_SUFFIX)
+
+
+def load_state(path: str, filepath: str, destination: str) -> UploadState:
+    """
+    Returns the saved state of the upload, or a new state if there is none or if it belongs
+    to another destination or to a different version of the file.
+    """
+    stat = os.stat(filepath)
+    try:
+        with open(path) as f:
+            state = UploadState(**json.load(f))
+    except (OSError, ValueError, TypeError):
+        state = None
+    if (
+        state is not None
+        and state.destination == destination
+        and state.size == stat.st_size
+        and state.mtime_ns == stat.st_mtime_ns
+    ):
+        return state
+    return UploadState(
+        os.path.abspath(filepath), destination, stat.st_size, stat.st_mtime_ns
+    )
+
+
+def save_state(path: str, state: UploadState) -> None:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        json.dump(asdict(state), f)
+    os.replace(path + ".tmp", path)
+
+
+def remove_state(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+# uploads the file from `state.offset`, first calling the checkpoint with the offset
+# it starts from (which it may correct from the server), and then with each new offset
+# acknowledged by the server
+Attempt = Callable[[UploadState, Callable[[int], None]], None]
+
+
+def upload_resumable(
+    filepath: str,
+    destination: str,
+    attempt: Attempt,
+    retries: int = 3,
+    state_directory: Optional[str] = None,
+    retry_delay: float = 1,
+) -> ResumableUpload:
+    """
+    Runs `attempt` until the file is uploaded, retrying up to `retries` times after errors.
+    The state is saved at every checkpoint, so that a failed task can be rerun
+    and continue from the last acknowledged offset. Raises the last error if all attempts fail.
+    """
+    path = state_path(filepath, state_directory)
+    state = load_state(path, filepath, destination)
+    resumed_from = None
+    sent = 0
+
+    def checkpoint(offset: int) -> None:
+        nonlocal resumed_from, sent
+        if resumed_from is None:
+            resumed_from = offset
+        else:
+            sent += max(0, offset - state.offset)
+        state.offset = offset
+        save_state(path, state)
+
+    start = time.perf_counter()
+    attempts = 0
+    while True:
+        attempts += 1
+        try:
+            attempt(state, checkpoint)
+            break
+        except Exception:
+            if attempts > retries:
+                raise
+            time.sleep(retry_delay * attempts)
+    remove_state(path)
+    return ResumableUpload(
+        filepath,
+        destination,
+        state.size,
+        sent,
+        resumed_from or 0,
+        attempts,
+        time.perf_counter() - start,
+    )
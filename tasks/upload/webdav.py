@@ -1,11 +1,65 @@
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from typing import Literal, Optional, Set
+from urllib.parse import quote
 
 from netunicorn.base import Architecture, Failure, Node, Success, Task, TaskDispatcher
 from netunicorn.library.tasks.tasks_utils import subprocess_run
+from netunicorn.library.tasks.upload.compression import (
+    SUFFIXES,
+    ZSTD_REQUIREMENT,
+    CompressingReader,
+    Compression,
+    available_algorithm,
+)
+from netunicorn.library.tasks.upload.dedup import (
+    StreamingDigest,
+    UploadManifest,
+    open_file,
+)
+from netunicorn.library.tasks.upload.resumable import (
+    DEFAULT_CHUNK_SIZE,
+    UploadState,
+    upload_resumable,
+)
+
+# responses to a PUT with Content-Range of servers that do not support it
+_RANGES_REJECTED = {400, 405, 416, 501}
+
+
+@dataclass
+class WebDavUpload:
+    filepath: str
+    url: str
+    bytes: int  # bytes sent, 0 if the upload failed
+    seconds: float
+    status_code: Optional[int] = None  # None if no response was received
+    error: Optional[str] = None
+    resumed_from: int = 0  # bytes uploaded by an earlier run of a resumable upload
+    compression_ratio: Optional[float] = None  # size of the file / bytes sent
+    skipped: bool = False  # the same content was already uploaded to the URL
+    copied_from: Optional[str] = None  # URL of the same content copied on the server
 
 
 class UploadToWebDav(TaskDispatcher):
+    """
+    Uploads files to `<endpoint>/<executor id>/<filepath>`.
+
+    The curl implementation (the default) runs `curl -T` for each file.
+    The native implementation uploads up to `parallelism` files at once over
+    keep-alive connections, creates each remote directory once, and returns
+    a `WebDavUpload` for every file. Its remote paths are URL-quoted and have no empty parts
+    (see `remote_path`), so they can differ from the curl ones for absolute or unusual filepaths.
+    Resumable, compressed and deduplicated uploads require the native implementation.
+    With `resumable`, files are uploaded in chunks of `chunk_size` bytes with ranged PUT requests
+    (see `UploadToWebDavNativeImplementation`). With `compression`, files are compressed
+    while they are uploaded and get the suffix of the algorithm (e.g., ".zst").
+    With `deduplicate`, content that was already uploaded from the node is not sent again
+    (see `dedup.UploadManifest`).
+    """
+
     def __init__(
         self,
         filepaths: Set[str],
@@ -14,6 +68,16 @@ class UploadToWebDav(TaskDispatcher):
         password: Optional[str] = None,
         authentication: Literal["basic"] = "basic",
         *args,
+        parallelism: int = 8,
+        timeout: float = 60,
+        implementation: Literal["native", "curl"] = "curl",
+        resumable: bool = False,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retries: int = 3,
+        state_directory: Optional[str] = None,
+        compression: Optional[Compression] = None,
+        deduplicate: bool = False,
+        manifest_directory: Optional[str] = None,
         **kwargs,
     ):
         if endpoint[-1] == "/":
@@ -26,15 +90,40 @@ class UploadToWebDav(TaskDispatcher):
 
         super().__init__(*args, **kwargs)
 
-        self.linux_implementation = UploadToWebDavImplementation(
-            self.filepaths,
-            self.endpoint,
-            self.username,
-            self.password,
-            self.authentication,
-            name=self.name,
-        )
-        self.linux_implementation.requirements = ["sudo apt-get install -y curl"]
+        if (
+            resumable or compression is not None or deduplicate
+        ) and implementation != "native":
+            raise ValueError(
+                'Resumable, compressed and deduplicated uploads require implementation="native"'
+            )
+        if implementation == "native":
+            self.linux_implementation = UploadToWebDavNativeImplementation(
+                self.filepaths,
+                self.endpoint,
+                self.username,
+                self.password,
+                self.authentication,
+                parallelism=parallelism,
+                timeout=timeout,
+                resumable=resumable,
+                chunk_size=chunk_size,
+                retries=retries,
+                state_directory=state_directory,
+                compression=compression,
+                deduplicate=deduplicate,
+                manifest_directory=manifest_directory,
+                name=self.name,
+            )
+        else:
+            self.linux_implementation = UploadToWebDavImplementation(
+                self.filepaths,
+                self.endpoint,
+                self.username,
+                self.password,
+                self.authentication,
+                name=self.name,
+            )
+            self.linux_implementation.requirements = ["sudo apt-get install -y curl"]
 
     def dispatch(self, node: Node) -> Task:
         if node.architecture in {Architecture.LINUX_AMD64, Architecture.LINUX_ARM64}:
@@ -72,5 +161,381 @@ class UploadToWebDavImplementation(Task):
             if self.authentication == "basic":
                 command += ["--user", f"{self.username}:{self.password}", "--basic"]
             results.append(subprocess_run(command))
-        container_type = Success if all(isinstance(x, Success) for x in results) else Failure
+        container_type = (
+            Success if all(isinstance(x, Success) for x in results) else Failure
+        )
         return container_type(results)
+
+
+class UploadToWebDavNativeImplementation(Task):
+    """
+    Uploads files with up to `parallelism` concurrent PUT requests sharing one HTTP session,
+    so that connections are reused between files. Remote directories are created
+    with MKCOL before the uploads, each of them once.
+
+    Resumable uploads send files in chunks with `Content-Range` headers and save
+    the acknowledged offset on disk (see `resumable.upload_resumable`), so that a retry continues
+    after the last chunk stored on the server. Files are uploaded whole if the server
+    rejects or ignores ranged PUT requests.
+
+    With `compression`, files are compressed while they are sent with chunked transfer encoding,
+    so compressed uploads cannot be resumed.
+
+    With `deduplicate`, files are hashed while they are sent and their digests are recorded
+    in a manifest of the endpoint on the node. An unchanged file whose content was already uploaded
+    to its URL is skipped if the URL still exists, and content uploaded to another URL is copied
+    there with the WebDAV COPY method.
+    """
+
+    requirements = ["pip install requests"]
+
+    def __init__(
+        self,
+        filepaths: Set[str],
+        endpoint: str,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        authentication: Literal["basic"] = "basic",
+        *args,
+        parallelism: int = 8,
+        timeout: float = 60,
+        resumable: bool = False,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        retries: int = 3,
+        state_directory: Optional[str] = None,
+        compression: Optional[Compression] = None,
+        deduplicate: bool = False,
+        manifest_directory: Optional[str] = None,
+        **kwargs,
+    ):
+        self.filepaths = filepaths
+        self.endpoint = endpoint
+        self.username = username
+        self.password = password
+        self.authentication = authentication
+        self.parallelism = max(1, parallelism)
+        self.timeout = timeout
+        self.resumable = resumable
+        self.chunk_size = chunk_size
+        self.retries = retries
+        self.state_directory = state_directory
+        self.compression = compression
+        self.deduplicate = deduplicate
+        self.manifest_directory = manifest_directory
+        super().__init__(*args, **kwargs)
+        if compression is not None:
+            if resumable:
+                raise ValueError("Compressed uploads cannot be resumed")
+            if compression.algorithm == "zstd":
+                self.add_requirement(ZSTD_REQUIREMENT)
+
+    def run(self):
+        import requests
+
+        executor_id = os.environ.get("NETUNICORN_EXECUTOR_ID") or "Unknown"
+        filepaths = sorted(self.filepaths)
+        suffix = ""
+        if self.compression is not None:
+            suffix = SUFFIXES[available_algorithm(self.compression)]
+        remote_paths = {x: remote_path(executor_id, x) + suffix for x in filepaths}
+        manifest = None
+        if self.deduplicate:
+            manifest = UploadManifest(self.endpoint, self.manifest_directory)
+
+        with requests.Session() as session:
+            adapter = requests.adapters.HTTPAdapter(
+                pool_connections=1, pool_maxsize=self.parallelism
+            )
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            if self.authentication == "basic" and self.username is not None:
+                session.auth = (self.username, self.password)
+
+            errors = make_collections(
+                session,
+                self.endpoint,
+                {y for x in remote_paths.values() for y in parent_collections(x)},
+                self.timeout,
+            )
+            if errors:
+                return Failure(errors)
+
+            with ThreadPoolExecutor(self.parallelism) as executor:
+                results = list(
+                    executor.map(
+                        lambda x: self._upload(
+                            session, x, remote_paths[x], manifest, suffix
+                        ),
+                        filepaths,
+                    )
+                )
+        if manifest is not None:
+            # locations forgotten since the last record
+            manifest.save()
+        container_type = Success if all(x.error is None for x in results) else Failure
+        return container_type(results)
+
+    def _upload(
+        self,
+        session,
+        filepath: str,
+        path: str,
+        manifest: Optional[UploadManifest] = None,
+        variant: str = "",
+    ) -> WebDavUpload:
+        url = f"{self.endpoint}/{path}"
+        if manifest is None:
+            return self._send(session, filepath, url)
+
+        start = time.perf_counter()
+        try:
+            stat = os.stat(filepath)
+            # files that changed are hashed while they are sent
+            digest = manifest.cached_digest(filepath)
+        except OSError as e:
+            return WebDavUpload(
+                filepath, url, 0, time.perf_counter() - start, error=str(e)
+            )
+        # the URL itself first, copies are needed only if it lacks the content
+        locations = manifest.locations(digest, variant) if digest else []
+        for location in sorted(locations, key=lambda x: x != url):
+            try:
+                if location == url:
+                    response = session.head(url, timeout=self.timeout)
+                    if response.ok:
+                        return WebDavUpload(
+                            filepath,
+                            url,
+                            0,
+                            time.perf_counter() - start,
+                            response.status_code,
+                            skipped=True,
+                        )
+                else:
+                    response = session.request(
+                        "COPY",
+                        location,
+                        headers={"Destination": url, "Overwrite": "T"},
+                        timeout=self.timeout,
+                    )
+                    if response.ok:
+                        manifest.record(digest, url, variant)
+                        return WebDavUpload(
+                            filepath,
+                            url,
+                            0,
+                            time.perf_counter() - start,
+                            response.status_code,
+                            copied_from=location,
+                        )
+            except Exception:
+                continue
+            if response.status_code == 404:
+                manifest.forget(location)
+
+        streamed = StreamingDigest()
+        result = self._send(session, filepath, url, streamed)
+        if result.error is None:
+            manifest.record_upload(filepath, stat, streamed, url, variant)
+        return result
+
+    def _send(
+        self,
+        session,
+        filepath: str,
+        url: str,
+        streamed: Optional[StreamingDigest] = None,
+    ) -> WebDavUpload:
+        if self.resumable:
+            return self._upload_resumable(session, filepath, url, streamed)
+        if self.compression is not None:
+            return self._upload_compressed(session, filepath, url, streamed)
+        start = time.perf_counter()
+        try:
+            with open_file(filepath, streamed) as f:
+                size = os.fstat(f.fileno()).st_size
+                response = session.put(
+                    url,
+                    data=f,
+                    headers={"Content-Length": str(size)},
+                    timeout=self.timeout,
+                )
+        except Exception as e:
+            return WebDavUpload(
+                filepath, url, 0, time.perf_counter() - start, error=str(e)
+            )
+        seconds = time.perf_counter() - start
+        if not response.ok:
+            return WebDavUpload(
+                filepath,
+                url,
+                0,
+                seconds,
+                response.status_code,
+                f"{response.status_code} {response.reason}",
+            )
+        return WebDavUpload(filepath, url, size, seconds, response.status_code)
+
+    def _upload_compressed(
+        self,
+        session,
+        filepath: str,
+        url: str,
+        streamed: Optional[StreamingDigest] = None,
+    ) -> WebDavUpload:
+        start = time.perf_counter()
+        try:
+            with CompressingReader(
+                open_file(filepath, streamed), self.compression
+            ) as reader:
+                response = session.put(url, data=reader, timeout=self.timeout)
+        except Exception as e:
+            return WebDavUpload(
+                filepath, url, 0, time.perf_counter() - start, error=str(e)
+            )
+        seconds = time.perf_counter() - start
+        if not response.ok:
+            return WebDavUpload(
+                filepath,
+                url,
+                0,
+                seconds,
+                response.status_code,
+                f"{response.status_code} {response.reason}",
+            )
+        return WebDavUpload(
+            filepath,
+            url,
+            reader.compressed_bytes,
+            seconds,
+            response.status_code,
+            compression_ratio=reader.statistics().ratio,
+        )
+
+    def _upload_resumable(
+        self,
+        session,
+        filepath: str,
+        url: str,
+        streamed: Optional[StreamingDigest] = None,
+    ) -> WebDavUpload:
+        start = time.perf_counter()
+        try:
+            upload = upload_resumable(
+                filepath,
+                url,
+                lambda state, checkpoint: self._attempt(
+                    session, filepath, state, checkpoint, streamed
+                ),
+                self.retries,
+                self.state_directory,
+            )
+        except Exception as e:
+            return WebDavUpload(
+                filepath, url, 0, time.perf_counter() - start, error=str(e)
+            )
+        return WebDavUpload(
+            filepath, url, upload.sent, upload.seconds, resumed_from=upload.resumed_from
+        )
+
+    def _attempt(
+        self,
+        session,
+        filepath: str,
+        state: UploadState,
+        checkpoint,
+        streamed: Optional[StreamingDigest] = None,
+    ) -> None:
+        url = state.destination
+        offset = state.offset
+        if offset:
+            # continue after the part that is actually stored on the server
+            response = session.head(url, timeout=self.timeout)
+            stored = (
+                int(response.headers.get("Content-Length", 0)) if response.ok else 0
+            )
+            offset = min(offset, stored)
+        checkpoint(offset)
+
+        with open_file(filepath, streamed) as f:
+            while state.offset < state.size:
+                f.seek(state.offset)
+                data = f.read(self.chunk_size)
+                end = state.offset + len(data)
+                if state.offset == 0 and end == state.size:
+                    response = session.put(url, data=data, timeout=self.timeout)
+                    response.raise_for_status()
+                    checkpoint(end)
+                    return
+                response = session.put(
+                    url,
+                    data=data,
+                    headers={
+                        "Content-Range": f"bytes {state.offset}-{end - 1}/{state.size}"
+                    },
+                    timeout=self.timeout,
+                )
+                if response.status_code in _RANGES_REJECTED or (
+                    response.ok
+                    and state.offset
+                    and not self._range_stored(session, url, end)
+                ):
+                    break
+                response.raise_for_status()
+                checkpoint(end)
+            else:
+                if state.size == 0:
+                    session.put(url, data=b"", timeout=self.timeout).raise_for_status()
+                return
+
+            # ranged PUT is not supported, upload the whole file
+            f.seek(0)
+            checkpoint(0)
+            response = session.put(
+                url,
+                data=f,
+                headers={"Content-Length": str(state.size)},
+                timeout=self.timeout,
+            )
+            response.raise_for_status()
+            checkpoint(state.size)
+
+    def _range_stored(self, session, url: str, end: int) -> bool:
+        # some servers ignore Content-Range and replace the file with the chunk
+        response = session.head(url, timeout=self.timeout)
+        return response.ok and response.headers.get("Content-Length") == str(end)
+
+
+def remote_path(executor_id: str, filepath: str) -> str:
+    """
+    Returns the URL-quoted path of the file relative to the endpoint: `<executor id>/<filepath>`.
+    """
+    parts = [x for x in filepath.split("/") if x not in {"", "."}]
+    return "/".join(quote(x) for x in [executor_id] + parts)
+
+
+def parent_collections(path: str) -> list[str]:
+    """
+    Returns the collections (directories) containing the path, outermost first.
+    """
+    parts = path.split("/")[:-1]
+    return ["/".join(parts[: i + 1]) for i in range(len(parts))]
+
+
+def make_collections(session, endpoint: str, collections: Set[str], timeout: float):
+    """
+    Creates the collections with MKCOL, parents before children.
+    Existing collections are skipped. Returns errors of the requests that failed.
+    """
+    errors = []
+    for collection in sorted(collections, key=lambda x: (x.count("/"), x)):
+        url = f"{endpoint}/{collection}/"
+        try:
+            response = session.request("MKCOL", url, timeout=timeout)
+        except Exception as e:
+            errors.append(f"MKCOL {url}: {e}")
+            continue
+        # 405 Method Not Allowed is returned if the collection already exists
+        if not response.ok and response.status_code != 405:
+            errors.append(f"MKCOL {url}: {response.status_code} {response.reason}")
+    return errors